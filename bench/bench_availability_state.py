@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Availability cache memory and throughput benchmark
+
+Records check results for many hosts/services in a dict availability cache (as record_availability
+does) and in the array backed AvailabilityState, then builds all the documents as a flush does.
+Each store runs in its own process to measure its peak memory once all the checks are recorded.
+Both stores must give the same documents.
+
+Usage: python bench/bench_availability_state.py [services] [checks per service]
+"""
+
+import os
+import sys
+import time
+import random
+import datetime
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from module.availability_state import AvailabilityState, STORE_DICT, STORE_ARRAY
+
+
+def dict_record(cache, query, hostname, service, state_id, last_chk, seconds_today, midnight_timestamp, in_downtime, day):
+    """
+    The record_availability dict cache update
+    """
+    if query in cache:
+        data = cache[query]
+        since_last_check = last_chk - data['last_check_timestamp']
+        if since_last_check > seconds_today:
+            data["daily_%d" % data['last_check_state']] = seconds_today
+        else:
+            data["daily_%d" % data['last_check_state']] += since_last_check
+    else:
+        data = {
+            'hostname': hostname, 'service': service, 'day': day, 'day_ts': midnight_timestamp,
+            'is_downtime': '1' if in_downtime else '0',
+            'daily_0': 0, 'daily_1': 0, 'daily_2': 0, 'daily_3': 0, 'daily_4': 0,
+            'first_check_state': state_id, 'first_check_timestamp': last_chk
+        }
+        cache[query] = data
+    data['daily_4'] = 86400
+    for value in [ data['daily_0'], data['daily_1'], data['daily_2'], data['daily_3'] ]:
+        data['daily_4'] -= int(value)
+    data['last_check_state'] = state_id
+    data['last_check_timestamp'] = last_chk
+
+
+def checks(services, count):
+    today = datetime.date.today()
+    day = today.strftime('%Y-%m-%d')
+    midnight_timestamp = int(time.mktime(datetime.datetime.combine(today, datetime.time.min).timetuple()))
+    rand = random.Random(0)
+    names = [('host-%05d' % (i / 10), 'Service-%d' % (i % 10)) for i in range(services)]
+    for c in range(count):
+        for hostname, service in names:
+            last_chk = midnight_timestamp + 60 + c * 60
+            yield ("""%s/%s_%s""" % (hostname, service, day), hostname, service, rand.randint(0, 3),
+                   last_chk, last_chk - midnight_timestamp, midnight_timestamp, False, day)
+
+
+def run(store, services, count):
+    """
+    Run the benchmark for a store, returns (records per second, documents per second, cache peak memory in KB, checksum)
+    """
+    cache = AvailabilityState() if store == STORE_ARRAY else {}
+    start = time.time()
+    for check in checks(services, count):
+        if store == STORE_ARRAY:
+            cache.record(*check[:-1])
+        else:
+            dict_record(cache, *check)
+    record_time = time.time() - start
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    if store == STORE_ARRAY:
+        docs = cache.documents(cache.keys())
+    else:
+        docs = cache.items()
+    documents_time = time.time() - start
+
+    checksum = sum([hash(tuple(sorted(doc.items()))) for query, doc in docs])
+    return (services * count / record_time, len(docs) / documents_time, memory, checksum)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        # Child process: one store
+        print "%f %f %d %d" % run(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+        sys.exit(0)
+
+    services = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    results = {}
+    for store in (STORE_DICT, STORE_ARRAY):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), store, str(services), str(count)])
+        records, documents, memory, checksum = output.split()
+        results[store] = (float(records), float(documents), int(memory), int(checksum))
+
+    print "%d hosts/services, %d checks each" % (services, count)
+    print "%-8s %14s %14s %14s" % ('store', 'checks/s', 'documents/s', 'cache memory')
+    for store in (STORE_DICT, STORE_ARRAY):
+        records, documents, memory, checksum = results[store]
+        print "%-8s %14.0f %14.0f %11d KB" % (store, records, documents, memory)
+    if results[STORE_DICT][3] != results[STORE_ARRAY][3]:
+        print "Different documents!"
+        sys.exit(1)
+    print "Same documents"
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Logs insertion durability benchmark
+
+Inserts batches of log documents in a scratch collection with each durability mode
+and reports the insertion latency and throughput. Requires a MongoDB server.
+
+Usage: python bench/bench_durability.py [uri] [batches] [batch size]
+"""
+
+import sys
+import time
+
+from pymongo import MongoClient
+from pymongo.write_concern import WriteConcern
+
+DURABILITY_MODES = [
+    ('fire_and_forget', {'w': 0}),
+    ('acknowledged', {'w': 1}),
+    ('journaled', {'w': 1, 'j': True}),
+    ('majority', {'w': 'majority'}),
+]
+
+
+def log_document(i):
+    return {
+        'logobject': 2, 'attempt': 1, 'logclass': 1, 'command_name': '', 'comment': '', 'contact_name': '',
+        'host_name': 'host-%04d' % (i % 1000), 'message': '[%d] SERVICE ALERT: ...' % (1441863951 + i), 'options': '',
+        'plugin_output': 'CRITICAL - benchmark line %d' % i, 'service_description': 'Service-%d' % (i % 20),
+        'state': 2, 'state_type': 'HARD', 'time': 1441863951 + i, 'type': 'SERVICE ALERT'
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def bench(db, mode, options, batches, batch_size, fsync=False):
+    collection = db.get_collection('bench_durability', write_concern=WriteConcern(**options))
+    collection.drop()
+    latencies = []
+    start = time.time()
+    for b in range(batches):
+        docs = [log_document(b * batch_size + i) for i in range(batch_size)]
+        now = time.time()
+        collection.insert_many(docs, ordered=False)
+        if fsync:
+            db.client.fsync(async=True)
+        latencies.append(time.time() - now)
+    elapsed = time.time() - start
+    collection.drop()
+    return {
+        'mode': mode + (' + fsync' if fsync else ''),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'lines_per_s': batches * batch_size / elapsed
+    }
+
+
+if __name__ == '__main__':
+    uri = sys.argv[1] if len(sys.argv) > 1 else 'mongodb://localhost'
+    batches = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+
+    db = MongoClient(uri).bench_mongo_logs
+    print "%-28s %10s %10s %12s" % ('mode', 'p50 (ms)', 'p99 (ms)', 'lines/s')
+    results = [bench(db, 'acknowledged', {'w': 1}, batches, batch_size, fsync=True)]
+    for mode, options in DURABILITY_MODES:
+        try:
+            results.append(bench(db, mode, options, batches, batch_size))
+        except Exception, exp:
+            print "%-28s failed: %s" % (mode, exp)
+    for r in results:
+        print "%-28s %10.2f %10.2f %12.0f" % (r['mode'], r['p50_ms'], r['p99_ms'], r['lines_per_s'])
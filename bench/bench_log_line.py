@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Log lines parsing micro benchmark
+
+Compares the table driven parser (parse_line) with the former if/elif parser
+and checks that both produce the same documents for every known line type.
+
+Usage: python bench/bench_log_line.py [lines count]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from module.log_line import (
+    parse_line, COLUMNS,
+    LOGCLASS_INFO, LOGCLASS_ALERT, LOGCLASS_PROGRAM, LOGCLASS_NOTIFICATION,
+    LOGCLASS_PASSIVECHECK, LOGCLASS_COMMAND, LOGCLASS_STATE, LOGCLASS_INVALID,
+    LOGOBJECT_INFO, LOGOBJECT_HOST, LOGOBJECT_SERVICE
+)
+
+SAMPLE_LINES = [
+    "[1441863951] CURRENT SERVICE STATE: srv-1;Load;OK;HARD;1;Load is fine",
+    "[1441863951] INITIAL SERVICE STATE: srv-1;Load;WARNING;SOFT;2;Load is high",
+    "[1441863951] SERVICE ALERT: srv-40;Service-9;CRITICAL;HARD;1;[Errno 2] No such file or directory",
+    "[1441863951] SERVICE DOWNTIME ALERT: srv-1;Load;STARTED;Service has entered a period of scheduled downtime",
+    "[1441863951] SERVICE FLAPPING ALERT: srv-1;Load;STARTED;Service appears to have started flapping",
+    "[1441863951] CURRENT HOST STATE: pi2;UP;HARD;1;PING OK",
+    "[1441863951] INITIAL HOST STATE: pi2;DOWN;SOFT;1;check_ping: Invalid hostname/address - pi2",
+    "[1441863951] HOST ALERT: pi2;DOWN;SOFT;1;check_ping: Invalid hostname/address - pi2",
+    "[1441863951] HOST DOWNTIME ALERT: pi2;STARTED;Host has entered a period of scheduled downtime",
+    "[1441863951] HOST FLAPPING ALERT: pi2;STOPPED;Host appears to have stopped flapping",
+    "[1441863951] SERVICE NOTIFICATION: admin;srv-1;Load;CRITICAL;notify-service-by-email;Load is critical",
+    "[1441863951] SERVICE NOTIFICATION: admin;srv-1;Load;DOWNTIMESTART (OK);notify-service-by-email;OK",
+    "[1441863951] HOST NOTIFICATION: admin;pi2;DOWN;notify-host-by-email;check_ping: Invalid hostname/address - pi2",
+    "[1441863951] HOST NOTIFICATION: admin;pi2;FLAPPINGSTART (UP);notify-host-by-email;PING OK",
+    "[1441863951] PASSIVE SERVICE CHECK: srv-1;Load;0;Load is fine",
+    "[1441863951] PASSIVE HOST CHECK: pi2;0;PING OK",
+    "[1441863951] SERVICE EVENT HANDLER: srv-1;Load;CRITICAL;SOFT;1;restart-service",
+    "[1441863951] HOST EVENT HANDLER: pi2;DOWN;SOFT;1;restart-host",
+    "[1441863951] EXTERNAL COMMAND: SCHEDULE_FORCED_HOST_CHECK;pi2;1441863951",
+    "[1441863951] TIMEPERIOD TRANSITION: 24x7;-1;1",
+    "[1441863993] INFO: [broker-master] We have our schedulers",
+    "[1441863993] WARNING: [broker-master] Connection lost",
+    "[1441863993] ERROR: [broker-master] Something failed",
+    "[1441863993] starting... (Shinken 2.4)",
+    "[1441863993] Warning: something to check",
+    "[1441863993] UNKNOWN LINE TYPE: whatever",
+    u"[1441863951] HOST ALERT: hété;UP;HARD;1;PING OK é  ",
+]
+
+
+def legacy_parse(line):
+    """The former Logline(line=line).as_dict() parser"""
+    if isinstance(line, unicode):
+        line = line.encode('UTF-8').rstrip()
+
+    service_states = {
+        'OK': 0,
+        'WARNING': 1,
+        'CRITICAL': 2,
+        'UNKNOWN': 3,
+        'RECOVERY': 0
+    }
+    host_states = {
+        'UP': 0,
+        'DOWN': 1,
+        'UNREACHABLE': 2,
+        'UNKNOWN': 3,
+        'RECOVERY': 0
+    }
+
+    logobject = LOGOBJECT_INFO
+    logclass = LOGCLASS_INVALID
+    attempt, state = [0] * 2
+    command_name, comment, contact_name, host_name, message, plugin_output, service_description, state_type = [''] * 8
+    time = line[1:11]
+    first_type_pos = line.find(' ') + 1
+    last_type_pos = line.find(':')
+    first_detail_pos = last_type_pos + 2
+    type = line[first_type_pos:last_type_pos]
+    options = line[first_detail_pos:]
+    message = line
+    if type == 'CURRENT SERVICE STATE':
+        logobject = LOGOBJECT_SERVICE
+        logclass = LOGCLASS_STATE
+        host_name, service_description, state, state_type, attempt, plugin_output = options.split(';', 5)
+    elif type == 'INITIAL SERVICE STATE':
+        logobject = LOGOBJECT_SERVICE
+        logclass = LOGCLASS_STATE
+        host_name, service_description, state, state_type, attempt, plugin_output = options.split(';', 5)
+    elif type == 'SERVICE ALERT':
+        logobject = LOGOBJECT_SERVICE
+        logclass = LOGCLASS_ALERT
+        host_name, service_description, state, state_type, attempt, plugin_output = options.split(';', 5)
+        state = service_states[state]
+    elif type == 'SERVICE DOWNTIME ALERT':
+        logobject = LOGOBJECT_SERVICE
+        logclass = LOGCLASS_ALERT
+        host_name, service_description, state_type, comment = options.split(';', 3)
+    elif type == 'SERVICE FLAPPING ALERT':
+        logobject = LOGOBJECT_SERVICE
+        logclass = LOGCLASS_ALERT
+        host_name, service_description, state_type, comment = options.split(';', 3)
+    elif type == 'CURRENT HOST STATE':
+        logobject = LOGOBJECT_HOST
+        logclass = LOGCLASS_STATE
+        host_name, state, state_type, attempt, plugin_output = options.split(';', 4)
+    elif type == 'INITIAL HOST STATE':
+        logobject = LOGOBJECT_HOST
+        logclass = LOGCLASS_STATE
+        host_name, state, state_type, attempt, plugin_output = options.split(';', 4)
+    elif type == 'HOST ALERT':
+        logobject = LOGOBJECT_HOST
+        logclass = LOGCLASS_ALERT
+        host_name, state, state_type, attempt, plugin_output = options.split(';', 4)
+        state = host_states[state]
+    elif type == 'HOST DOWNTIME ALERT':
+        logobject = LOGOBJECT_HOST
+        logclass = LOGCLASS_ALERT
+        host_name, state_type, comment = options.split(';', 2)
+    elif type == 'HOST FLAPPING ALERT':
+        logobject = LOGOBJECT_HOST
+        logclass = LOGCLASS_ALERT
+        host_name, state_type, comment = options.split(';', 2)
+    elif type == 'SERVICE NOTIFICATION':
+        logobject = LOGOBJECT_SERVICE
+        logclass = LOGCLASS_NOTIFICATION
+        contact_name, host_name, service_description, state_type, command_name, check_plugin_output = options.split(';', 5)
+        if '(' in state_type:
+            state_type = 'UNKNOWN'
+        state = service_states[state_type]
+    elif type == 'HOST NOTIFICATION':
+        logobject = LOGOBJECT_HOST
+        logclass = LOGCLASS_NOTIFICATION
+        contact_name, host_name, state_type, command_name, check_plugin_output = options.split(';', 4)
+        if '(' in state_type:
+            state_type = 'UNKNOWN'
+        state = host_states[state_type]
+    elif type == 'PASSIVE SERVICE CHECK':
+        logobject = LOGOBJECT_SERVICE
+        logclass = LOGCLASS_PASSIVECHECK
+        host_name, service_description, state, check_plugin_output = options.split(';', 3)
+    elif type == 'PASSIVE HOST CHECK':
+        logobject = LOGOBJECT_HOST
+        logclass = LOGCLASS_PASSIVECHECK
+        host_name, state, check_plugin_output = options.split(';', 2)
+    elif type == 'SERVICE EVENT HANDLER':
+        logobject = LOGOBJECT_SERVICE
+        logclass = LOGCLASS_NOTIFICATION
+        host_name, service_description, state, state_type, attempt, command_name = options.split(';', 5)
+        state = service_states[state]
+    elif type == 'HOST EVENT HANDLER':
+        logobject = LOGOBJECT_HOST
+        logclass = LOGCLASS_NOTIFICATION
+        host_name, state, state_type, attempt, command_name = options.split(';', 4)
+        state = host_states[state]
+    elif type == 'EXTERNAL COMMAND':
+        logobject = LOGOBJECT_INFO
+        logclass = LOGCLASS_COMMAND
+    elif type == 'TIMEPERIOD TRANSITION':
+        logobject = LOGOBJECT_INFO
+        logclass = LOGCLASS_PROGRAM
+    elif type == 'INFO' or type == 'WARNING' or type == 'ERROR':
+        logobject = LOGOBJECT_INFO
+        logclass = LOGCLASS_PROGRAM
+    elif type.startswith('starting...') or \
+         type.startswith('shutting down...') or \
+         type.startswith('Bailing out') or \
+         type.startswith('active mode...') or \
+         type.startswith('standby mode...') or \
+         type.startswith('Warning'):
+        logobject = LOGOBJECT_INFO
+        logclass = LOGCLASS_PROGRAM
+
+    values = {
+        'logobject': int(logobject),
+        'attempt': int(attempt),
+        'logclass': int(logclass),
+        'command_name': command_name,
+        'comment': comment,
+        'contact_name': contact_name,
+        'host_name': host_name,
+        'message': message,
+        'options': '',
+        'plugin_output': plugin_output,
+        'service_description': service_description,
+        'state': state,
+        'state_type': state_type,
+        'time': int(time),
+        'type': type
+    }
+    return dict(zip(COLUMNS, [values[col] for col in COLUMNS]))
+
+
+def check():
+    for line in SAMPLE_LINES:
+        expected = legacy_parse(line)
+        got = parse_line(line)
+        if got != expected:
+            print "Mismatch for: %r\n  expected: %s\n  got:      %s" % (line, expected, got)
+            return False
+    print "Same documents for the %d sample lines" % len(SAMPLE_LINES)
+    return True
+
+
+def bench(parser, lines):
+    start = time.time()
+    for line in lines:
+        parser(line)
+    return len(lines) / (time.time() - start)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    if not check():
+        sys.exit(1)
+
+    lines = (SAMPLE_LINES * (count / len(SAMPLE_LINES) + 1))[:count]
+    before = bench(legacy_parse, lines)
+    after = bench(parse_line, lines)
+    print "legacy parser:       %10.0f lines/s" % before
+    print "table driven parser: %10.0f lines/s (x%.2f)" % (after, after / before)
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Log documents size report
+
+Compares the BSON size of the full and compact schema log documents for the sample
+lines of every known line type, and checks that expanding a compact document gives
+back the full document.
+
+Usage: python bench/bench_log_schema.py [compression threshold]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bson
+
+from module.log_line import parse_line
+from module.compact import compact_document, expand_document
+from bench_log_line import SAMPLE_LINES
+
+LONG_OUTPUT = "CRITICAL - " + "; ".join(["/dev/sda%d used %d%%" % (i, 50 + i) for i in range(40)])
+
+
+def bson_size(doc):
+    return len(bson.BSON.encode(doc))
+
+
+if __name__ == '__main__':
+    threshold = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+
+    lines = list(SAMPLE_LINES)
+    lines.append("[1441863951] SERVICE ALERT: srv-1;Disks;CRITICAL;HARD;3;%s" % LONG_OUTPUT)
+
+    full_total = compact_total = 0
+    print "%-26s %6s %8s" % ('type', 'full', 'compact')
+    for line in lines:
+        doc = parse_line(line)
+        compact = compact_document(doc, threshold)
+        expanded = expand_document(compact)
+        if expanded != doc:
+            print "Expansion mismatch for: %r\n  expected: %s\n  got:      %s" % (line, doc, expanded)
+            sys.exit(1)
+        full_size, compact_size = bson_size(doc), bson_size(compact)
+        full_total += full_size
+        compact_total += compact_size
+        print "%-26s %6d %8d" % (doc['type'][:26], full_size, compact_size)
+
+    print "Average bytes per document: full %.0f, compact %.0f (%.0f%%)" % (
+        full_total / float(len(lines)), compact_total / float(len(lines)), 100.0 * compact_total / full_total)
@@ -0,0 +1,344 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Broker module pipeline benchmark
+
+Generates a synthetic brok stream (initial hosts/services status, check results every
+check interval with random state changes, log broks of every known log line type) and
+drives the module hot paths with it:
+  parse         Logline parsing of the log broks lines
+  manage_broks  MongoLogs.manage_broks with batches of broks, as received from the broker
+  commit_logs   MongoLogs.commit_logs until the logs cache is empty
+  availability  MongoLogs.record_availability for the check results
+
+Each scenario reports its throughput, p50/p99 latency (per batch or per call) and the process
+peak memory. Results are printed as JSON, and compared with a previous run with --compare.
+
+The DB is an in-process stand-in (mongomock://, requires mongomock) or a MongoDB server,
+in which case a scratch database is used and dropped. Requires Shinken.
+
+Usage: python bench/bench_pipeline.py [options]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import resource
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from shinken.brok import Brok
+from shinken.objects.module import Module
+from shinken.log import logger
+
+from module.module import MongoLogs, CONNECTED
+from module.log_line import Logline
+
+from bench_log_line import SAMPLE_LINES
+
+SERVICE_STATES = ['OK', 'WARNING', 'CRITICAL', 'UNKNOWN']
+HOST_STATES = ['UP', 'DOWN', 'UNREACHABLE', 'UNKNOWN']
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def peak_memory():
+    """
+    Process peak resident memory, in KB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class BrokStream(object):
+    """
+    Synthetic brok stream of a monitored configuration
+    """
+
+    def __init__(self, hosts, services, check_interval, duration, state_change, logs_per_check, seed=0):
+        self.hosts = ['host-%05d' % i for i in range(hosts)]
+        self.services = ['Service-%d' % i for i in range(services)]
+        self.check_interval = check_interval
+        self.duration = duration
+        self.state_change = state_change
+        self.logs_per_check = logs_per_check
+        self.random = random.Random(seed)
+        # The simulated period ends now, the availability is recorded for today
+        self.start = int(time.time()) - duration
+
+    def initial_broks(self):
+        broks = []
+        for host in self.hosts:
+            broks.append(Brok('initial_host_status', {
+                'host_name': host, 'business_impact': 2, 'hostgroups': ['all']
+            }))
+            for service in self.services:
+                broks.append(Brok('initial_service_status', {
+                    'host_name': host, 'service_description': service, 'business_impact': 2
+                }))
+        broks.append(Brok('initial_broks_done', {'instance_id': 0}))
+        return broks
+
+    def check_data(self, host, service, state_id, last_state_id, timestamp):
+        states = SERVICE_STATES if service else HOST_STATES
+        data = {
+            'host_name': host,
+            'state': states[state_id], 'state_id': state_id,
+            'last_state': states[last_state_id], 'last_state_id': last_state_id,
+            'state_type': 'HARD', 'last_chk': timestamp, 'in_scheduled_downtime': False,
+            'output': '%s - synthetic check' % states[state_id]
+        }
+        if service:
+            data['service_description'] = service
+        return data
+
+    def log_line(self, timestamp, line=None):
+        """
+        A sample log line, of a random type, at a timestamp
+        """
+        if line is None:
+            line = self.random.choice(SAMPLE_LINES)
+        return u'[%d]%s' % (timestamp, line[line.index(']') + 1:])
+
+    def broks(self):
+        """
+        Generate the check results and log broks, in time order
+        """
+        objects = [(host, '') for host in self.hosts]
+        objects.extend([(host, service) for host in self.hosts for service in self.services])
+        states = dict([(obj, 0) for obj in objects])
+
+        for tick in range(0, self.duration, self.check_interval):
+            for i, (host, service) in enumerate(objects):
+                timestamp = self.start + tick + i * self.check_interval / len(objects)
+                last_state_id = states[(host, service)]
+                state_id = last_state_id
+                if self.random.random() < self.state_change:
+                    state_id = self.random.randint(0, 2 if service else 1)
+                    states[(host, service)] = state_id
+                    if service:
+                        line = u'[%d] SERVICE ALERT: %s;%s;%s;HARD;1;%s - synthetic check' % (
+                            timestamp, host, service, SERVICE_STATES[state_id], SERVICE_STATES[state_id])
+                    else:
+                        line = u'[%d] HOST ALERT: %s;%s;HARD;1;%s - synthetic check' % (
+                            timestamp, host, HOST_STATES[state_id], HOST_STATES[state_id])
+                    yield Brok('log', {'log': line})
+
+                brok_type = 'service_check_result' if service else 'host_check_result'
+                yield Brok(brok_type, self.check_data(host, service, state_id, last_state_id, timestamp))
+
+                if self.logs_per_check and self.random.random() < self.logs_per_check:
+                    yield Brok('log', {'log': self.log_line(timestamp)})
+
+    def batches(self, size):
+        batch = []
+        for brok in self.broks():
+            batch.append(brok)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def get_module(uri, database, options=None):
+    """
+    Get a module connected to the DB of the URI, a mongomock:// URI gets an in-process stand-in
+
+    options are more module configuration parameters
+    """
+    params = {
+        'module_name': 'bench-mongo-logs', 'module_type': 'mongo-logs',
+        'uri': uri, 'database': database, 'services_filter': '.*', 'create_indexes': '0',
+        'commit_volume': '1000'
+    }
+    params.update(options or {})
+    mod_conf = Module(params)
+    mod = MongoLogs(mod_conf)
+    if uri.startswith('mongomock://'):
+        import mongomock
+        mod.con = mongomock.MongoClient()
+        mod.db = mod.con[database]
+        mod.is_connected = CONNECTED
+    elif not mod.open(wait=True):
+        raise Exception("Can not connect to %s" % uri)
+    return mod
+
+
+def result(name, count, elapsed, latencies, unit):
+    return {
+        'scenario': name,
+        'count': count,
+        'elapsed_s': elapsed,
+        'per_s': count / elapsed if elapsed else 0.0,
+        'unit': unit,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_memory_kb': peak_memory()
+    }
+
+
+def bench_parse(stream, batch_size):
+    # Every known line type, and the lines of the stream
+    lines = [stream.log_line(stream.start, line) for line in SAMPLE_LINES]
+    for batch in stream.batches(batch_size):
+        for b in batch:
+            if b.type == 'log':
+                b.prepare()
+                lines.append(b.data['log'])
+    latencies = []
+    start = time.time()
+    for i in range(0, len(lines), batch_size):
+        now = time.time()
+        for line in lines[i:i + batch_size]:
+            try:
+                Logline(line=line)
+            except Exception:
+                pass
+        latencies.append(time.time() - now)
+    return result('parse', len(lines), time.time() - start, latencies, 'lines')
+
+
+def bench_manage_broks(mod, stream, batch_size):
+    mod.manage_broks(stream.initial_broks())
+    count = 0
+    latencies = []
+    start = time.time()
+    for batch in stream.batches(batch_size):
+        now = time.time()
+        mod.manage_broks(batch)
+        latencies.append(time.time() - now)
+        count += len(batch)
+    return result('manage_broks', count, time.time() - start, latencies, 'broks')
+
+
+def bench_commit_logs(mod):
+    count = len(mod.logs_cache)
+    latencies = []
+    start = time.time()
+    while mod.logs_cache:
+        now = time.time()
+        mod.commit_logs()
+        latencies.append(time.time() - now)
+    return result('commit_logs', count, time.time() - start, latencies, 'lines')
+
+
+def bench_availability(mod, stream, batch_size):
+    mod.availability_cache = {}
+    checks = []
+    for batch in stream.batches(batch_size):
+        for b in batch:
+            if b.type in ('host_check_result', 'service_check_result'):
+                b.prepare()
+                checks.append(b)
+    latencies = []
+    start = time.time()
+    for b in checks:
+        now = time.time()
+        mod.record_availability(b.data['host_name'], b.data.get('service_description', ''), b)
+        latencies.append(time.time() - now)
+    mod.flush_availability()
+    return result('availability', len(checks), time.time() - start, latencies, 'checks')
+
+
+def compare(results, previous):
+    previous = dict([(r['scenario'], r) for r in previous['results']])
+    print >> sys.stderr, "%-14s %12s %12s %10s %10s" % ('scenario', 'per_s', 'previous', 'ratio', 'p99 ratio')
+    for r in results['results']:
+        p = previous.get(r['scenario'])
+        if not p:
+            continue
+        print >> sys.stderr, "%-14s %12.0f %12.0f %10.2f %10.2f" % (
+            r['scenario'], r['per_s'], p['per_s'],
+            r['per_s'] / p['per_s'] if p['per_s'] else 0.0,
+            r['p99_ms'] / p['p99_ms'] if p['p99_ms'] else 0.0)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]", description="Benchmark the mongo-logs broker module hot paths")
+    parser.add_option('-u', '--uri', default='mongomock://',
+                      help="MongoDB connection string, mongomock:// for an in-process stand-in [%default]")
+    parser.add_option('-d', '--database', default='bench_mongo_logs', help="scratch database name [%default]")
+    parser.add_option('--hosts', type='int', default=100, help="hosts count [%default]")
+    parser.add_option('--services', type='int', default=10, help="services per host [%default]")
+    parser.add_option('--check-interval', type='int', default=60, help="check interval, in seconds [%default]")
+    parser.add_option('--duration', type='int', default=600, help="simulated period, in seconds [%default]")
+    parser.add_option('--state-change', type='float', default=0.05, help="state change probability per check [%default]")
+    parser.add_option('--logs-per-check', type='float', default=0.2, help="other log lines per check [%default]")
+    parser.add_option('-b', '--batch', type='int', default=100, help="broks per batch [%default]")
+    parser.add_option('-s', '--scenarios', default='parse,manage_broks,commit_logs,availability',
+                      help="comma separated scenarios [%default]")
+    parser.add_option('-o', '--output', default=None, help="write the JSON results in this file")
+    parser.add_option('-c', '--compare', default=None, help="compare with the JSON results of a previous run")
+    opts, args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+
+    def stream():
+        return BrokStream(opts.hosts, opts.services, opts.check_interval, opts.duration,
+                          opts.state_change, opts.logs_per_check)
+
+    scenarios = opts.scenarios.split(',')
+    mod = get_module(opts.uri, opts.database)
+    results = []
+    try:
+        if 'parse' in scenarios:
+            results.append(bench_parse(stream(), opts.batch))
+        if 'manage_broks' in scenarios or 'commit_logs' in scenarios:
+            r = bench_manage_broks(mod, stream(), opts.batch)
+            if 'manage_broks' in scenarios:
+                results.append(r)
+        if 'commit_logs' in scenarios:
+            results.append(bench_commit_logs(mod))
+        if 'availability' in scenarios:
+            if not mod.services_cache:
+                mod.manage_broks(stream().initial_broks())
+            results.append(bench_availability(mod, stream(), opts.batch))
+    finally:
+        mod.con.drop_database(opts.database)
+
+    output = {
+        'time': time.time(),
+        'python': sys.version.split()[0],
+        'uri': opts.uri,
+        'options': dict([(k, v) for k, v in vars(opts).items() if k not in ('output', 'compare')]),
+        'results': results
+    }
+    print json.dumps(output, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if opts.compare:
+        with open(opts.compare) as f:
+            compare(output, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
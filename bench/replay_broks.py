@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Broks capture replay
+
+Feeds the broks of a capture file (brok_capture_file module parameter) to a fresh module
+instance, batch by batch as they were received, and runs the module periodic tasks (logs
+commit, availability flush) as its main loop does:
+  --speed 1   replay at the capture pace
+  --speed N   replay N times faster than the capture
+  --speed 0   replay as fast as possible
+
+Reports the throughput, the lag behind the scaled capture timeline (p50/p99/max, meaningful
+when the replay is paced) and a digest of the final DB state (documents count and hash of each
+collection, without the documents ids). The digests of two replays (other speed, other module
+parameters with --option) are compared with --compare.
+
+The DB is an in-process stand-in (mongomock://, requires mongomock) or a MongoDB server,
+in which case a scratch database is used and dropped. Requires Shinken.
+
+Usage: python bench/replay_broks.py [options] capture_file
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from shinken.brok import Brok
+from shinken.log import logger
+
+from module.capture import read_capture
+
+from bench_pipeline import get_module, percentile, peak_memory
+
+
+def captured_batches(filename):
+    """
+    Iterate over the captured batches: (receive time, broks), the broks are built unprepared
+    (data still pickled) as the broker module receives them
+    """
+    for record in read_capture(filename):
+        if isinstance(record, dict):
+            # Capture session header
+            continue
+        received, broks = record
+        batch = []
+        for brok_type, data, instance_id in broks:
+            b = Brok(brok_type, {})
+            b.data = data
+            if instance_id is not None:
+                b.instance_id = instance_id
+            batch.append(b)
+        yield received, batch
+
+
+def db_digest(db):
+    """
+    Get the documents count and a hash of the documents of each collection, the ids are ignored
+    """
+    digest = {}
+    for name in sorted(db.collection_names()):
+        if name.startswith('system.'):
+            continue
+        docs = []
+        for doc in db[name].find():
+            doc.pop('_id', None)
+            docs.append(json.dumps(doc, sort_keys=True, default=str))
+        docs.sort()
+        digest[name] = {'count': len(docs), 'hash': hashlib.sha1('\n'.join(docs)).hexdigest()}
+    return digest
+
+
+def replay(mod, filename, speed):
+    """
+    Replay a capture file with a module, returns the replay statistics
+    """
+    count = 0
+    batches = 0
+    lags = []
+    latencies = []
+    first = None
+    start = time.time()
+    commit_next_time = start + mod.commit_period
+    for received, batch in captured_batches(filename):
+        if first is None:
+            first = received
+        due = start + (received - first) / speed if speed else start
+        now = time.time()
+        if due > now:
+            time.sleep(due - now)
+            now = time.time()
+        lags.append(max(0.0, now - due))
+
+        mod.manage_broks(batch)
+        latencies.append(time.time() - now)
+        count += len(batch)
+        batches += 1
+
+        # Module main loop periodic tasks
+        now = time.time()
+        if commit_next_time < now:
+            commit_next_time = now + mod.commit_period
+            mod.commit_logs()
+            mod.flush_availability()
+        elif mod.commit_due(now):
+            mod.commit_logs()
+        mod.rollover_availability()
+
+    # Store everything
+    while mod.logs_cache:
+        mod.commit_logs()
+    mod.flush_availability()
+    elapsed = time.time() - start
+
+    return {
+        'broks': count,
+        'batches': batches,
+        'captured_s': (received - first) if first is not None else 0.0,
+        'elapsed_s': elapsed,
+        'per_s': count / elapsed if elapsed else 0.0,
+        'batch_p50_ms': percentile(latencies, 50) * 1000,
+        'batch_p99_ms': percentile(latencies, 99) * 1000,
+        'lag_p50_s': percentile(lags, 50),
+        'lag_p99_s': percentile(lags, 99),
+        'lag_max_s': max(lags) if lags else 0.0,
+        'peak_memory_kb': peak_memory()
+    }
+
+
+def compare(output, previous):
+    """
+    Compare the DB digests of two replays, returns True if the DB states are the same
+    """
+    same = True
+    names = sorted(set(output['db']) | set(previous['db']))
+    print >> sys.stderr, "%-24s %10s %10s %6s" % ('collection', 'count', 'previous', 'same')
+    for name in names:
+        current, other = output['db'].get(name), previous['db'].get(name)
+        equal = current == other
+        same = same and equal
+        print >> sys.stderr, "%-24s %10s %10s %6s" % (name, current['count'] if current else '-',
+                                                      other['count'] if other else '-', 'yes' if equal else 'NO')
+    print >> sys.stderr, "throughput: %.0f broks/s, previous: %.0f broks/s" % (output['replay']['per_s'], previous['replay']['per_s'])
+    return same
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] capture_file", description="Replay a broks capture with the mongo-logs broker module")
+    parser.add_option('-u', '--uri', default='mongomock://',
+                      help="MongoDB connection string, mongomock:// for an in-process stand-in [%default]")
+    parser.add_option('-d', '--database', default='replay_mongo_logs', help="scratch database name [%default]")
+    parser.add_option('-s', '--speed', type='float', default=0,
+                      help="replay speed, 1 for the capture pace, N for N times faster, 0 for max speed [%default]")
+    parser.add_option('--option', action='append', default=[],
+                      help="module parameter, as name=value (repeatable)")
+    parser.add_option('-k', '--keep', action='store_true', default=False, help="do not drop the scratch database")
+    parser.add_option('-o', '--output', default=None, help="write the JSON results in this file")
+    parser.add_option('-c', '--compare', default=None, help="compare with the JSON results of a previous replay")
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("a capture file is required")
+
+    logger.setLevel(logging.WARNING)
+
+    options = dict([option.split('=', 1) for option in opts.option])
+    mod = get_module(opts.uri, opts.database, options)
+    try:
+        stats = replay(mod, args[0], opts.speed)
+        digest = db_digest(mod.db)
+    finally:
+        if not opts.keep:
+            mod.con.drop_database(opts.database)
+
+    output = {
+        'time': time.time(),
+        'python': sys.version.split()[0],
+        'uri': opts.uri,
+        'capture': os.path.abspath(args[0]),
+        'speed': opts.speed,
+        'options': options,
+        'replay': stats,
+        'db': digest
+    }
+    print json.dumps(output, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if opts.compare:
+        with open(opts.compare) as f:
+            if not compare(output, json.load(f)):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
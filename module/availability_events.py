@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Event sourced availability.
+
+Instead of rewriting the daily availability document of a host/service on each check result,
+one small event document is stored when its state or its downtime status changes:
+
+    {'_id': 'host/service_timestamp_previous_current', 'hostname', 'service', 'timestamp', 'state', 'downtime'}
+
+previous and current are the state and downtime status before and after the transition ('-' when
+the previous state is not known), thus several transitions in the same second have different ids.
+
+A daily availability document is derived from the events of its day and the last event before
+the day: the host/service is in the state of an event until the next event.
+"""
+
+import time
+import datetime
+
+# Availability storage modes
+AVAILABILITY_DAILY = 'daily'
+AVAILABILITY_EVENTS = 'events'
+AVAILABILITY_MODES = [AVAILABILITY_DAILY, AVAILABILITY_EVENTS]
+
+# Indexes needed to derive the daily documents: (name, keys, unique)
+AVAILABILITY_EVENTS_INDEXES = [
+    ('hostname_service_timestamp', [('hostname', 1), ('service', 1), ('timestamp', 1)], False),
+    ('timestamp', [('timestamp', 1)], False),
+]
+
+UNCHECKED_STATE = 4
+DAY_SECONDS = 86400
+
+
+def transition_event(hostname, service, timestamp, state_id, in_downtime, previous=None):
+    """
+    Build a state transition event, its id is the same if it is stored again
+
+    previous is the (state id, downtime) of the host/service before the transition, None if not known.
+    """
+    downtime = '1' if in_downtime else '0'
+    return {
+        '_id': "%s/%s_%d_%s_%d%s" % (hostname, service, timestamp,
+                                     "%d%s" % previous if previous is not None else '-', state_id, downtime),
+        'hostname': hostname,
+        'service': service,
+        'timestamp': timestamp,
+        'state': state_id,
+        'downtime': downtime
+    }
+
+
+def day_bounds(day):
+    """
+    Get the midnight timestamp of a day (YYYY-MM-DD) and of the next day
+    """
+    midnight = datetime.datetime.strptime(day, '%Y-%m-%d')
+    next_day = midnight + datetime.timedelta(days=1)
+    return int(time.mktime(midnight.timetuple())), int(time.mktime(next_day.timetuple()))
+
+
+def daily_from_events(hostname, service, day, previous, events, closed=False):
+    """
+    Derive the daily availability document of a host/service from its state transitions
+
+    previous is the last event before the day (or None), events are the events of the day sorted
+    by timestamp. The document of a closed day counts the last state until the end of the day,
+    else the last state is counted until its event, as record_availability does until the next
+    check result. Returns None if the host/service has no known state in this day.
+    """
+    day_ts, day_end = day_bounds(day)
+    data = {
+        'hostname': hostname,
+        'service': service,
+        'day': day,
+        'day_ts': day_ts,
+        'daily_0': 0, 'daily_1': 0, 'daily_2': 0, 'daily_3': 0, 'daily_4': 0
+    }
+
+    if previous is not None:
+        # The day starts in the last known state
+        events = [dict(previous, timestamp=day_ts)] + list(events)
+    if not events:
+        return None
+
+    for event, next_event in zip(events, events[1:]):
+        data["daily_%d" % event['state']] += next_event['timestamp'] - event['timestamp']
+    first = events[0]
+    last = events[-1]
+    if closed and day_end > last['timestamp']:
+        data["daily_%d" % last['state']] += day_end - last['timestamp']
+
+    # Days do not always last 86400 seconds
+    data['daily_4'] = day_end - day_ts
+    for state in range(UNCHECKED_STATE):
+        data['daily_4'] -= data['daily_%d' % state]
+    data['is_downtime'] = first['downtime']
+    data['first_check_state'] = first['state']
+    data['first_check_timestamp'] = first['timestamp']
+    data['last_check_state'] = last['state']
+    data['last_check_timestamp'] = last['timestamp']
+    return data
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Array backed availability cache.
+
+Each host/service gets a dense ordinal (its row) and the availability record of its current day
+is stored in parallel typed arrays: seconds in each state, first/last check state and timestamp,
+downtime flag and day. Compared to one dict per record, a row costs a few tens of bytes.
+
+AvailabilityState behaves like the availability cache dict (keys are the host/service_day cache
+keys, values are availability documents built on access), and record() updates a row in place
+for each check result. The unchecked time (daily_4) is only computed when documents are built,
+for many rows at once with numpy when it is available.
+"""
+
+import time
+import datetime
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STORE_DICT = 'dict'
+STORE_ARRAY = 'array'
+STORE_MODES = [STORE_DICT, STORE_ARRAY]
+
+# daily_0 .. daily_3, daily_4 (unchecked) is computed
+CHECKED_STATES = 4
+DAY_SECONDS = 86400
+
+# Cache keys are host/service_YYYY-MM-DD
+DAY_LENGTH = 10
+
+
+def split_key(query):
+    """
+    Get the host/service id and the day of a cache key
+    """
+    return query[:-DAY_LENGTH - 1], query[-DAY_LENGTH:]
+
+
+class AvailabilityState(object):
+    """
+    Availability records of the hosts/services, one row per host/service
+    """
+
+    def __init__(self):
+        # host/service id: row, and row: (host name, service description)
+        self.ordinals = {}
+        self.names = []
+
+        self.daily = [array('l') for i in range(CHECKED_STATES)]
+        self.first_state = array('b')
+        self.first_timestamp = array('l')
+        self.last_state = array('b')
+        self.last_timestamp = array('l')
+        self.downtime = array('b')
+        # Day of the row record (date ordinal), 0 for no record
+        self.day = array('l')
+
+        # date ordinal: (day, midnight timestamp, day seconds), and day: date ordinal
+        self.days = {}
+        self.day_ordinals = {}
+        self.count = 0
+
+    def day_ordinal(self, day):
+        ordinal = self.day_ordinals.get(day)
+        if ordinal is None:
+            date = datetime.datetime.strptime(day, '%Y-%m-%d').date()
+            ordinal = self.day_ordinals[day] = date.toordinal()
+            midnight = datetime.datetime.combine(date, datetime.time.min)
+            midnight_timestamp = int(time.mktime(midnight.timetuple()))
+            # Days do not always last 86400 seconds
+            next_midnight = int(time.mktime((midnight + datetime.timedelta(days=1)).timetuple()))
+            self.days[ordinal] = (day, midnight_timestamp, next_midnight - midnight_timestamp)
+        return ordinal
+
+    def row(self, hostname, service):
+        """
+        Get the row of a host/service, a new row is appended for an unknown host/service
+        """
+        service_id = hostname + "/" + service
+        row = self.ordinals.get(service_id)
+        if row is None:
+            row = self.ordinals[service_id] = len(self.names)
+            self.names.append((hostname, service))
+            for column in self.daily:
+                column.append(0)
+            self.first_state.append(0)
+            self.first_timestamp.append(0)
+            self.last_state.append(0)
+            self.last_timestamp.append(0)
+            self.downtime.append(0)
+            self.day.append(0)
+        return row
+
+    def lookup(self, query):
+        """
+        Get the row of a cache key, None if there is no record for this host/service and day
+        """
+        row = self.ordinals.get(query[:-DAY_LENGTH - 1])
+        if row is None or self.day[row] != self.day_ordinals.get(query[-DAY_LENGTH:]):
+            return None
+        return row
+
+    def record(self, query, hostname, service, state_id, last_chk, seconds_today, midnight_timestamp, in_downtime):
+        """
+        Update the record of a host/service with a check result, as record_availability does with a dict
+        """
+        row = self.lookup(query)
+        if row is not None:
+            last_state = self.last_state[row]
+            since_last_check = last_chk - self.last_timestamp[row]
+            if since_last_check > seconds_today:
+                # Last state changed before today ...
+                self.daily[last_state][row] = seconds_today
+            else:
+                self.daily[last_state][row] += since_last_check
+        else:
+            # New daily record
+            row = self.row(hostname, service)
+            if not self.day[row]:
+                self.count += 1
+            self.day[row] = self.day_ordinal(split_key(query)[1])
+            for column in self.daily:
+                column[row] = 0
+            self.downtime[row] = 1 if in_downtime else 0
+            self.first_state[row] = state_id
+            self.first_timestamp[row] = last_chk
+
+        self.last_state[row] = state_id
+        self.last_timestamp[row] = last_chk
+
+    def columns(self, rows):
+        """
+        Get the values of rows: the list of the values of each column, daily_0 .. daily_4 first
+        """
+        columns = self.daily + [self.downtime, self.first_state, self.first_timestamp,
+                                self.last_state, self.last_timestamp, self.day]
+        if np is not None and len(rows) > 1:
+            indexes = np.array(rows, dtype=np.int64)
+            values = [np.frombuffer(column, dtype='i%d' % column.itemsize)[indexes] for column in columns]
+            day_seconds = np.full(len(rows), DAY_SECONDS, dtype=np.int64)
+            for ordinal in np.unique(values[-1]):
+                day_seconds[values[-1] == ordinal] = self.days[ordinal][2]
+            unchecked = day_seconds - values[0] - values[1] - values[2] - values[3]
+            values.insert(CHECKED_STATES, unchecked)
+            return [v.tolist() for v in values]
+
+        values = [[column[row] for row in rows] for column in columns]
+        values.insert(CHECKED_STATES, [self.days[day][2] - sum(checked)
+                                       for day, checked in zip(values[-1], zip(*values[:CHECKED_STATES]))])
+        return values
+
+    def documents(self, queries):
+        """
+        Get the availability documents of cache keys, as a list of (cache key, document)
+
+        Unknown cache keys are ignored.
+        """
+        found = []
+        rows = []
+        for query in queries:
+            row = self.lookup(query)
+            if row is not None:
+                found.append(query)
+                rows.append(row)
+        if not rows:
+            return []
+
+        names = self.names
+        days = self.days
+        docs = []
+        for query, row, daily_0, daily_1, daily_2, daily_3, daily_4, downtime, first_state, first_timestamp, \
+                last_state, last_timestamp, day in zip(found, rows, *self.columns(rows)):
+            hostname, service = names[row]
+            day, day_ts, day_seconds = days[day]
+            docs.append((query, {
+                'hostname': hostname,
+                'service': service,
+                'day': day,
+                'day_ts': day_ts,
+                'is_downtime': '1' if downtime else '0',
+                'daily_0': daily_0, 'daily_1': daily_1, 'daily_2': daily_2, 'daily_3': daily_3, 'daily_4': daily_4,
+                'first_check_state': first_state,
+                'first_check_timestamp': first_timestamp,
+                'last_check_state': last_state,
+                'last_check_timestamp': last_timestamp
+            }))
+        return docs
+
+    # Availability cache dict interface
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, query):
+        return self.lookup(query) is not None
+
+    def __getitem__(self, query):
+        docs = self.documents([query])
+        if not docs:
+            raise KeyError(query)
+        return docs[0][1]
+
+    def get(self, query, default=None):
+        docs = self.documents([query])
+        if not docs:
+            return default
+        return docs[0][1]
+
+    def __setitem__(self, query, doc):
+        row = self.row(doc['hostname'], doc['service'])
+        if not self.day[row]:
+            self.count += 1
+        self.day[row] = self.day_ordinal(doc['day'])
+        for state, column in enumerate(self.daily):
+            column[row] = int(doc['daily_%d' % state])
+        self.downtime[row] = 1 if doc.get('is_downtime') == '1' else 0
+        self.first_state[row] = int(doc['first_check_state'])
+        self.first_timestamp[row] = int(doc['first_check_timestamp'])
+        self.last_state[row] = int(doc['last_check_state'])
+        self.last_timestamp[row] = int(doc['last_check_timestamp'])
+
+    def __delitem__(self, query):
+        row = self.lookup(query)
+        if row is None:
+            raise KeyError(query)
+        self.day[row] = 0
+        self.count -= 1
+
+    def keys(self):
+        return [self.key(row) for row in range(len(self.names)) if self.day[row]]
+
+    def items(self):
+        return self.documents(self.keys())
+
+    def key(self, row):
+        hostname, service = self.names[row]
+        return """%s/%s_%s""" % (hostname, service, self.days[self.day[row]][0])
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Circuit breaker for the DB connection attempts.
+
+After a failed attempt the breaker opens: no attempt is allowed until an exponentially growing,
+randomized delay is elapsed. Then one attempt is allowed (half open) and its result closes the
+breaker or opens it again for a longer delay.
+"""
+
+import time
+import random
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, min_delay=1, max_delay=300):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.next_attempt = 0
+
+    def allow(self, now=None):
+        """
+        Is a connection attempt allowed now?
+        """
+        if self.state == BREAKER_CLOSED:
+            return True
+        if self.state == BREAKER_OPEN and (now or time.time()) >= self.next_attempt:
+            self.state = BREAKER_HALF_OPEN
+            return True
+        return False
+
+    def success(self):
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.next_attempt = 0
+
+    def failure(self, now=None):
+        """
+        Open the breaker, returns the delay before the next allowed attempt
+        """
+        self.failures += 1
+        delay = min(self.max_delay, self.min_delay * 2 ** min(self.failures - 1, 30))
+        # Equal jitter: avoid all the brokers reconnecting at the same time
+        delay = delay / 2.0 + random.uniform(0, delay / 2.0)
+        self.state = BREAKER_OPEN
+        self.next_attempt = (now or time.time()) + delay
+        return delay
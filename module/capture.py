@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Capture of the broks received by the module, to replay a real broks stream (bench/replay_broks.py).
+
+A capture file is gzip compressed. It starts with a header record, followed by one record per
+batch of received broks: (receive time, [(type, data, instance_id), ...]). Records are pickled.
+The brok data is captured as received, still pickled when the brok is not prepared, so capturing
+a brok costs no unpickling.
+
+The compressed data is synced to the file every second, a capture interrupted by a crash is
+readable up to its last sync.
+"""
+
+import os
+import time
+import zlib
+import gzip
+import cPickle
+
+from shinken.log import logger
+
+CAPTURE_VERSION = 1
+# gzip format (zlib wbits + 16)
+GZIP_WBITS = zlib.MAX_WBITS | 16
+
+
+class BrokCapture(object):
+    """
+    Append-only compressed broks capture file
+
+    The compressed data is written directly to the file descriptor, without buffered file object:
+    a forked process which drops its copy of the capture does not write anything in the file.
+    """
+
+    def __init__(self, filename, max_size=0, sync_period=1.0):
+        self.filename = filename
+        self.max_size = max_size
+        self.sync_period = sync_period
+        self.fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+        self.compressor = zlib.compressobj(1, zlib.DEFLATED, GZIP_WBITS)
+        self.pending = []
+        self.written = os.fstat(self.fd).st_size
+        self.broks = 0
+        self.next_sync = time.time() + sync_period
+        self.capturing = True
+        self._append({'version': CAPTURE_VERSION, 'started': time.time(), 'pid': os.getpid()})
+        logger.info("[krill-hostevents] capturing broks in %s", filename)
+
+    def _append(self, record):
+        chunk = self.compressor.compress(cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL))
+        if chunk:
+            self.pending.append(chunk)
+
+    def capture(self, broks):
+        """
+        Append a batch of broks to the capture
+        """
+        if not self.capturing:
+            return
+        now = time.time()
+        self._append((now, [(b.type,
+                             cPickle.dumps(b.data, cPickle.HIGHEST_PROTOCOL) if getattr(b, 'prepared', False) else b.data,
+                             getattr(b, 'instance_id', None)) for b in broks]))
+        self.broks += len(broks)
+        if now >= self.next_sync:
+            self.sync()
+
+    def sync(self):
+        """
+        Write the compressed data of the captured broks, the file is readable up to this point
+        """
+        self.pending.append(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        data = ''.join(self.pending)
+        self.pending = []
+        os.write(self.fd, data)
+        self.written += len(data)
+        self.next_sync = time.time() + self.sync_period
+        if self.max_size and self.written >= self.max_size:
+            logger.warning("[krill-hostevents] broks capture %s reached its maximum size, capture stopped", self.filename)
+            self.capturing = False
+
+    def close(self):
+        if self.fd is None:
+            return
+        self.pending.append(self.compressor.flush())
+        os.write(self.fd, ''.join(self.pending))
+        os.close(self.fd)
+        self.fd = None
+        self.capturing = False
+        logger.info("[krill-hostevents] broks capture %s closed, %d broks captured", self.filename, self.broks)
+
+
+def read_capture(filename):
+    """
+    Iterate over the records of a capture file: the header dictionary of each capture session,
+    and the (receive time, broks) records. A truncated capture ends at its last readable record.
+    """
+    f = gzip.open(filename, 'rb')
+    try:
+        while True:
+            try:
+                record = cPickle.load(f)
+            except EOFError:
+                return
+            except (IOError, zlib.error, cPickle.UnpicklingError), exp:
+                logger.warning("[krill-hostevents] broks capture %s is truncated: %s", filename, str(exp))
+                return
+            if isinstance(record, dict) and record.get('version') != CAPTURE_VERSION:
+                raise ValueError("unknown broks capture version: %s" % record.get('version'))
+            yield record
+    finally:
+        f.close()
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Local checkpoint of the module state.
+
+A checkpoint file is a header (magic, format version, length and CRC of the payload) followed
+by the zlib compressed pickle of the state dictionary. It is written in a temporary file which
+is renamed once synced, so that a crash never leaves a partial checkpoint.
+"""
+
+import os
+import zlib
+import struct
+import cPickle
+
+from shinken.log import logger
+
+CHECKPOINT_MAGIC = 'MLCK'
+# 2: the availability array store keeps the days length
+CHECKPOINT_VERSION = 2
+# magic, version, payload length, payload CRC32
+CHECKPOINT_HEADER = struct.Struct('>4sBIi')
+
+
+def save_checkpoint(filename, state):
+    """
+    Write the state in a checkpoint file, returns the checkpoint size
+    """
+    payload = zlib.compress(cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL), 1)
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, len(payload), zlib.crc32(payload)))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, filename)
+    return CHECKPOINT_HEADER.size + len(payload)
+
+
+def load_checkpoint(filename):
+    """
+    Read the state of a checkpoint file
+
+    Returns None if there is no checkpoint, or if it is not usable (other format version, corrupted)
+    """
+    if not os.path.exists(filename):
+        return None
+
+    try:
+        with open(filename, 'rb') as f:
+            header = f.read(CHECKPOINT_HEADER.size)
+            if len(header) < CHECKPOINT_HEADER.size:
+                logger.error("[krill-hostevents] checkpoint %s is truncated, ignored", filename)
+                return None
+            magic, version, length, crc = CHECKPOINT_HEADER.unpack(header)
+            if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+                logger.warning("[krill-hostevents] checkpoint %s has an unknown format (%r, version %d), ignored",
+                               filename, magic, version)
+                return None
+            payload = f.read(length)
+    except (IOError, OSError), exp:
+        logger.error("[krill-hostevents] Can not read the checkpoint %s: %s", filename, str(exp))
+        return None
+
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        logger.error("[krill-hostevents] checkpoint %s is corrupted, ignored", filename)
+        return None
+    return cPickle.loads(zlib.decompress(payload))
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compact schema for the stored log documents.
+
+- short keys, empty or default values are not stored
+- integer coded type and state type when they are known values
+- the raw message is only stored when it can not be rebuilt from the other fields
+- optional zlib compression of the long plugin outputs
+
+expand_document builds back the full document, as stored with the full schema.
+"""
+
+import zlib
+
+from bson.binary import Binary
+
+from .log_line import LINE_TYPES, SERVICE_STATES, HOST_STATES, EMPTY_LINE, LOGOBJECT_SERVICE
+
+SCHEMA_FULL = 'full'
+SCHEMA_COMPACT = 'compact'
+SCHEMA_MODES = [SCHEMA_FULL, SCHEMA_COMPACT]
+
+# Full key: compact key
+COMPACT_KEYS = {
+    'time': 't',
+    'type': 'y',
+    'logclass': 'c',
+    'logobject': 'o',
+    'host_name': 'h',
+    'service_description': 's',
+    'state': 'st',
+    'state_type': 'sy',
+    'attempt': 'a',
+    'plugin_output': 'p',
+    'comment': 'cm',
+    'contact_name': 'ct',
+    'command_name': 'cn',
+    'message': 'm',
+    'options': 'op',
+}
+FULL_KEYS = dict([(v, k) for k, v in COMPACT_KEYS.items()])
+
+# Compressed plugin output key
+COMPRESSED_OUTPUT = 'pz'
+
+# Stored type codes: never change a code, append the new line types at the end.
+# A line type without a code is stored with its name.
+TYPE_CODES = {
+    'CURRENT HOST STATE': 0,
+    'CURRENT SERVICE STATE': 1,
+    'ERROR': 2,
+    'EXTERNAL COMMAND': 3,
+    'HOST ALERT': 4,
+    'HOST DOWNTIME ALERT': 5,
+    'HOST EVENT HANDLER': 6,
+    'HOST FLAPPING ALERT': 7,
+    'HOST NOTIFICATION': 8,
+    'INFO': 9,
+    'INITIAL HOST STATE': 10,
+    'INITIAL SERVICE STATE': 11,
+    'PASSIVE HOST CHECK': 12,
+    'PASSIVE SERVICE CHECK': 13,
+    'SERVICE ALERT': 14,
+    'SERVICE DOWNTIME ALERT': 15,
+    'SERVICE EVENT HANDLER': 16,
+    'SERVICE FLAPPING ALERT': 17,
+    'SERVICE NOTIFICATION': 18,
+    'TIMEPERIOD TRANSITION': 19,
+    'WARNING': 20,
+}
+TYPE_NAMES = dict([(i, t) for t, i in TYPE_CODES.items()])
+
+STATE_TYPE_CODES = {'SOFT': 0, 'HARD': 1}
+STATE_TYPE_NAMES = dict([(i, t) for t, i in STATE_TYPE_CODES.items()])
+
+SERVICE_STATE_NAMES = {0: 'OK', 1: 'WARNING', 2: 'CRITICAL', 3: 'UNKNOWN'}
+HOST_STATE_NAMES = {0: 'UP', 1: 'DOWN', 2: 'UNREACHABLE', 3: 'UNKNOWN'}
+
+# Logs indexes needed by the module and the WebUI queries: (name, keys, unique)
+LOGS_INDEXES = [
+    ('time', [('time', 1)], False),
+    ('host_service_time', [('host_name', 1), ('service_description', 1), ('time', 1)], False),
+    ('logclass_time', [('logclass', 1), ('time', 1)], False),
+]
+
+# Compact indexes matching the full schema logs indexes
+COMPACT_LOGS_INDEXES = [
+    ('time', [('t', 1)], False),
+    ('host_service_time', [('h', 1), ('s', 1), ('t', 1)], False),
+    ('logclass_time', [('c', 1), ('t', 1)], False),
+]
+
+
+def rebuild_message(doc):
+    """
+    Rebuild the raw log line of a full schema document, None if it is not possible
+    """
+    spec = LINE_TYPES.get(doc['type'])
+    if spec is None:
+        return None
+    logobject, logclass, fields, states, state_field = spec
+    if not fields:
+        return None
+    values = []
+    for name in fields:
+        if name is None:
+            return None
+        value = doc[name]
+        if name == 'state' and states is not None:
+            names = SERVICE_STATE_NAMES if states is SERVICE_STATES else HOST_STATE_NAMES
+            value = names.get(value)
+            if value is None:
+                return None
+        values.append(str(value) if isinstance(value, (int, long)) else value)
+    return '[%d] %s: %s' % (doc['time'], doc['type'], ';'.join(values))
+
+
+def compact_document(doc, compress_threshold=0):
+    """
+    Get the compact schema document of a full schema log document
+
+    Plugin outputs longer than compress_threshold bytes are zlib compressed, 0 to never compress.
+    """
+    compact = {}
+    if '_id' in doc:
+        compact['_id'] = doc['_id']
+
+    for key, value in doc.iteritems():
+        short = COMPACT_KEYS.get(key)
+        if short is None or key in ('message', 'type', 'state_type', 'plugin_output'):
+            continue
+        if value == EMPTY_LINE[key] and key != 'time':
+            continue
+        compact[short] = value
+
+    compact['y'] = TYPE_CODES.get(doc['type'], doc['type'])
+    if doc['state_type']:
+        compact['sy'] = STATE_TYPE_CODES.get(doc['state_type'], doc['state_type'])
+
+    output = doc['plugin_output']
+    if output:
+        if compress_threshold and len(output) > compress_threshold:
+            if isinstance(output, unicode):
+                output = output.encode('UTF-8')
+            compact[COMPRESSED_OUTPUT] = Binary(zlib.compress(output))
+        else:
+            compact['p'] = output
+
+    # Only store the raw line if it can not be rebuilt
+    if rebuild_message(doc) != doc['message']:
+        compact['m'] = doc['message']
+    return compact
+
+
+def expand_document(doc):
+    """
+    Get the full schema document of a stored log document, compact or not
+    """
+    if 't' not in doc:
+        return doc
+
+    full = EMPTY_LINE.copy()
+    for short, value in doc.iteritems():
+        key = FULL_KEYS.get(short)
+        if key:
+            full[key] = value
+        elif short == '_id':
+            full['_id'] = value
+
+    if isinstance(full['type'], (int, long)):
+        full['type'] = TYPE_NAMES[full['type']]
+    if isinstance(full['state_type'], (int, long)):
+        full['state_type'] = STATE_TYPE_NAMES[full['state_type']]
+    if COMPRESSED_OUTPUT in doc:
+        full['plugin_output'] = zlib.decompress(doc[COMPRESSED_OUTPUT])
+    if 'm' not in doc:
+        full['message'] = rebuild_message(full)
+    return full
@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hosts/services and log lines filters.
+
+A filter is a comma separated list of rules, compiled once into predicates:
+  regexp or service_description:regexp    host_name/service_description matches the regexp
+  host:regexp                             host name matches the regexp
+  bi:>x, bi:>=x, bi:<x, bi:<=x, bi:=x     business impact comparison (bp: is the same)
+  bi:x-y                                  business impact in the range [x, y]
+  hg:name                                 host is a member of the host group
+  class:alert|state|...                   log line class is one of the listed classes
+  type:regexp                             log line type matches the regexp
+A rule prefixed with ! excludes the matching objects or lines.
+
+An object or line is included if one of the include rules matches (or if there is no include rule
+and the default decision is to include) and if none of the exclude rules matches.
+"""
+
+import re
+import operator
+
+from .log_line import (
+    LINE_TYPES,
+    LOGCLASS_INFO, LOGCLASS_ALERT, LOGCLASS_PROGRAM, LOGCLASS_NOTIFICATION,
+    LOGCLASS_PASSIVECHECK, LOGCLASS_COMMAND, LOGCLASS_STATE, LOGCLASS_INVALID,
+    PROGRAM_PREFIXES
+)
+
+LOGCLASS_NAMES = {
+    'info': LOGCLASS_INFO,
+    'alert': LOGCLASS_ALERT,
+    'program': LOGCLASS_PROGRAM,
+    'notification': LOGCLASS_NOTIFICATION,
+    'passive': LOGCLASS_PASSIVECHECK,
+    'command': LOGCLASS_COMMAND,
+    'state': LOGCLASS_STATE,
+}
+
+BI_OPERATORS = [
+    ('>=', operator.ge),
+    ('<=', operator.le),
+    ('>', operator.gt),
+    ('<', operator.lt),
+    ('=', operator.eq),
+]
+
+
+class FilterError(Exception):
+    pass
+
+
+def type_logclass(type):
+    """
+    Get the log class of a log line type, as parse_line does
+    """
+    spec = LINE_TYPES.get(type)
+    if spec is not None:
+        return spec[1]
+    if type.startswith(PROGRAM_PREFIXES):
+        return LOGCLASS_PROGRAM
+    return LOGCLASS_INVALID
+
+
+def _bi_predicate(value):
+    range_match = re.match(r'^(\d+)-(\d+)$', value)
+    if range_match:
+        low, high = int(range_match.group(1)), int(range_match.group(2))
+        return lambda obj: obj.get('business_impact') is not None and low <= obj['business_impact'] <= high
+    for symbol, op in BI_OPERATORS:
+        if value.startswith(symbol):
+            try:
+                threshold = int(value[len(symbol):])
+            except ValueError:
+                break
+            return lambda obj: obj.get('business_impact') is not None and op(obj['business_impact'], threshold)
+    raise FilterError("Wrong business impact rule: %s" % value)
+
+
+def _regexp(value):
+    try:
+        return re.compile(value, re.IGNORECASE)
+    except re.error, exp:
+        raise FilterError("Wrong regexp %s: %s" % (value, exp))
+
+
+class Filter(object):
+    """
+    A compiled filter
+
+    Object rules apply to a dict describing a host or a service with the keys:
+    host_name, service_description, business_impact and hostgroups (host group names).
+    Line rules apply to log line types.
+    """
+
+    def __init__(self, expression=''):
+        self.expression = expression
+        self.object_includes = []
+        self.object_excludes = []
+        self.line_includes = []
+        self.line_excludes = []
+        self.needs_info = False
+
+        for rule in (expression or '').split(','):
+            rule = rule.strip()
+            if rule:
+                self._compile_rule(rule)
+
+    def __nonzero__(self):
+        return bool(self.object_includes or self.object_excludes or self.line_includes or self.line_excludes)
+
+    def _compile_rule(self, rule):
+        exclude = rule.startswith('!')
+        if exclude:
+            rule = rule[1:]
+
+        kind, value = 'service_description', rule
+        elts = rule.split(':', 1)
+        if len(elts) > 1 and elts[0].lower() in ('service_description', 'host', 'bi', 'bp', 'hg', 'class', 'type'):
+            kind, value = elts[0].lower(), elts[1]
+
+        line_rule = False
+        if kind == 'service_description':
+            pattern = _regexp(value)
+            predicate = lambda obj: bool(pattern.search(obj['host_name'] + '/' + obj['service_description']))
+        elif kind == 'host':
+            pattern = _regexp(value)
+            predicate = lambda obj: bool(pattern.search(obj['host_name']))
+        elif kind in ('bi', 'bp'):
+            predicate = _bi_predicate(value.lower())
+            self.needs_info = True
+        elif kind == 'hg':
+            name = value
+            predicate = lambda obj: name in (obj.get('hostgroups') or ())
+            self.needs_info = True
+        elif kind == 'class':
+            classes = set()
+            for name in value.lower().split('|'):
+                if name not in LOGCLASS_NAMES:
+                    raise FilterError("Unknown log class: %s" % name)
+                classes.add(LOGCLASS_NAMES[name])
+            predicate = lambda type: type_logclass(type) in classes
+            line_rule = True
+        else:
+            pattern = _regexp(value)
+            predicate = lambda type: bool(pattern.search(type))
+            line_rule = True
+
+        if line_rule:
+            (self.line_excludes if exclude else self.line_includes).append(predicate)
+        else:
+            (self.object_excludes if exclude else self.object_includes).append(predicate)
+
+    def match_object(self, obj, default=True):
+        """
+        Include or exclude a host/service
+        """
+        if self.object_includes:
+            included = False
+            for predicate in self.object_includes:
+                if predicate(obj):
+                    included = True
+                    break
+        else:
+            included = default
+        if not included:
+            return False
+        for predicate in self.object_excludes:
+            if predicate(obj):
+                return False
+        return True
+
+    def match_type(self, type):
+        """
+        Include or exclude a log line type
+        """
+        if self.line_includes:
+            included = False
+            for predicate in self.line_includes:
+                if predicate(type):
+                    included = True
+                    break
+            if not included:
+                return False
+        for predicate in self.line_excludes:
+            if predicate(type):
+                return False
+        return True
+
+    def has_object_rules(self):
+        return bool(self.object_includes or self.object_excludes)
@@ -0,0 +1,305 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Import Shinken/Nagios log files (shinken.log, archives/*.log) in the logs collection.
+
+Files are parsed and inserted in parallel, one file per worker process. The same lines
+as the broker module are stored, with the same deterministic ids. The progress of each file
+is checkpointed after each inserted batch, thus an interrupted import resumes where it stopped:
+the lines of a batch inserted again are ignored as duplicates. A dry run does not checkpoint.
+With time partitioned logs, the lines are inserted in their partitions, and with the compact schema
+they are stored as compact documents, as the broker module does.
+
+Use a mongomock:// URI to run the import against an in-process stand-in (with one process).
+"""
+
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import Queue
+import optparse
+import threading
+import multiprocessing
+
+from .log_line import InvalidLines, parse_stored, log_id
+from .partitions import LogsPartitions, PARTITION_NONE, PARTITION_MODES
+from .compact import compact_document, LOGS_INDEXES, COMPACT_LOGS_INDEXES, SCHEMA_FULL, SCHEMA_COMPACT, SCHEMA_MODES
+
+DEFAULT_CHECKPOINT = '.mongo-logs-import.checkpoint'
+
+# Progress queue of the worker processes, set by the pool initializer
+progress_queue = None
+
+
+def get_client(uri):
+    """
+    Get a client for the URI, a mongomock:// URI gets an in-process stand-in
+    """
+    if uri.startswith('mongomock://'):
+        import mongomock
+        return mongomock.MongoClient()
+
+    from pymongo import MongoClient
+    return MongoClient(uri)
+
+
+def open_log_file(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def read_lines(f, offset):
+    """
+    Yield (line, offset after the line) from the offset position of a file
+    """
+    if offset:
+        f.seek(offset)
+    for line in f:
+        offset += len(line)
+        yield line.rstrip('\r\n'), offset
+
+
+def import_file(filename, offset, options, db=None):
+    """
+    Import a log file from offset, batch_size lines at a time
+
+    Returns a tuple (filename, offset, stored lines, invalid lines, elapsed time)
+    """
+    start = time.time()
+    if db is None and not options['dry_run']:
+        db = get_client(options['uri'])[options['database']]
+    partitions = None
+    if options['partitioning'] != PARTITION_NONE:
+        partitions = LogsPartitions(options['collection'], options['partitioning'])
+
+    invalid = InvalidLines()
+    stored = 0
+    position = [offset]
+
+    def lines():
+        for line, pos in read_lines(f, offset):
+            position[0] = pos
+            yield line
+
+    def insert(batch, pos):
+        if not options['dry_run']:
+            store_documents(db, batch, options, partitions)
+        report(filename, pos, len(batch))
+
+    with open_log_file(filename) as f:
+        batch = []
+        for doc in parse_stored(lines(), invalid):
+            doc['_id'] = log_id(doc)
+            batch.append(doc)
+            if len(batch) >= options['batch_size']:
+                insert(batch, position[0])
+                stored += len(batch)
+                batch = []
+        if batch:
+            insert(batch, position[0])
+            stored += len(batch)
+
+    report(filename, position[0], 0, done=True)
+    return filename, position[0], stored, len(invalid), time.time() - start
+
+
+def store_documents(db, docs, options, partitions=None):
+    """
+    Insert log documents in the logs collection, or in their partitions of the logs collection
+    """
+    compact = options['schema'] == SCHEMA_COMPACT
+    if partitions:
+        batches = partitions.split(docs)
+        for name in sorted(batches):
+            partitions.register(db, name, batches[name][0]['time'], COMPACT_LOGS_INDEXES if compact else LOGS_INDEXES)
+    else:
+        batches = {options['collection']: docs}
+
+    for name in sorted(batches):
+        if compact:
+            batches[name] = [compact_document(doc, options['compress_output']) for doc in batches[name]]
+        insert_documents(db[name], batches[name])
+
+
+def insert_documents(collection, docs):
+    """
+    Insert log documents, the documents already stored by an interrupted import are ignored
+    """
+    from pymongo.errors import BulkWriteError
+
+    try:
+        collection.insert_many(docs, ordered=False)
+    except BulkWriteError, exp:
+        errors = [e for e in exp.details.get('writeErrors', []) if e.get('code') not in (11000, 11001)]
+        if errors or exp.details.get('writeConcernErrors'):
+            raise
+
+
+def report(filename, offset, count, done=False):
+    if progress_queue is not None:
+        progress_queue.put((filename, offset, count, done))
+
+
+def init_worker(queue):
+    global progress_queue
+    progress_queue = queue
+
+
+def import_file_worker(args):
+    return import_file(*args)
+
+
+class Checkpoint(object):
+    """
+    Import progress: offset of the next line to import, per file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.files = {}
+        if filename and os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                self.files = json.load(f)
+
+    def offset(self, filename):
+        return self.files.get(filename, {}).get('offset', 0)
+
+    def done(self, filename):
+        return self.files.get(filename, {}).get('done', False)
+
+    def update(self, filename, offset, done=False):
+        self.files[filename] = {'offset': offset, 'done': done}
+
+    def save(self):
+        if not self.filename:
+            return
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            json.dump(self.files, f)
+        os.rename(tmp, self.filename)
+
+
+def run(filenames, options):
+    checkpoint = Checkpoint(options['checkpoint'])
+    todo = [(filename, checkpoint.offset(filename), options)
+            for filename in filenames if not checkpoint.done(filename)]
+    print "%d files to import, %d already imported" % (len(todo), len(filenames) - len(todo))
+
+    global progress_queue
+    progress_queue = multiprocessing.Queue() if options['processes'] > 1 else Queue.Queue()
+    counters = {'lines': 0}
+    start = time.time()
+
+    def follow_progress():
+        while True:
+            item = progress_queue.get()
+            if item is None:
+                break
+            filename, offset, count, done = item
+            if not options['dry_run']:
+                checkpoint.update(filename, offset, done)
+                checkpoint.save()
+            counters['lines'] += count
+
+    follower = threading.Thread(target=follow_progress)
+    follower.start()
+
+    try:
+        if options['processes'] > 1:
+            pool = multiprocessing.Pool(options['processes'], init_worker, (progress_queue,))
+            results = pool.imap_unordered(import_file_worker, todo)
+        else:
+            db = None
+            if not options['dry_run']:
+                db = get_client(options['uri'])[options['database']]
+            results = (import_file(filename, offset, options, db) for filename, offset, options in todo)
+
+        for filename, offset, stored, invalid, elapsed in results:
+            print "%s: %d lines stored, %d invalid lines, %.1fs (%.0f lines/s)" % (
+                filename, stored, invalid, elapsed, stored / elapsed if elapsed else 0)
+
+        if options['processes'] > 1:
+            pool.close()
+            pool.join()
+    finally:
+        progress_queue.put(None)
+        follower.join()
+
+    elapsed = time.time() - start
+    print "Imported %d lines in %.1fs (%.0f lines/s)" % (
+        counters['lines'], elapsed, counters['lines'] / elapsed if elapsed else 0)
+    return counters['lines']
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options] logfile [logfile ...]",
+                                   description="Import Shinken/Nagios log files in the mongo-logs logs collection")
+    parser.add_option('-u', '--uri', default='mongodb://localhost',
+                      help="MongoDB connection string, mongomock:// for an in-process stand-in [%default]")
+    parser.add_option('-d', '--database', default='shinken', help="database name [%default]")
+    parser.add_option('-c', '--collection', default='logs', help="logs collection name [%default]")
+    parser.add_option('-t', '--partitioning', type='choice', choices=PARTITION_MODES, default=PARTITION_NONE,
+                      help="logs collection partitioning (logs_partitioning of the module): %s [%%default]" % ', '.join(PARTITION_MODES))
+    parser.add_option('-s', '--schema', type='choice', choices=SCHEMA_MODES, default=SCHEMA_FULL,
+                      help="logs schema (logs_schema of the module): %s [%%default]" % ', '.join(SCHEMA_MODES))
+    parser.add_option('-z', '--compress-output', type='int', default=0,
+                      help="compact schema: compress the plugin outputs longer than this number of bytes, 0 to never compress [%default]")
+    parser.add_option('-b', '--batch-size', type='int', default=1000, help="lines per insertion [%default]")
+    parser.add_option('-p', '--processes', type='int', default=multiprocessing.cpu_count(),
+                      help="worker processes [%default]")
+    parser.add_option('-k', '--checkpoint', default=DEFAULT_CHECKPOINT,
+                      help="checkpoint file to resume an import, empty for no checkpoint [%default]")
+    parser.add_option('-n', '--dry-run', action='store_true', default=False, help="parse only, do not insert nor checkpoint")
+    opts, args = parser.parse_args(argv)
+
+    filenames = []
+    for arg in args:
+        filenames.extend(sorted(glob.glob(arg)) or [arg])
+    if not filenames:
+        parser.error("no log file to import")
+
+    options = {
+        'uri': opts.uri,
+        'database': opts.database,
+        'collection': opts.collection,
+        'partitioning': opts.partitioning,
+        'schema': opts.schema,
+        'compress_output': opts.compress_output,
+        'batch_size': opts.batch_size,
+        'processes': max(1, opts.processes),
+        'checkpoint': opts.checkpoint,
+        'dry_run': opts.dry_run
+    }
+    if options['uri'].startswith('mongomock://'):
+        # The stand-in lives in this process
+        options['processes'] = 1
+
+    run(filenames, options)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Local spill journal for the log lines that can not be kept in memory.
+
+The journal is a directory of append-only segment files, one JSON document per line.
+A checkpoint file stores the position of the first line not yet stored in the DB.
+"""
+
+import os
+import re
+import json
+import threading
+
+from bson.objectid import ObjectId
+
+from shinken.log import logger
+
+SEGMENT_PATTERN = re.compile(r'^segment-(\d{10})\.jnl$')
+
+
+class LogsJournal(object):
+    """
+    Append-only, segment-rotated journal of log documents
+
+    Each appended document is given an ObjectId so that replaying a batch twice
+    (crash between insertion and checkpoint) does not duplicate the lines in the DB.
+    """
+
+    def __init__(self, path, segment_size=64 * 1024 * 1024):
+        self.path = path
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        self.checkpoint_file = os.path.join(self.path, 'checkpoint')
+
+        segments = self._segments()
+        self.write_seq = segments[-1] if segments else 0
+        self.read_seq, self.read_offset = self._load_checkpoint()
+        if segments and self.read_seq < segments[0]:
+            self.read_seq, self.read_offset = segments[0], 0
+
+        # Drop a partially written line left by a crash
+        self._repair(self.write_seq)
+
+        self.writer = open(self._segment_file(self.write_seq), 'ab')
+        self.write_offset = self.writer.tell()
+        self.appended = 0
+        logger.info("[krill-hostevents] logs journal: %s, segments %d to %d, replay from %d:%d",
+                    self.path, self.read_seq, self.write_seq, self.read_seq, self.read_offset)
+
+    def _segment_file(self, seq):
+        return os.path.join(self.path, 'segment-%010d.jnl' % seq)
+
+    def _segments(self):
+        segments = []
+        for name in os.listdir(self.path):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                segments.append(int(match.group(1)))
+        return sorted(segments)
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_file, 'rb') as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (IOError, ValueError):
+            return 0, 0
+
+    def _repair(self, seq):
+        filename = self._segment_file(seq)
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith('\n'):
+                f.truncate(data.rfind('\n') + 1)
+                logger.warning("[krill-hostevents] logs journal: truncated a partial line in %s", filename)
+
+    def append(self, doc):
+        """
+        Append a log document to the journal
+        """
+        if '_id' not in doc:
+            doc['_id'] = ObjectId()
+        line = json.dumps(dict(doc, _id=str(doc['_id']))) + '\n'
+        with self.lock:
+            if self.write_offset >= self.segment_size:
+                self.writer.close()
+                self.write_seq += 1
+                self.writer = open(self._segment_file(self.write_seq), 'ab')
+                self.write_offset = 0
+            self.writer.write(line)
+            self.write_offset += len(line)
+            self.appended += 1
+
+    def pending(self):
+        """
+        True if some journaled lines are not yet stored in the DB
+        """
+        return (self.read_seq, self.read_offset) < (self.write_seq, self.write_offset)
+
+    def read_batch(self, count):
+        """
+        Read at most count documents from the checkpointed position
+
+        Returns a tuple (documents, position), position is to be given to commit once
+        the documents are stored in the DB
+        """
+        with self.lock:
+            self.writer.flush()
+            write_seq = self.write_seq
+
+        docs = []
+        seq, offset = self.read_seq, self.read_offset
+        while len(docs) < count:
+            try:
+                f = open(self._segment_file(seq), 'rb')
+            except IOError:
+                f = None
+            if f:
+                with f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith('\n'):
+                            # Line is being written
+                            break
+                        offset += len(line)
+                        doc = json.loads(line)
+                        doc['_id'] = ObjectId(doc['_id'])
+                        docs.append(doc)
+                        if len(docs) >= count:
+                            break
+            if len(docs) >= count or seq >= write_seq:
+                break
+            seq, offset = seq + 1, 0
+
+        return docs, (seq, offset)
+
+    def commit(self, position):
+        """
+        Checkpoint a replay position and remove the fully replayed segments
+        """
+        seq, offset = position
+        tmp = self.checkpoint_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write('%d %d' % (seq, offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.checkpoint_file)
+        self.read_seq, self.read_offset = seq, offset
+
+        for old in self._segments():
+            if old < seq:
+                os.remove(self._segment_file(old))
+
+        if not self.pending():
+            self._reset()
+
+    def _reset(self):
+        """
+        Everything is replayed: start a new segment to bound the disk usage
+        """
+        with self.lock:
+            if (self.read_seq, self.read_offset) < (self.write_seq, self.write_offset):
+                return
+            self.writer.close()
+            os.remove(self._segment_file(self.write_seq))
+            self.write_seq += 1
+            self.writer = open(self._segment_file(self.write_seq), 'ab')
+            self.write_offset = 0
+            self.read_seq, self.read_offset = self.write_seq, 0
+        tmp = self.checkpoint_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write('%d %d' % (self.read_seq, self.read_offset))
+        os.rename(tmp, self.checkpoint_file)
+
+    def close(self):
+        with self.lock:
+            self.writer.close()
@@ -36,12 +36,268 @@ LOGOBJECT_HOST = 1
 LOGOBJECT_SERVICE = 2
 LOGOBJECT_CONTACT = 3
 
+import re
+import struct
+import hashlib
+
+from bson.objectid import ObjectId
+
 from shinken.log import logger
 
+SERVICE_STATES = {
+    'OK': 0,
+    'WARNING': 1,
+    'CRITICAL': 2,
+    'UNKNOWN': 3,
+    'RECOVERY': 0
+}
+HOST_STATES = {
+    'UP': 0,
+    'DOWN': 1,
+    'UNREACHABLE': 2,
+    'UNKNOWN': 3,
+    'RECOVERY': 0
+}
+
+COLUMNS = ['logobject', 'attempt', 'logclass', 'command_name', 'comment', 'contact_name', 'host_name', 'message', 'options', 'plugin_output', 'service_description', 'state', 'state_type', 'time', 'type']
+
+# Default values of a parsed line document
+EMPTY_LINE = {
+    'logobject': LOGOBJECT_INFO,
+    'attempt': 0,
+    'logclass': LOGCLASS_INVALID,
+    'command_name': '',
+    'comment': '',
+    'contact_name': '',
+    'host_name': '',
+    'message': '',
+    'options': '',  # Fix a mismatch of number of fields with old databases and new ones
+    'plugin_output': '',
+    'service_description': '',
+    'state': 0,
+    'state_type': '',
+    'time': 0,
+    'type': ''
+}
+
+# Message type: (logobject, logclass, fields, states, state field)
+# - fields are the names of the ';' separated message details, None for an ignored detail
+# - states is the mapping applied to the state field value to get the state, if any
+# - for notifications, the state is got from the state_type ('(' in state_type means UNKNOWN)
+LINE_TYPES = {
+    'CURRENT SERVICE STATE': (LOGOBJECT_SERVICE, LOGCLASS_STATE,
+                              ('host_name', 'service_description', 'state', 'state_type', 'attempt', 'plugin_output'), None, None),
+    'INITIAL SERVICE STATE': (LOGOBJECT_SERVICE, LOGCLASS_STATE,
+                              ('host_name', 'service_description', 'state', 'state_type', 'attempt', 'plugin_output'), None, None),
+    # SERVICE ALERT: srv-40;Service-9;CRITICAL;HARD;1;[Errno 2] No such file or directory
+    'SERVICE ALERT': (LOGOBJECT_SERVICE, LOGCLASS_ALERT,
+                      ('host_name', 'service_description', 'state', 'state_type', 'attempt', 'plugin_output'), SERVICE_STATES, 'state'),
+    'SERVICE DOWNTIME ALERT': (LOGOBJECT_SERVICE, LOGCLASS_ALERT,
+                               ('host_name', 'service_description', 'state_type', 'comment'), None, None),
+    'SERVICE FLAPPING ALERT': (LOGOBJECT_SERVICE, LOGCLASS_ALERT,
+                               ('host_name', 'service_description', 'state_type', 'comment'), None, None),
+
+    'CURRENT HOST STATE': (LOGOBJECT_HOST, LOGCLASS_STATE,
+                           ('host_name', 'state', 'state_type', 'attempt', 'plugin_output'), None, None),
+    'INITIAL HOST STATE': (LOGOBJECT_HOST, LOGCLASS_STATE,
+                           ('host_name', 'state', 'state_type', 'attempt', 'plugin_output'), None, None),
+    'HOST ALERT': (LOGOBJECT_HOST, LOGCLASS_ALERT,
+                   ('host_name', 'state', 'state_type', 'attempt', 'plugin_output'), HOST_STATES, 'state'),
+    'HOST DOWNTIME ALERT': (LOGOBJECT_HOST, LOGCLASS_ALERT,
+                            ('host_name', 'state_type', 'comment'), None, None),
+    'HOST FLAPPING ALERT': (LOGOBJECT_HOST, LOGCLASS_ALERT,
+                            ('host_name', 'state_type', 'comment'), None, None),
+
+    # tust_cuntuct;test_host_0;test_ok_0;CRITICAL;notify-service;i am CRITICAL  <-- normal
+    # SERVICE NOTIFICATION: test_contact;test_host_0;test_ok_0;DOWNTIMESTART (OK);notify-service;OK
+    'SERVICE NOTIFICATION': (LOGOBJECT_SERVICE, LOGCLASS_NOTIFICATION,
+                             ('contact_name', 'host_name', 'service_description', 'state_type', 'command_name', None), SERVICE_STATES, 'state_type'),
+    # tust_cuntuct;test_host_0;DOWN;notify-host;i am DOWN
+    'HOST NOTIFICATION': (LOGOBJECT_HOST, LOGCLASS_NOTIFICATION,
+                          ('contact_name', 'host_name', 'state_type', 'command_name', None), HOST_STATES, 'state_type'),
+
+    'PASSIVE SERVICE CHECK': (LOGOBJECT_SERVICE, LOGCLASS_PASSIVECHECK,
+                              ('host_name', 'service_description', 'state', None), None, None),
+    'PASSIVE HOST CHECK': (LOGOBJECT_HOST, LOGCLASS_PASSIVECHECK,
+                           ('host_name', 'state', None), None, None),
+
+    'SERVICE EVENT HANDLER': (LOGOBJECT_SERVICE, LOGCLASS_NOTIFICATION,
+                              ('host_name', 'service_description', 'state', 'state_type', 'attempt', 'command_name'), SERVICE_STATES, 'state'),
+    'HOST EVENT HANDLER': (LOGOBJECT_HOST, LOGCLASS_NOTIFICATION,
+                           ('host_name', 'state', 'state_type', 'attempt', 'command_name'), HOST_STATES, 'state'),
+
+    'EXTERNAL COMMAND': (LOGOBJECT_INFO, LOGCLASS_COMMAND, (), None, None),
+    'TIMEPERIOD TRANSITION': (LOGOBJECT_INFO, LOGCLASS_PROGRAM, (), None, None),
+    'INFO': (LOGOBJECT_INFO, LOGCLASS_PROGRAM, (), None, None),
+    'WARNING': (LOGOBJECT_INFO, LOGCLASS_PROGRAM, (), None, None),
+    'ERROR': (LOGOBJECT_INFO, LOGCLASS_PROGRAM, (), None, None),
+}
+
+# Message types for program events
+PROGRAM_PREFIXES = ('starting...', 'shutting down...', 'Bailing out', 'active mode...', 'standby mode...', 'Warning')
+
+# Shinken daemons log lines which are not stored
+NOT_STORED_LINE = re.compile(r"^\[[0-9]*\] [A-Z][a-z]*.:")
+
+# Log lines classes which are not stored
+IGNORED_LOGCLASSES = (LOGCLASS_PASSIVECHECK, LOGCLASS_INFO, LOGCLASS_PROGRAM, LOGCLASS_COMMAND)
+
+
 class LoglineWrongFormat(Exception):
     pass
 
 
+# Index of the host name in the fields of the line types about a host
+HOST_NAME_FIELDS = dict([(type, spec[2].index('host_name'))
+                         for type, spec in LINE_TYPES.items() if spec[2] and 'host_name' in spec[2]])
+
+
+def line_host_name(line):
+    """
+    Get the host name of a log line without parsing the whole line, '' if the line is not about a host
+    """
+    last_type_pos = line.find(':')
+    index = HOST_NAME_FIELDS.get(line[line.find(' ') + 1:last_type_pos])
+    if index is None:
+        return ''
+    values = line[last_type_pos + 2:].split(';', index + 1)
+    return values[index] if len(values) > index else ''
+
+
+def parse_line(line):
+    """Parse a log line and return the document to be stored in the DB
+
+    The document has the same content as Logline(line=line).as_dict()
+    """
+    if isinstance(line, unicode):
+        line = line.encode('UTF-8').rstrip()
+
+    # [1278280765] SERVICE ALERT: test_host_0
+    if line[0] != '[' and line[11] != ']':
+        raise LoglineWrongFormat
+
+    last_type_pos = line.find(':')
+    type = line[line.find(' ') + 1:last_type_pos]
+
+    doc = EMPTY_LINE.copy()
+    doc['message'] = line
+    doc['type'] = type
+
+    spec = LINE_TYPES.get(type)
+    if spec is None:
+        if type.startswith(PROGRAM_PREFIXES):
+            doc['logclass'] = LOGCLASS_PROGRAM
+        else:
+            logger.debug("[Livestatus Log Lines] Does not match")
+        doc['time'] = int(line[1:11])
+        return doc
+
+    logobject, logclass, fields, states, state_field = spec
+    doc['logobject'] = logobject
+    doc['logclass'] = logclass
+    if fields:
+        values = line[last_type_pos + 2:].split(';', len(fields) - 1)
+        if len(values) != len(fields):
+            raise ValueError("need more than %d values to unpack" % len(values))
+        for name, value in zip(fields, values):
+            if name:
+                doc[name] = value
+        if states:
+            if state_field == 'state_type' and '(' in doc['state_type']:
+                # downtime/flapping/etc-notifications take the type UNKNOWN
+                doc['state_type'] = 'UNKNOWN'
+            doc['state'] = states[doc[state_field]]
+        doc['attempt'] = int(doc['attempt'])
+    doc['time'] = int(line[1:11])
+    return doc
+
+
+def log_id(doc):
+    """
+    Get the deterministic id of a log document: its time and a hash of its type, host, service and message
+
+    The id is an ObjectId, the documents ids are still ordered by time.
+    """
+    key = hashlib.sha1()
+    for field in ('type', 'host_name', 'service_description', 'message'):
+        value = doc.get(field) or ''
+        if isinstance(value, unicode):
+            value = value.encode('UTF-8')
+        key.update(value + '\0')
+    return ObjectId(struct.pack('>I', int(doc['time']) & 0xffffffff) + key.digest()[:8])
+
+
+class InvalidLines(object):
+    """Side channel for the lines that parse_many can not parse
+
+    Counts the invalid lines per reason and keeps the first few of them
+    """
+
+    def __init__(self, samples=10):
+        self.count = 0
+        self.reasons = {}
+        self.samples = []
+        self.max_samples = samples
+
+    def add(self, line, reason):
+        self.count += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append((line, reason))
+
+    def __len__(self):
+        return self.count
+
+
+def parse_many(lines, invalid=None):
+    """Parse an iterable of log lines, or of log broks, and yield the documents to be stored in the DB
+
+    The lines are consumed one at a time, thus memory usage does not depend upon the lines count.
+    Invalid lines are not yielded, they are reported to the invalid side channel (InvalidLines) if any.
+    """
+    parse = parse_line
+    for line in lines:
+        if not isinstance(line, basestring):
+            line = line.data['log']
+        try:
+            doc = parse(line)
+        except LoglineWrongFormat:
+            if invalid is not None:
+                invalid.add(line, 'format')
+            continue
+        except (ValueError, KeyError, IndexError):
+            if invalid is not None:
+                invalid.add(line, 'fields')
+            continue
+        if doc['logclass'] == LOGCLASS_INVALID:
+            if invalid is not None:
+                invalid.add(line, 'type')
+            continue
+        yield doc
+
+
+def parse_stored(lines, invalid=None, accept_type=None):
+    """Same as parse_many but only yields the documents which the broker module stores in the DB
+
+    Shinken daemons lines and the lines of the IGNORED_LOGCLASSES classes are skipped.
+    accept_type is an optional predicate on the line type, the lines of the refused types
+    are skipped before being parsed.
+    """
+    not_stored = NOT_STORED_LINE.match
+
+    def candidates():
+        for line in lines:
+            if not_stored(line):
+                continue
+            if accept_type is not None and not accept_type(line[line.find(' ') + 1:line.find(':')]):
+                continue
+            yield line
+
+    for doc in parse_many(candidates(), invalid):
+        if doc['logclass'] not in IGNORED_LOGCLASSES:
+            yield doc
+
+
 class Logline(dict):
     """A class which represents a line from the logfile
     Public functions:
@@ -50,7 +306,8 @@ class Logline(dict):
     """
 
     id = 0
-    columns = ['logobject', 'attempt', 'logclass', 'command_name', 'comment', 'contact_name', 'host_name', 'message', 'options', 'plugin_output', 'service_description', 'state', 'state_type', 'time', 'type']
+    columns = COLUMNS
+    parse_many = staticmethod(parse_many)
 
     def __init__(self, sqlite_cursor=None, sqlite_row=None, line=None, srcdict=None):
         if srcdict != None:
@@ -64,167 +321,12 @@ class Logline(dict):
                 else:
                     setattr(self, col[0], sqlite_row[idx])
         elif line != None:
-            if isinstance(line, unicode):
-                line = line.encode('UTF-8').rstrip()
-
-            # [1278280765] SERVICE ALERT: test_host_0
-            if line[0] != '[' and line[11] != ']':
+            try:
+                self.__dict__.update(parse_line(line))
+            except LoglineWrongFormat:
                 logger.warning("[Livestatus Log Lines] Invalid line: %s" % line)
-                raise LoglineWrongFormat
-            else:
-                service_states = {
-                    'OK': 0,
-                    'WARNING': 1,
-                    'CRITICAL': 2,
-                    'UNKNOWN': 3,
-                    'RECOVERY': 0
-                }
-                host_states = {
-                    'UP': 0,
-                    'DOWN': 1,
-                    'UNREACHABLE': 2,
-                    'UNKNOWN': 3,
-                    'RECOVERY': 0
-                }
-
-                # type is 0:info, 1:state, 2:program, 3:notification, 4:passive, 5:command
-                logobject = LOGOBJECT_INFO
-                logclass = LOGCLASS_INVALID
-                attempt, state = [0] * 2
-                command_name, comment, contact_name, host_name, message, plugin_output, service_description, state_type = [''] * 8
-                time = line[1:11]
-                first_type_pos = line.find(' ') + 1
-                last_type_pos = line.find(':')
-                first_detail_pos = last_type_pos + 2
-                type = line[first_type_pos:last_type_pos]
-                options = line[first_detail_pos:]
-                message = line
-                if type == 'CURRENT SERVICE STATE':
-                    logobject = LOGOBJECT_SERVICE
-                    logclass = LOGCLASS_STATE
-                    host_name, service_description, state, state_type, attempt, plugin_output = options.split(';', 5)
-                elif type == 'INITIAL SERVICE STATE':
-                    logobject = LOGOBJECT_SERVICE
-                    logclass = LOGCLASS_STATE
-                    host_name, service_description, state, state_type, attempt, plugin_output = options.split(';', 5)
-                elif type == 'SERVICE ALERT':
-                    # SERVICE ALERT: srv-40;Service-9;CRITICAL;HARD;1;[Errno 2] No such file or directory
-                    logobject = LOGOBJECT_SERVICE
-                    logclass = LOGCLASS_ALERT
-                    host_name, service_description, state, state_type, attempt, plugin_output = options.split(';', 5)
-                    state = service_states[state]
-                elif type == 'SERVICE DOWNTIME ALERT':
-                    logobject = LOGOBJECT_SERVICE
-                    logclass = LOGCLASS_ALERT
-                    host_name, service_description, state_type, comment = options.split(';', 3)
-                elif type == 'SERVICE FLAPPING ALERT':
-                    logobject = LOGOBJECT_SERVICE
-                    logclass = LOGCLASS_ALERT
-                    host_name, service_description, state_type, comment = options.split(';', 3)
-
-                elif type == 'CURRENT HOST STATE':
-                    logobject = LOGOBJECT_HOST
-                    logclass = LOGCLASS_STATE
-                    host_name, state, state_type, attempt, plugin_output = options.split(';', 4)
-                elif type == 'INITIAL HOST STATE':
-                    logobject = LOGOBJECT_HOST
-                    logclass = LOGCLASS_STATE
-                    host_name, state, state_type, attempt, plugin_output = options.split(';', 4)
-                elif type == 'HOST ALERT':
-                    logobject = LOGOBJECT_HOST
-                    logclass = LOGCLASS_ALERT
-                    host_name, state, state_type, attempt, plugin_output = options.split(';', 4)
-                    state = host_states[state]
-                elif type == 'HOST DOWNTIME ALERT':
-                    logobject = LOGOBJECT_HOST
-                    logclass = LOGCLASS_ALERT
-                    host_name, state_type, comment = options.split(';', 2)
-                elif type == 'HOST FLAPPING ALERT':
-                    logobject = LOGOBJECT_HOST
-                    logclass = LOGCLASS_ALERT
-                    host_name, state_type, comment = options.split(';', 2)
-
-                elif type == 'SERVICE NOTIFICATION':
-                    # tust_cuntuct;test_host_0;test_ok_0;CRITICAL;notify-service;i am CRITICAL  <-- normal
-                    # SERVICE NOTIFICATION: test_contact;test_host_0;test_ok_0;DOWNTIMESTART (OK);notify-service;OK
-                    logobject = LOGOBJECT_SERVICE
-                    logclass = LOGCLASS_NOTIFICATION
-                    contact_name, host_name, service_description, state_type, command_name, check_plugin_output = options.split(';', 5)
-                    if '(' in state_type:  # downtime/flapping/etc-notifications take the type UNKNOWN
-                        state_type = 'UNKNOWN'
-                    state = service_states[state_type]
-                elif type == 'HOST NOTIFICATION':
-                    # tust_cuntuct;test_host_0;DOWN;notify-host;i am DOWN
-                    logobject = LOGOBJECT_HOST
-                    logclass = LOGCLASS_NOTIFICATION
-                    contact_name, host_name, state_type, command_name, check_plugin_output = options.split(';', 4)
-                    if '(' in state_type:
-                        state_type = 'UNKNOWN'
-                    state = host_states[state_type]
-
-                elif type == 'PASSIVE SERVICE CHECK':
-                    logobject = LOGOBJECT_SERVICE
-                    logclass = LOGCLASS_PASSIVECHECK
-                    host_name, service_description, state, check_plugin_output = options.split(';', 3)
-                elif type == 'PASSIVE HOST CHECK':
-                    logobject = LOGOBJECT_HOST
-                    logclass = LOGCLASS_PASSIVECHECK
-                    host_name, state, check_plugin_output = options.split(';', 2)
-
-                elif type == 'SERVICE EVENT HANDLER':
-                    logobject = LOGOBJECT_SERVICE
-                    logclass = LOGCLASS_NOTIFICATION
-                    host_name, service_description, state, state_type, attempt, command_name = options.split(';', 5)
-                    state = service_states[state]
-                elif type == 'HOST EVENT HANDLER':
-                    logobject = LOGOBJECT_HOST
-                    logclass = LOGCLASS_NOTIFICATION
-                    host_name, state, state_type, attempt, command_name = options.split(';', 4)
-                    state = host_states[state]
-
-                elif type == 'EXTERNAL COMMAND':
-                    logobject = LOGOBJECT_INFO
-                    logclass = LOGCLASS_COMMAND
-
-                elif type == 'TIMEPERIOD TRANSITION':
-                    logobject = LOGOBJECT_INFO
-                    logclass = LOGCLASS_PROGRAM
-
-                elif type == 'INFO' or \
-                     type == 'WARNING' or \
-                     type == 'ERROR':
-                    logobject = LOGOBJECT_INFO
-                    logclass = LOGCLASS_PROGRAM
-
-                elif type.startswith('starting...') or \
-                     type.startswith('shutting down...') or \
-                     type.startswith('Bailing out') or \
-                     type.startswith('active mode...') or \
-                     type.startswith('standby mode...') or \
-                     type.startswith('Warning'):
-                    logobject = LOGOBJECT_INFO
-                    logclass = LOGCLASS_PROGRAM
-                else:
-                    logger.debug("[Livestatus Log Lines] Does not match")
-                    pass
-
-                Logline.id += 1
-                # self.lineno = Logline.id
-                setattr(self, 'logobject', int(logobject))
-                setattr(self, 'attempt', int(attempt))
-                setattr(self, 'logclass', int(logclass))
-                setattr(self, 'command_name', command_name)
-                setattr(self, 'comment', comment)
-                setattr(self, 'contact_name', contact_name)
-                setattr(self, 'host_name', host_name)
-                setattr(self, 'message', message)
-                setattr(self, 'options', '') # Fix a mismatch of number of fields with old databases and new ones
-                setattr(self, 'plugin_output', plugin_output)
-                setattr(self, 'service_description', service_description)
-                setattr(self, 'state', state)
-                setattr(self, 'state_type', state_type)
-                setattr(self, 'time', int(time))
-                setattr(self, 'type', type)
+                raise
+            Logline.id += 1
 
 
     def as_tuple(self):
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Internal metrics of the mongo-logs module.
+
+Counters, gauges and timers (latency histograms) are collected in memory and periodically
+dumped to a local JSON file (or the module log) and pushed to the configured pushers.
+The timers are reset at each dump: their statistics cover the last metrics period.
+When metrics are disabled, collecting a metric is a single test.
+"""
+
+import os
+import json
+import time
+import socket
+import bisect
+
+from shinken.log import logger
+
+# Timers histogram buckets upper bounds, in seconds
+TIMER_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60]
+
+
+class Timer(object):
+    """
+    Latency histogram
+    """
+
+    __slots__ = ['count', 'total', 'min', 'max', 'buckets']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(TIMER_BUCKETS) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(TIMER_BUCKETS, value)] += 1
+
+    def percentile(self, p):
+        """
+        Upper bound of the bucket containing the p percentile
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return TIMER_BUCKETS[i] if i < len(TIMER_BUCKETS) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.min or 0.0,
+            'max': self.max or 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99)
+        }
+
+
+class Metrics(object):
+    """
+    Metrics registry
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+        self.pushers = []
+        self.last_snapshot = None
+
+    def incr(self, name, value=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def counter(self, name, value):
+        """
+        Set a counter maintained elsewhere (broks stats, writer counters)
+        """
+        if not self.enabled:
+            return
+        self.counters[name] = value
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        self.gauges[name] = value
+
+    def timing(self, name, seconds):
+        if not self.enabled:
+            return
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = Timer()
+        timer.add(seconds)
+
+    def snapshot(self):
+        """
+        Get all the metrics, with the counters rates and the timers since the previous snapshot
+        """
+        now = time.time()
+        # Timings recorded by the writer thread while snapshotting go to the next snapshot
+        timers, self.timers = self.timers, {}
+        rates = {}
+        if self.last_snapshot:
+            elapsed = now - self.last_snapshot['time']
+            previous = self.last_snapshot['counters']
+            if elapsed > 0:
+                for name, value in self.counters.items():
+                    rates[name] = (value - previous.get(name, 0)) / elapsed
+
+        snapshot = {
+            'time': now,
+            'counters': dict(self.counters),
+            'rates': rates,
+            'gauges': dict(self.gauges),
+            'timers': dict([(name, timer.snapshot()) for name, timer in timers.items()])
+        }
+        self.last_snapshot = snapshot
+        return snapshot
+
+    def dump(self, filename=None):
+        """
+        Dump the metrics in a JSON file, or in the module log, and push them
+        """
+        if not self.enabled:
+            return
+        snapshot = self.snapshot()
+        if filename:
+            try:
+                tmp = filename + '.tmp'
+                with open(tmp, 'wb') as f:
+                    json.dump(snapshot, f, indent=2, sort_keys=True)
+                os.rename(tmp, filename)
+            except (IOError, OSError), exp:
+                logger.error("[krill-hostevents] Can not dump metrics to %s: %s", filename, str(exp))
+        else:
+            logger.info("[krill-hostevents] metrics: %s", json.dumps(snapshot, sort_keys=True))
+
+        for pusher in self.pushers:
+            try:
+                pusher.push(snapshot)
+            except Exception, exp:
+                logger.warning("[krill-hostevents] Can not push metrics with %s: %s", pusher, str(exp))
+
+
+class StatsdPusher(object):
+    """
+    Push the metrics to a statsd server (UDP)
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='mongo_logs'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.previous = {}
+
+    def __str__(self):
+        return 'statsd %s:%d' % self.address
+
+    def push(self, snapshot):
+        lines = []
+        for name, value in snapshot['counters'].items():
+            delta = value - self.previous.get(name, 0)
+            self.previous[name] = value
+            if delta:
+                lines.append('%s.%s:%d|c' % (self.prefix, name, delta))
+        for name, value in snapshot['gauges'].items():
+            lines.append('%s.%s:%s|g' % (self.prefix, name, value))
+        for name, timer in snapshot['timers'].items():
+            for key in ('mean', 'p50', 'p99', 'max'):
+                lines.append('%s.%s.%s:%d|g' % (self.prefix, name, key, timer[key] * 1000))
+
+        # Keep datagrams small
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) > 1400:
+                self.socket.sendto('\n'.join(packet), self.address)
+                packet, size = [], 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self.socket.sendto('\n'.join(packet), self.address)
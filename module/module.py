@@ -36,6 +36,8 @@ import re
 import sys
 import pymongo
 import traceback
+import threading
+import Queue
 
 from shinken.objects.service import Service
 from shinken.modulesctx import modulesctx
@@ -48,18 +50,45 @@ from shinken.modulesctx import modulesctx
 # Logline = livestatus.Logline
 from .log_line import (
     Logline,
+    InvalidLines,
+    parse_stored,
+    log_id,
     LOGCLASS_INVALID,
     LOGCLASS_PASSIVECHECK,
     LOGCLASS_INFO,
     LOGCLASS_PROGRAM,
     LOGCLASS_COMMAND
 )
+from .writer import LogsWriter, WRITER_BLOCK, WRITER_POLICIES
+from .journal import LogsJournal
+from .partitions import LogsPartitions, PARTITION_NONE, PARTITION_MODES
+from .filters import Filter, FilterError
+from .compact import compact_document, SCHEMA_FULL, SCHEMA_COMPACT, SCHEMA_MODES, LOGS_INDEXES, COMPACT_LOGS_INDEXES
+from .metrics import Metrics, StatsdPusher
+from .availability_state import AvailabilityState, STORE_DICT, STORE_ARRAY, STORE_MODES
+from .shards import ShardPool
+from .checkpoint import save_checkpoint, load_checkpoint
+from .capture import BrokCapture
+from .breaker import CircuitBreaker, BREAKER_CLOSED
+from .availability_events import (
+    transition_event,
+    daily_from_events,
+    day_bounds,
+    AVAILABILITY_DAILY,
+    AVAILABILITY_EVENTS,
+    AVAILABILITY_MODES,
+    AVAILABILITY_EVENTS_INDEXES
+)
 
 
 try:
     import pymongo
-    from pymongo import MongoClient
-    from pymongo.errors import AutoReconnect, ConnectionFailure
+    from pymongo import MongoClient, ReplaceOne, ASCENDING
+    from pymongo.errors import AutoReconnect, ConnectionFailure, BulkWriteError
+    from pymongo.write_concern import WriteConcern
+    from bson import BSON
+    from bson.errors import InvalidDocument
+    from bson.objectid import ObjectId
 except ImportError:
     logger.error('[krill-hostevents] Can not import pymongo and/or MongoClient'
                  'Your pymongo lib is too old. '
@@ -93,6 +122,43 @@ DISCONNECTED = 2
 SWITCHING = 3
 
 
+# Indexes needed by the module and the WebUI queries: (name, keys, unique)
+# The logs indexes depend upon the logs schema (LOGS_INDEXES, COMPACT_LOGS_INDEXES)
+AVAILABILITY_INDEXES = [
+    ('hostname_service_day', [('hostname', 1), ('service', 1), ('day', 1)], True),
+]
+
+# Durability modes: write concern options
+DURABILITY_MODES = {
+    'fire_and_forget': {'w': 0},
+    'acknowledged': {'w': 1},
+    'journaled': {'w': 1, 'j': True},
+    'majority': {'w': 'majority'},
+}
+
+
+# Bulk write errors classes, by error code
+WRITE_ERROR_CLASSES = {
+    11000: 'duplicate',
+    11001: 'duplicate',
+    121: 'validation',
+    10334: 'too_large',
+    17419: 'too_large',
+}
+# Errors of a DB server which can not write now, the documents are inserted again later
+TRANSIENT_WRITE_ERRORS = set([6, 7, 50, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436])
+
+
+def write_error_class(code):
+    if code in TRANSIENT_WRITE_ERRORS:
+        return 'transient'
+    return WRITE_ERROR_CLASSES.get(code, 'other')
+
+
+# Broks management functions names
+BROK_MANAGER = re.compile(r'^manage_(\w+)_brok$')
+
+
 class MongoLogsError(Exception):
     pass
 
@@ -122,15 +188,153 @@ class MongoLogs(BaseModule):
         self.commit_volume = int(getattr(mod_conf, 'commit_volume', '1000'))
         logger.info('[krill-hostevents] periodical commit volume: %d lines', self.commit_volume)
 
+        self.commit_threshold = int(getattr(mod_conf, 'commit_threshold', str(self.commit_volume)))
+        logger.info('[krill-hostevents] commit threshold: %d lines', self.commit_threshold)
+
+        # Lines wait at most half the commit period by default
+        self.commit_max_age = int(getattr(mod_conf, 'commit_max_age', str(max(1, self.commit_period / 2))))
+        logger.info('[krill-hostevents] commit max lines age: %ds', self.commit_max_age)
+
+        self.commit_max_time = float(getattr(mod_conf, 'commit_max_time', '5'))
+        logger.info('[krill-hostevents] commit max duration: %ss', self.commit_max_time)
+
+        self.commit_target_latency = int(getattr(mod_conf, 'commit_target_latency', '500'))
+        logger.info('[krill-hostevents] commit target latency: %dms', self.commit_target_latency)
+
         self.db_test_period = int(getattr(mod_conf, 'db_test_period', '0'))
         logger.info('[krill-hostevents] periodical DB connection test period: %ds', self.db_test_period)
 
+        self.db_timeout = int(getattr(mod_conf, 'db_timeout', '30'))
+        logger.info('[krill-hostevents] DB server selection timeout: %ds', self.db_timeout)
+
+        self.db_retry_min = int(getattr(mod_conf, 'db_retry_min', '1'))
+        self.db_retry_max = int(getattr(mod_conf, 'db_retry_max', '300'))
+        logger.info('[krill-hostevents] DB connection retry delay: %d to %ds', self.db_retry_min, self.db_retry_max)
+
+        self.logs_durability = getattr(mod_conf, 'logs_durability', 'acknowledged')
+        if self.logs_durability not in DURABILITY_MODES:
+            logger.error('[krill-hostevents] Wrong logs_durability: %s, using acknowledged', self.logs_durability)
+            self.logs_durability = 'acknowledged'
+        logger.info('[krill-hostevents] logs durability: %s', self.logs_durability)
+
+        self.availability_durability = getattr(mod_conf, 'availability_durability', 'acknowledged')
+        if self.availability_durability not in DURABILITY_MODES:
+            logger.error('[krill-hostevents] Wrong availability_durability: %s, using acknowledged', self.availability_durability)
+            self.availability_durability = 'acknowledged'
+        logger.info('[krill-hostevents] availability durability: %s', self.availability_durability)
+
+        self.fsync_after_commit = getattr(mod_conf, 'fsync_after_commit', '0') == '1'
+        logger.info('[krill-hostevents] fsync after commit: %s', self.fsync_after_commit)
+
+        self.create_indexes = getattr(mod_conf, 'create_indexes', '1') == '1'
+        logger.info('[krill-hostevents] create indexes: %s', self.create_indexes)
+
         self.logs_collection = getattr(mod_conf, 'logs_collection', 'logs')
         logger.info('[krill-hostevents] logs collection: %s', self.logs_collection)
 
+        self.logs_partitioning = getattr(mod_conf, 'logs_partitioning', PARTITION_NONE)
+        if self.logs_partitioning not in PARTITION_MODES:
+            logger.error('[krill-hostevents] Wrong logs_partitioning: %s, using %s', self.logs_partitioning, PARTITION_NONE)
+            self.logs_partitioning = PARTITION_NONE
+        logger.info('[krill-hostevents] logs partitioning: %s', self.logs_partitioning)
+
+        self.logs_schema = getattr(mod_conf, 'logs_schema', SCHEMA_FULL)
+        if self.logs_schema not in SCHEMA_MODES:
+            logger.error('[krill-hostevents] Wrong logs_schema: %s, using %s', self.logs_schema, SCHEMA_FULL)
+            self.logs_schema = SCHEMA_FULL
+        logger.info('[krill-hostevents] logs schema: %s', self.logs_schema)
+
+        self.logs_compress_output = int(getattr(mod_conf, 'logs_compress_output', '0'))
+        logger.info('[krill-hostevents] logs plugin output compression threshold: %d bytes', self.logs_compress_output)
+
+        # Logs collection fields names depend upon the schema
+        self.logs_indexes = COMPACT_LOGS_INDEXES if self.logs_schema == SCHEMA_COMPACT else LOGS_INDEXES
+        self.logs_time_field = 't' if self.logs_schema == SCHEMA_COMPACT else 'time'
+
+        self.logs_journal_path = getattr(mod_conf, 'logs_journal_path', '')
+        logger.info('[krill-hostevents] logs journal path: %s', self.logs_journal_path)
+
+        self.logs_journal_segment_size = int(getattr(mod_conf, 'logs_journal_segment_size', '64'))
+        logger.info('[krill-hostevents] logs journal segment size: %d MB', self.logs_journal_segment_size)
+
+        self.logs_deterministic_ids = getattr(mod_conf, 'logs_deterministic_ids', '1') == '1'
+        logger.info('[krill-hostevents] logs deterministic ids: %s', self.logs_deterministic_ids)
+
+        self.logs_cache_size = int(getattr(mod_conf, 'logs_cache_size', '100000'))
+        logger.info('[krill-hostevents] logs cache size: %d lines', self.logs_cache_size)
+
         self.hav_collection = getattr(mod_conf, 'hav_collection', 'availability')
         logger.info('[krill-hostevents] hosts availability collection: %s', self.hav_collection)
 
+        self.availability_write_behind = getattr(mod_conf, 'availability_write_behind', '0') == '1'
+        logger.info('[krill-hostevents] availability write-behind: %s', self.availability_write_behind)
+
+        self.availability_flush_threshold = int(getattr(mod_conf, 'availability_flush_threshold', '1000'))
+        logger.info('[krill-hostevents] availability flush threshold: %d records', self.availability_flush_threshold)
+
+        self.availability_store = getattr(mod_conf, 'availability_store', STORE_DICT)
+        if self.availability_store not in STORE_MODES:
+            logger.error('[krill-hostevents] Wrong availability_store: %s, using %s', self.availability_store, STORE_DICT)
+            self.availability_store = STORE_DICT
+        logger.info('[krill-hostevents] availability cache store: %s', self.availability_store)
+
+        self.availability_mode = getattr(mod_conf, 'availability_mode', AVAILABILITY_DAILY)
+        if self.availability_mode not in AVAILABILITY_MODES:
+            logger.error('[krill-hostevents] Wrong availability_mode: %s, using %s', self.availability_mode, AVAILABILITY_DAILY)
+            self.availability_mode = AVAILABILITY_DAILY
+        logger.info('[krill-hostevents] availability mode: %s', self.availability_mode)
+
+        self.hav_events_collection = getattr(mod_conf, 'hav_events_collection', 'availability_events')
+        logger.info('[krill-hostevents] availability events collection: %s', self.hav_events_collection)
+
+        self.availability_catchup_days = int(getattr(mod_conf, 'availability_catchup_days', '7'))
+        logger.info('[krill-hostevents] availability events mode, closed days catch-up: %d days', self.availability_catchup_days)
+
+        self.writer_thread = getattr(mod_conf, 'writer_thread', '0') == '1'
+        logger.info('[krill-hostevents] background writer thread: %s', self.writer_thread)
+
+        self.writer_queue_size = int(getattr(mod_conf, 'writer_queue_size', '100'))
+        logger.info('[krill-hostevents] writer queue size: %d batches', self.writer_queue_size)
+
+        self.writer_queue_policy = getattr(mod_conf, 'writer_queue_policy', WRITER_BLOCK)
+        if self.writer_queue_policy not in WRITER_POLICIES:
+            logger.error('[krill-hostevents] Wrong writer_queue_policy: %s, using %s', self.writer_queue_policy, WRITER_BLOCK)
+            self.writer_queue_policy = WRITER_BLOCK
+        logger.info('[krill-hostevents] writer queue policy: %s', self.writer_queue_policy)
+
+        self.availability_warmup_batch = int(getattr(mod_conf, 'availability_warmup_batch', '1000'))
+        logger.info('[krill-hostevents] availability warm-up batch: %d hosts', self.availability_warmup_batch)
+
+        self.metrics_period = int(getattr(mod_conf, 'metrics_period', '0'))
+        logger.info('[krill-hostevents] metrics period: %ds', self.metrics_period)
+
+        self.metrics_file = getattr(mod_conf, 'metrics_file', '')
+        logger.info('[krill-hostevents] metrics file: %s', self.metrics_file)
+
+        self.metrics_statsd = getattr(mod_conf, 'metrics_statsd', '')
+        logger.info('[krill-hostevents] metrics statsd server: %s', self.metrics_statsd)
+
+        self.metrics_prefix = getattr(mod_conf, 'metrics_prefix', 'mongo_logs')
+        logger.info('[krill-hostevents] metrics prefix: %s', self.metrics_prefix)
+
+        self.checkpoint_file = getattr(mod_conf, 'checkpoint_file', '')
+        logger.info('[krill-hostevents] state checkpoint file: %s', self.checkpoint_file)
+
+        self.checkpoint_period = int(getattr(mod_conf, 'checkpoint_period', '300'))
+        logger.info('[krill-hostevents] state checkpoint period: %ds', self.checkpoint_period)
+
+        self.brok_capture_file = getattr(mod_conf, 'brok_capture_file', '')
+        logger.info('[krill-hostevents] broks capture file: %s', self.brok_capture_file)
+
+        self.brok_capture_max_size = int(getattr(mod_conf, 'brok_capture_max_size', '1024'))
+        logger.info('[krill-hostevents] broks capture maximum size: %d MB', self.brok_capture_max_size)
+
+        self.ingestion_shards = int(getattr(mod_conf, 'ingestion_shards', '1'))
+        logger.info('[krill-hostevents] ingestion shards: %d', self.ingestion_shards)
+
+        self.ingestion_queue_size = int(getattr(mod_conf, 'ingestion_queue_size', '100'))
+        logger.info('[krill-hostevents] ingestion shard queue size: %d batches', self.ingestion_queue_size)
+
         max_logs_age = getattr(mod_conf, 'max_logs_age', '365')
         maxmatch = re.match(r'^(\d+)([dwmy]*)$', max_logs_age)
         if not maxmatch:
@@ -152,31 +356,26 @@ class MongoLogs(BaseModule):
         self.services_cache = {}
         services_filter = getattr(mod_conf, 'services_filter', '')
         logger.info('[krill-hostevents] services filtering: %s', services_filter)
+        try:
+            self.services_filter = Filter(services_filter)
+        except FilterError, exp:
+            logger.error('[krill-hostevents] Wrong services_filter: %s', str(exp))
+            self.services_filter = Filter()
 
-        self.filter_service_description = None
-        self.filter_service_criticality = None
-        if services_filter:
-            # Decode services filter
-            services_filter = [s for s in services_filter.split(',')]
-            for rule in services_filter:
-                rule = rule.strip()
-                if not rule:
-                    continue
-                logger.info('[krill-hostevents] services filtering rule: %s', rule)
-                elts = rule.split(':', 1)
-
-                t = 'service_description'
-                if len(elts) > 1:
-                    t = elts[0].lower()
-                    s = elts[1].lower()
-
-                if t == 'service_description':
-                    self.filter_service_description = rule
-                    logger.info('[krill-hostevents] services will be filtered by description: %s', self.filter_service_description)
+        logs_filter = getattr(mod_conf, 'logs_filter', '')
+        logger.info('[krill-hostevents] logs filtering: %s', logs_filter)
+        try:
+            self.logs_filter = Filter(logs_filter)
+        except FilterError, exp:
+            logger.error('[krill-hostevents] Wrong logs_filter: %s', str(exp))
+            self.logs_filter = Filter()
 
-                if t == 'bp' or t == 'bi':
-                    self.filter_service_criticality = s
-                    logger.info('[krill-hostevents] services will be filtered by criticality: %s', self.filter_service_criticality)
+        # Filters decisions, per host/service
+        self.services_filter_decisions = {}
+        self.logs_filter_decisions = {}
+        # Hosts/services business impact and host groups, only when a filter needs them
+        self.objects_info = {}
+        self.filters_need_info = self.services_filter.needs_info or self.logs_filter.needs_info
 
 
         # Elasticsearch configuration part ... prepare next version !
@@ -193,31 +392,133 @@ class MongoLogs(BaseModule):
 
 
         self.is_connected = DISCONNECTED
+        self.con = None
+        self.db = None
+        self.db_probing = False
+        self.disconnected_since = None
+        self.breaker = CircuitBreaker(self.db_retry_min, self.db_retry_max)
+
+        self.writer = None
+
+        # Indexes health: count of missing and mismatched indexes, None until verified
+        self.indexes_health = None
 
         self.next_logs_rotation = time.time() + 5000
 
         self.logs_cache = deque()
-
-        self.availability_cache = {}
+        # Time when the oldest waiting line was buffered, None when the logs cache is empty
+        self.logs_cache_since = None
+        # The writer thread puts back the lines it could not insert in the logs cache
+        self.logs_lock = threading.Lock()
+        # Lines per insert batch, adapted to the insert latency when a target latency is defined
+        self.commit_batch = self.commit_volume
+        self.logs_partitions = None
+        if self.logs_partitioning != PARTITION_NONE:
+            self.logs_partitions = LogsPartitions(self.logs_collection, self.logs_partitioning)
+        self.logs_journal = None
+        self.logs_journal_replaying = False
+
+        self.availability_cache = AvailabilityState() if self.availability_store == STORE_ARRAY else {}
+        # Event sourced availability: last (state, downtime) of the hosts/services and events to store
+        self.availability_states = {}
+        self.availability_events = []
         self.availability_cache_backlog = []
+        # Cache keys of the availability records not yet stored in the DB
+        self.availability_dirty = set()
+        # The writer thread updates the dirty keys, the closed records and the pending events
+        self.availability_lock = threading.Lock()
+        # Day of the cached availability records, and closed records of the previous days not yet stored
+        self.availability_day = datetime.date.today().strftime('%Y-%m-%d')
+        self.availability_closing = {}
+        # Length of the days in seconds, by day
+        self.days_seconds = {}
+
+        # Availability records read from the DB to reconcile a loaded checkpoint, None until read
+        self.reconciled = None
+
+        # Host names which today records were loaded by the warm-up, and cache keys of the
+        # hosts/services known to have no today record: no DB query on their first check result
+        self.availability_warmed = set()
+        self.availability_missing = set()
+
+        # Module start time, to measure the time needed to get a warm availability cache
+        self.start_time = time.time()
+        # Last availability warm-up duration and time from the module start to the warm cache, None until done
+        self.warmup_time = None
+        self.steady_state_time = None
+
+        # Broks management functions by brok type, and broks counters by brok type
+        self.brok_routes = self.build_brok_routes()
+        self.brok_stats = {}
+
+        # Internal metrics, only collected when a metrics period is defined
+        self.metrics = self.build_metrics(self.metrics_prefix)
+
+        # Sharded ingestion: shards pool in the module process, shard index in a shard process
+        self.shard_pool = None
+        self.shard = None
+
+        # Received broks capture, only in the module process
+        self.brok_capture = None
 
     def load(self, app):
         self.app = app
 
+    def build_metrics(self, prefix):
+        metrics = Metrics(enabled=self.metrics_period > 0)
+        if metrics.enabled and self.metrics_statsd:
+            host, _, port = self.metrics_statsd.partition(':')
+            try:
+                metrics.pushers.append(StatsdPusher(host or 'localhost', int(port or '8125'), prefix))
+            except Exception, exp:
+                logger.error('[krill-hostevents] Wrong metrics_statsd: %s (%s)', self.metrics_statsd, str(exp))
+        return metrics
+
     def init(self):
+        # With sharded ingestion, each shard has its own journal
+        if self.logs_journal_path and self.ingestion_shards <= 1:
+            try:
+                self.logs_journal = LogsJournal(self.logs_journal_path, self.logs_journal_segment_size * 1024 * 1024)
+            except Exception, exp:
+                logger.error("[krill-hostevents] Can not open the logs journal %s: %s", self.logs_journal_path, str(exp))
+                self.logs_journal = None
         return True
 
-    def open(self):
+    def open(self, wait=False):
         """
         Connect to the Mongo DB with configured URI.
 
-        Execute a command to check if connected on master to activate immediate connection to
-        the DB because we need to know if DB server is available.
+        The client is created once, its connections pool is kept when the DB is not available.
+        The DB server availability is probed in a background thread, unless wait is set: this
+        method returns False at once if not connected, and while the circuit breaker is open
+        after failed probes.
+        """
+        if self.is_connected == CONNECTED:
+            return True
+
+        if self.con is None:
+            self.con = MongoClient(self.uri, connect=False, serverSelectionTimeoutMS=self.db_timeout * 1000)
+
+        if self.db_probing or not self.breaker.allow():
+            return False
+        self.db_probing = True
+
+        if wait:
+            return self.probe_connection()
+
+        thread = threading.Thread(target=self.probe_connection, name='mongo-logs-probe')
+        thread.daemon = True
+        thread.start()
+        return False
+
+    def probe_connection(self):
+        """
+        Execute a command to check if connected on master, to know if the DB server is available.
 
         Update log rotation time to force a log rotation
         """
-        self.con = MongoClient(self.uri, connect=False)
         logger.info("[krill-hostevents] trying to connect MongoDB: %s", self.uri)
+        self.metrics.incr('db.connects')
         try:
             result = self.con.admin.command("ismaster")
             logger.info("[krill-hostevents] connected to MongoDB, admin: %s", result)
@@ -226,22 +527,126 @@ class MongoLogs(BaseModule):
             self.db = getattr(self.con, self.database)
             logger.info("[krill-hostevents] connected to the database: %s (%s)", self.database, self.db)
 
-            self.is_connected = CONNECTED
+            self.breaker.success()
+            self.set_connection_state(CONNECTED)
             self.next_logs_rotation = time.time()
 
             logger.info('[krill-hostevents] database connection established')
+
+            if not self.shard:
+                # Index builds may take long on big collections, do not wait for them
+                thread = threading.Thread(target=self.ensure_indexes, name='mongo-logs-indexes')
+                thread.daemon = True
+                thread.start()
+            return True
         except ConnectionFailure as e:
             logger.error("[krill-hostevents] Server is not available: %s", str(e))
-            return False
+            self.metrics.incr('db.connect_failures')
         except Exception as e:
-            logger.error("[krill-hostevents] Could not open the database", str(e))
-            raise MongoLogsError
+            logger.error("[krill-hostevents] Could not open the database: %s", str(e))
+            self.metrics.incr('db.connect_failures')
+        finally:
+            self.db_probing = False
 
-        return True
+        delay = self.breaker.failure()
+        logger.info("[krill-hostevents] next connection attempt in %ds", delay)
+        return False
+
+    def check_connection(self):
+        """
+        Health probe of a connected DB, done in a background thread
+        """
+        try:
+            self.con.admin.command("ping")
+        except AutoReconnect, exp:
+            logger.error("[krill-hostevents] Database health check failed: %s", str(exp))
+            self.set_connection_state(SWITCHING)
+        except Exception, exp:
+            logger.error("[krill-hostevents] Database health check failed: %s", str(exp))
+            self.set_connection_state(DISCONNECTED)
+
+    def set_connection_state(self, state):
+        """
+        Update the DB connection state, the time spent without a connection is reported as stalled time
+        """
+        now = time.time()
+        if state != CONNECTED and self.is_connected == CONNECTED:
+            self.disconnected_since = now
+            logger.warning("[krill-hostevents] database connection lost")
+        elif state == CONNECTED and self.disconnected_since:
+            stalled = now - self.disconnected_since
+            self.disconnected_since = None
+            self.metrics.timing('db.stalled', stalled)
+            logger.info("[krill-hostevents] database connection restored after %ds", stalled)
+        if state != CONNECTED and self.breaker.state == BREAKER_CLOSED:
+            # The next connection attempts are delayed
+            self.breaker.failure(now)
+        self.is_connected = state
+
+    def logs_db_collection(self, name):
+        """
+        Get a logs collection (or logs partition) with the configured logs write concern
+        """
+        return self.db.get_collection(name, write_concern=WriteConcern(**DURABILITY_MODES[self.logs_durability]))
+
+    def hav_db_collection(self):
+        """
+        Get the availability collection with the configured availability write concern
+        """
+        return self.db.get_collection(self.hav_collection, write_concern=WriteConcern(**DURABILITY_MODES[self.availability_durability]))
+
+    def ensure_indexes(self):
+        """
+        Verify that the indexes needed by the module exist and create the missing ones (create_indexes)
+
+        Indexes are built in background by the DB server. An existing index with the same keys
+        but different options is not modified, it is reported as mismatched. The indexes which are
+        still missing (not created or failed) are reported as missing.
+        """
+        health = {'missing': 0, 'mismatched': 0, 'created': 0, 'errors': 0}
+        collections = [(self.logs_collection, self.logs_indexes), (self.hav_collection, AVAILABILITY_INDEXES)]
+        if self.availability_mode == AVAILABILITY_EVENTS:
+            collections.append((self.hav_events_collection, AVAILABILITY_EVENTS_INDEXES))
+        for collection, indexes in collections:
+            try:
+                existing = self.db[collection].index_information()
+            except Exception, exp:
+                logger.error("[krill-hostevents] Can not get the indexes of %s: %s", collection, str(exp))
+                health['errors'] += 1
+                continue
+
+            existing_keys = dict([(tuple(info['key']), info) for info in existing.values()])
+            for name, keys, unique in indexes:
+                keys = [(field, ASCENDING if order == 1 else order) for field, order in keys]
+                info = existing_keys.get(tuple(keys))
+                if info is not None:
+                    if bool(info.get('unique', False)) != unique:
+                        health['mismatched'] += 1
+                        logger.warning("[krill-hostevents] index %s of %s exists with unique=%s, expected unique=%s",
+                                       keys, collection, info.get('unique', False), unique)
+                    continue
+
+                if not self.create_indexes:
+                    health['missing'] += 1
+                    logger.warning("[krill-hostevents] index %s of %s is missing", keys, collection)
+                    continue
+
+                logger.info("[krill-hostevents] creating index %s on %s", name, collection)
+                try:
+                    self.db[collection].create_index(keys, name=name, unique=unique, background=True)
+                    health['created'] += 1
+                except Exception, exp:
+                    health['missing'] += 1
+                    health['errors'] += 1
+                    logger.error("[krill-hostevents] Can not create index %s on %s: %s", name, collection, str(exp))
+
+        self.indexes_health = health
+        logger.info("[krill-hostevents] indexes health: %s", health)
 
     def close(self):
         self.is_connected = DISCONNECTED
-        self.con.close()
+        if self.con is not None:
+            self.con.close()
         logger.info('[krill-hostevents] database connection closed')
 
     def commit(self):
@@ -264,26 +669,60 @@ class MongoLogs(BaseModule):
         today0000 = datetime.datetime(today.year, today.month, today.day, 0, 0, 0)
         today0005 = datetime.datetime(today.year, today.month, today.day, 0, 5, 0)
         oldest = today0000 - datetime.timedelta(days=self.max_logs_age)
-        result = self.db[self.logs_collection].delete_many({u'time': {'$lt': time.mktime(oldest.timetuple())}})
-        logger.info("[krill-hostevents] removed %d logs older than %s days.", result.deleted_count, self.max_logs_age)
+        if self.logs_partitions:
+            # Drop the partitions which only contain too old logs
+            for name in self.logs_partitions.expired(self.db, time.mktime(oldest.timetuple())):
+                self.logs_partitions.drop(self.db, name)
+                logger.info("[krill-hostevents] dropped logs partition %s older than %s days.", name, self.max_logs_age)
+        else:
+            result = self.db[self.logs_collection].delete_many({self.logs_time_field: {'$lt': time.mktime(oldest.timetuple())}})
+            logger.info("[krill-hostevents] removed %d logs older than %s days.", result.deleted_count, self.max_logs_age)
 
         if now < time.mktime(today0005.timetuple()):
             next_rotation = today0005
         else:
             next_rotation = today0005 + datetime.timedelta(days=1)
 
+        self.metrics.timing('logs.rotation', time.time() - now)
+
         # See you tomorrow
         self.next_logs_rotation = time.mktime(next_rotation.timetuple())
         logger.info("[krill-hostevents] next log rotation at %s " % time.asctime(time.localtime(self.next_logs_rotation)))
 
+    def commit_due(self, now):
+        """
+        The logs cache must be committed before the next commit period: too many lines, or lines
+        waiting for too long. The lines age is their buffering time, not their log time.
+        """
+        if not self.logs_cache:
+            return False
+        if len(self.logs_cache) >= self.commit_threshold:
+            return True
+        since = self.logs_cache_since
+        return bool(self.commit_max_age) and since is not None and now - since >= self.commit_max_age
+
     def commit_logs(self):
         """
-        Peridically called (commit_period), this method prepares a bunch of queued logs (commit_colume) to insert them in the DB
+        Called every commit period, or sooner when a commit is due, this method prepares batches of queued logs
+        (commit_batch lines) to insert them in the DB until the logs cache is empty
+
+        The commit stops after commit_max_time seconds or on a DB error, the remaining lines are
+        committed on the next loop.
+
+        When the writer thread is enabled, the prepared logs are queued to the writer
+
+        The journaled logs are more recent than the cached ones, they are replayed once the cache is empty
         """
         if not self.logs_cache:
+            if self.logs_journal and self.logs_journal.pending():
+                if not self.writer:
+                    self.replay_journal()
+                elif not self.logs_journal_replaying:
+                    # The replay job flags itself as running
+                    self.writer.put('replay_journal')
             return
 
-        if not self.is_connected == CONNECTED:
+        if not self.writer and not self.is_connected == CONNECTED:
             if not self.open():
                 logger.warning("[krill-hostevents] log commiting failed")
                 logger.warning("[krill-hostevents] %d lines to insert in database", len(self.logs_cache))
@@ -291,52 +730,976 @@ class MongoLogs(BaseModule):
 
         logger.debug("[krill-hostevents] commiting ...")
 
-        logger.debug("[krill-hostevents] %d lines to insert in database (max insertion is %d lines)", len(self.logs_cache), self.commit_volume)
-
-        # Flush all the stored log lines
-        logs_to_commit = 1
-        now = time.time()
-        some_logs = []
-        while True:
-            try:
-                # result = self.db[self.logs_collection].insert_one(self.logs_cache.popleft())
-                some_logs.append(self.logs_cache.popleft())
-                logs_to_commit = logs_to_commit + 1
-                if logs_to_commit >= self.commit_volume:
+        logger.debug("[krill-hostevents] %d lines to insert in database (batches of %d lines)", len(self.logs_cache), self.commit_batch)
+
+        # Flush the stored log lines, batch after batch
+        start = time.time()
+        committed = 0
+        while self.logs_cache:
+            some_logs = []
+            with self.logs_lock:
+                while self.logs_cache and len(some_logs) < self.commit_batch:
+                    some_logs.append(self.logs_cache.popleft())
+                if not self.logs_cache:
+                    self.logs_cache_since = None
+
+            if self.writer:
+                if not self.writer.put('insert_logs', some_logs):
+                    # Refused: keep the lines for the next commit
+                    with self.logs_lock:
+                        self.buffer_logs(some_logs, time.time())
                     break
-            except IndexError:
-                logger.debug("[krill-hostevents] prepared all available logs for commit")
+            elif not self.insert_logs(some_logs):
                 break
-            except Exception, exp:
-                logger.error("[krill-hostevents] exception: %s", str(exp))
-        logger.debug("[krill-hostevents] time to prepare %s logs for commit (%2.4f)", logs_to_commit, time.time() - now)
+            committed += len(some_logs)
+
+            if time.time() - start > self.commit_max_time:
+                logger.info("[krill-hostevents] commit stopped after %2.4fs, %d lines remaining", time.time() - start, len(self.logs_cache))
+                break
+        logger.debug("[krill-hostevents] time to commit %d logs (%2.4f)", committed, time.time() - start)
+
+    def insert_logs(self, some_logs):
+        """
+        Insert a batch of log lines in the DB, returns True if the lines were inserted
+
+        The lines are inserted with an unordered bulk insert. If the DB is not available, or if the
+        batch or some of its lines fail with a transient error, the lines are put back in the logs
+        cache to be inserted again: the lines already inserted are then ignored as duplicates (same id).
+        The lines rejected by the DB (validation, size) are dropped and counted.
+        """
+        if not self.is_connected == CONNECTED:
+            if not self.open():
+                logger.warning("[krill-hostevents] log inserting failed, %d lines to insert in database", len(some_logs))
+                self.requeue_logs(some_logs)
+                return False
 
         now = time.time()
+        write_errors = {}
         try:
             # Insert lines to commit
-            result = self.db[self.logs_collection].insert_many(some_logs)
-            logger.debug("[krill-hostevents] inserted %d logs.", len(result.inserted_ids))
+            inserted = self.insert_log_documents(some_logs, ordered=False, ignore_duplicates=True, write_errors=write_errors)
+            logger.debug("[krill-hostevents] inserted %d logs.", inserted)
+            self.metrics.timing('logs.insert', time.time() - now)
+            self.metrics.incr('logs.inserted', inserted)
 
             # Request the server to flush data on files
-            self.con.fsync(async=True)
+            if self.fsync_after_commit:
+                self.con.fsync(async=True)
         except AutoReconnect, exp:
             logger.error("[krill-hostevents] Autoreconnect exception when inserting lines: %s", str(exp))
-            self.is_connected = SWITCHING
+            self.set_connection_state(SWITCHING)
+            self.metrics.incr('db.autoreconnects')
             # Abort commit ... will be finished next time!
+            self.requeue_logs(some_logs)
+            return False
+        except BulkWriteError, exp:
+            # Write concern error: the server is reachable, the lines are inserted again (same ids)
+            logger.error("[krill-hostevents] Write concern error when inserting lines: %s", exp.details.get('writeConcernErrors'))
+            self.metrics.incr('logs.errors.write_concern')
+            self.requeue_logs(some_logs)
+            return False
+        except InvalidDocument, exp:
+            # Not sent to the DB: drop the lines which can not be encoded, insert the other ones again
+            self.requeue_logs(self.encodable_logs(some_logs, exp))
+            return True
         except Exception, exp:
-            self.close()
+            self.set_connection_state(DISCONNECTED)
             logger.error("[krill-hostevents] Database error occurred when commiting: %s", exp)
-        logger.debug("[krill-hostevents] time to insert %s logs (%2.4f)", logs_to_commit, time.time() - now)
+            self.requeue_logs(some_logs)
+            return False
+
+        retry = write_errors.pop('retry', [])
+        for kind, count in write_errors.items():
+            self.metrics.incr('logs.errors.%s' % kind, count)
+        if [kind for kind in write_errors if kind != 'duplicate']:
+            logger.warning("[krill-hostevents] log lines insert errors: %s, %d lines to insert again", write_errors, len(retry))
+        if retry:
+            self.requeue_logs(retry)
+            return False
+
+        logger.debug("[krill-hostevents] time to insert %s logs (%2.4f)", len(some_logs), time.time() - now)
+        self.adapt_commit_batch(len(some_logs), time.time() - now)
+        return True
+
+    def encodable_logs(self, some_logs, exp):
+        """
+        Get the log lines which can be BSON encoded, the other ones are dropped and counted
+        """
+        valid = []
+        for doc in some_logs:
+            try:
+                BSON.encode(doc)
+                valid.append(doc)
+            except InvalidDocument:
+                pass
+        logger.error("[krill-hostevents] %d invalid log lines dropped: %s", len(some_logs) - len(valid), exp)
+        self.metrics.incr('logs.errors.invalid', len(some_logs) - len(valid))
+        return valid
+
+    def requeue_logs(self, some_logs):
+        """
+        Put back log lines at the head of the logs cache, to be inserted first on next commit
+
+        Called by the writer thread too, the logs cache is locked. The put back lines are
+        considered as buffered now, they are retried at the latest after commit_max_age seconds.
+        """
+        with self.logs_lock:
+            self.buffer_logs(some_logs, time.time())
+        self.metrics.incr('logs.requeued', len(some_logs))
+
+    def buffer_logs(self, some_logs, now):
+        """
+        Put log lines at the head of the logs cache, the logs cache must be locked
+        """
+        if not some_logs:
+            return
+        self.logs_cache.extendleft(reversed(some_logs))
+        if self.logs_cache_since is None or now < self.logs_cache_since:
+            self.logs_cache_since = now
+
+    def adapt_commit_batch(self, count, latency):
+        """
+        Adapt the commit batch size to the measured insert latency of a batch of count lines
+
+        The batch size doubles while full batches are inserted in less than half the target latency,
+        and halves when the target latency is exceeded, between commit_volume / 10 and commit_volume * 10.
+        """
+        if not self.commit_target_latency:
+            return
+        target = self.commit_target_latency / 1000.0
+        batch = self.commit_batch
+        if latency > target:
+            batch = max(batch / 2, max(1, self.commit_volume / 10))
+        elif latency < target / 2 and count >= batch:
+            batch = min(batch * 2, self.commit_volume * 10)
+        if batch != self.commit_batch:
+            logger.debug("[krill-hostevents] commit batch: %d lines (insert latency %2.4fs)", batch, latency)
+            self.commit_batch = batch
+
+    def insert_log_documents(self, docs, ordered=True, ignore_duplicates=False, write_errors=None):
+        """
+        Insert log documents in the logs collection, or in their partitions of the logs collection
+
+        Returns the number of inserted documents. With ignore_duplicates, a bulk write error
+        only caused by already existing documents is not raised.
+
+        With a write_errors dictionary, the documents write errors are not raised, they are
+        counted in write_errors by class (duplicate, transient, validation, too_large, other)
+        and the documents failed with a transient error are listed in write_errors['retry'].
+        A write concern error is always raised.
+        """
+        if self.logs_partitions:
+            batches = self.logs_partitions.split(docs)
+            for name in sorted(batches):
+                if self.logs_partitions.register(self.db, name, batches[name][0]['time'], self.logs_indexes if self.create_indexes else None):
+                    logger.info("[krill-hostevents] new logs partition: %s", name)
+        else:
+            batches = {self.logs_collection: docs}
+
+        originals = dict(batches)
+        if self.logs_schema == SCHEMA_COMPACT:
+            # The compacted copies get the ids of the documents: a retried document is not inserted twice
+            for doc in docs:
+                if '_id' not in doc:
+                    doc['_id'] = ObjectId()
+            for name in batches:
+                batches[name] = [compact_document(doc, self.logs_compress_output) for doc in batches[name]]
+
+        inserted = 0
+        for name in sorted(batches):
+            try:
+                result = self.logs_db_collection(name).insert_many(batches[name], ordered=ordered)
+                inserted += len(result.inserted_ids)
+            except BulkWriteError, exp:
+                if write_errors is not None and not exp.details.get('writeConcernErrors'):
+                    for error in exp.details.get('writeErrors', []):
+                        kind = write_error_class(error.get('code'))
+                        write_errors[kind] = write_errors.get(kind, 0) + 1
+                        if kind == 'transient':
+                            write_errors.setdefault('retry', []).append(originals[name][error['index']])
+                        elif kind != 'duplicate':
+                            logger.debug("[krill-hostevents] log line rejected: %s", error.get('errmsg'))
+                    inserted += exp.details.get('nInserted', 0)
+                    continue
+                errors = [e for e in exp.details.get('writeErrors', []) if e.get('code') != 11000]
+                if not ignore_duplicates or errors or exp.details.get('writeConcernErrors'):
+                    raise
+                inserted += exp.details.get('nInserted', 0)
+        return inserted
+
+    def cache_log(self, values):
+        """
+        Store a log line in the logs cache, or in the logs journal if the cache is full
+
+        Once a line is journaled, all the next lines are journaled until the journal is replayed
+        to keep the lines order.
+        """
+        if self.logs_deterministic_ids:
+            values['_id'] = log_id(values)
+        if self.logs_journal and (len(self.logs_cache) >= self.logs_cache_size or self.logs_journal.pending()):
+            try:
+                self.logs_journal.append(values)
+                return
+            except Exception, exp:
+                logger.error("[krill-hostevents] Can not journal a log line: %s", str(exp))
+        with self.logs_lock:
+            if not self.logs_cache:
+                self.logs_cache_since = time.time()
+            self.logs_cache.append(values)
+
+    def replay_journal(self):
+        """
+        Insert all the journaled logs in the DB, in order, commit_volume lines at a time
+
+        The journal position is checkpointed after each inserted batch. The journaled lines have an _id,
+        thus lines inserted twice because of a crash before the checkpoint are ignored by the DB.
+        The replay stops on a batch to be replayed again (see replay_batch).
+        """
+        self.logs_journal_replaying = True
+        now = time.time()
+        replayed = 0
+        try:
+            while self.logs_journal.pending():
+                if not self.is_connected == CONNECTED:
+                    if not self.open():
+                        logger.warning("[krill-hostevents] journal replay failed, database is not available")
+                        return
+
+                docs, position = self.logs_journal.read_batch(self.commit_volume)
+                if docs and not self.replay_batch(docs):
+                    return
+                self.logs_journal.commit(position)
+                replayed += len(docs)
+        finally:
+            self.logs_journal_replaying = False
+            if replayed:
+                logger.info("[krill-hostevents] replayed %d journaled logs (%2.4f)", replayed, time.time() - now)
+
+    def replay_batch(self, docs):
+        """
+        Insert a batch of journaled logs, returns False if the batch is to be replayed again
+
+        As in insert_logs, the lines rejected by the DB (validation, size) or which can not be encoded
+        are dropped and counted: the batch is only kept after a connection, write concern or transient error.
+        """
+        write_errors = {}
+        try:
+            try:
+                self.insert_log_documents(docs, ordered=False, ignore_duplicates=True, write_errors=write_errors)
+            except InvalidDocument, exp:
+                self.insert_log_documents(self.encodable_logs(docs, exp), ordered=False, ignore_duplicates=True,
+                                          write_errors=write_errors)
+        except BulkWriteError, exp:
+            # Write concern error: the server is reachable, the batch is replayed again (same ids)
+            logger.error("[krill-hostevents] Write concern error when replaying journal: %s", exp.details.get('writeConcernErrors'))
+            self.metrics.incr('logs.errors.write_concern')
+            return False
+        except AutoReconnect, exp:
+            logger.error("[krill-hostevents] Autoreconnect exception when replaying journal: %s", str(exp))
+            self.set_connection_state(SWITCHING)
+            self.metrics.incr('db.autoreconnects')
+            return False
+        except Exception, exp:
+            self.set_connection_state(DISCONNECTED)
+            logger.error("[krill-hostevents] Database error occurred when replaying journal: %s", exp)
+            return False
+
+        retry = write_errors.pop('retry', [])
+        for kind, count in write_errors.items():
+            self.metrics.incr('logs.errors.%s' % kind, count)
+        rejected = sum([count for kind, count in write_errors.items() if kind not in ('duplicate', 'transient')])
+        if rejected:
+            logger.warning("[krill-hostevents] journaled log lines insert errors: %s, %d lines dropped", write_errors, rejected)
+        if retry:
+            logger.warning("[krill-hostevents] %d journaled log lines to insert again, journal replay stopped", len(retry))
+            return False
+        return True
+
+    def flush_availability(self):
+        """
+        Store all the dirty availability records of the cache in the DB with one bulk operation
+
+        Called every commit period and when more than availability_flush_threshold records are dirty.
+        Records stay dirty if the DB is not available, they will be stored on next flush.
+        The pending availability events are stored too.
+        """
+        with self.availability_lock:
+            events = self.availability_events
+            self.availability_events = []
+        if events:
+            if not self.writer:
+                self.store_availability_events(events)
+            elif not self.writer.put('store_availability_events', events):
+                # Refused: events are stored on next flush
+                self.requeue_availability_events(events)
+
+        if not self.availability_dirty:
+            return
+
+        if not self.writer and not self.is_connected == CONNECTED:
+            if not self.open():
+                logger.warning("[krill-hostevents] availability flush failed, %d records to store", len(self.availability_dirty))
+                return
+
+        with self.availability_lock:
+            dirty = self.availability_dirty
+            self.availability_dirty = set()
+            closing = [(query, self.availability_closing[query]) for query in dirty if query in self.availability_closing]
+        if self.availability_store == STORE_ARRAY:
+            # Build all the documents at once
+            records = self.availability_cache.documents(dirty)
+        else:
+            records = [(query, self.availability_cache.get(query)) for query in dirty]
+        records.extend(closing)
+        requests = []
+        for query, data in records:
+            if not data:
+                continue
+            q_day = { "hostname": data['hostname'], "service": data['service'], "day": data['day'] }
+            # The cached record is still updated while the request is queued
+            requests.append(ReplaceOne(q_day, dict(data), upsert=True))
+        if not requests:
+            return
+
+        if self.writer:
+            if not self.writer.put('store_availability', (requests, dirty)):
+                # Refused: records remain dirty for the next flush
+                self.requeue_availability(dirty)
+            return
+
+        self.store_availability((requests, dirty))
+
+    def store_availability(self, batch):
+        """
+        Store a batch of availability records in the DB
+
+        batch is a tuple (bulk requests, cache keys), the cache keys are marked dirty again if storing fails
+        """
+        requests, dirty = batch
+        if not self.is_connected == CONNECTED:
+            if not self.open():
+                logger.warning("[krill-hostevents] availability storing failed, %d records to store", len(requests))
+                self.requeue_availability(dirty)
+                return
+
+        now = time.time()
+        try:
+            result = self.hav_db_collection().bulk_write(requests, ordered=False)
+            logger.debug("[krill-hostevents] stored %d availability records (%s upserted)", len(requests),
+                         result.upserted_count if result.acknowledged else 'unknown')
+            self.metrics.timing('availability.store', time.time() - now)
+            self.metrics.incr('availability.stored', len(requests))
+            with self.availability_lock:
+                for query in dirty:
+                    self.availability_closing.pop(query, None)
+        except BulkWriteError, exp:
+            # The server is reachable: records are stored again after a write concern error,
+            # records rejected by the DB are dropped
+            if exp.details.get('writeConcernErrors'):
+                logger.error("[krill-hostevents] Write concern error when storing availability: %s",
+                             exp.details['writeConcernErrors'])
+                self.metrics.incr('availability.errors.write_concern')
+                self.requeue_availability(dirty)
+            else:
+                logger.error("[krill-hostevents] %d availability records rejected: %s",
+                             len(exp.details.get('writeErrors', [])), exp.details.get('writeErrors', [])[:1])
+                self.metrics.incr('availability.errors.rejected', len(exp.details.get('writeErrors', [])))
+                with self.availability_lock:
+                    for query in dirty:
+                        self.availability_closing.pop(query, None)
+        except AutoReconnect, exp:
+            logger.error("[krill-hostevents] Autoreconnect exception when storing availability: %s", str(exp))
+            self.set_connection_state(SWITCHING)
+            self.metrics.incr('db.autoreconnects')
+            self.requeue_availability(dirty)
+        except Exception, exp:
+            self.set_connection_state(DISCONNECTED)
+            logger.error("[krill-hostevents] Database error occurred when storing availability: %s", exp)
+            self.requeue_availability(dirty)
+        logger.debug("[krill-hostevents] time to store %d availability records (%2.4f)", len(requests), time.time() - now)
+
+    def requeue_availability(self, keys):
+        """
+        Mark availability records dirty again, to be stored on next flush
+
+        Called by the writer thread too, the dirty keys are locked.
+        """
+        with self.availability_lock:
+            self.availability_dirty.update(keys)
+
+    def requeue_availability_events(self, events):
+        """
+        Put back availability events before the pending ones, to be stored on next flush
+        """
+        with self.availability_lock:
+            self.availability_events[:0] = events
+
+    def rollover_availability(self):
+        """
+        Close the availability records of the previous days once the day changed
+
+        The seconds between the last check and the end of its day are credited to the last check state,
+        the closed records and the seeded today records (starting at midnight in the last check state)
+        are stored with one bulk operation, and the previous days records are evicted from the cache.
+        """
+        today = datetime.date.today()
+        day = today.strftime('%Y-%m-%d')
+        if day == self.availability_day:
+            return
+
+        now = time.time()
+        midnight_timestamp = int(time.mktime(datetime.datetime.combine(today, datetime.time.min).timetuple()))
+        days_bounds = {}
+        closed = {}
+        seeded = set()
+        for query, data in self.availability_cache.items():
+            if data['day'] == day:
+                continue
+            del self.availability_cache[query]
+
+            # Days do not always last 86400 seconds
+            bounds = days_bounds.get(data['day'])
+            if bounds is None:
+                bounds = days_bounds[data['day']] = day_bounds(data['day'])
+            day_ts, day_end = bounds
+            remaining = day_end - int(data['last_check_timestamp'])
+            if remaining > 0:
+                data["daily_%d" % data['last_check_state']] += remaining
+            data['daily_4'] = day_end - day_ts
+            for value in [ data['daily_0'], data['daily_1'], data['daily_2'], data['daily_3'] ]:
+                data['daily_4'] -= int(value)
+            closed[query] = data
+
+            # Seed today record, unless a check was already recorded today
+            service_id = data['hostname'] + "/" + data['service']
+            today_query = """%s/%s_%s""" % (data['hostname'], data['service'], day)
+            if service_id not in self.services_cache or today_query in self.availability_cache:
+                continue
+            self.availability_cache[today_query] = {
+                'hostname': data['hostname'],
+                'service': data['service'],
+                'day': day,
+                'day_ts': midnight_timestamp,
+                'is_downtime': data['is_downtime'],
+                'daily_0': 0, 'daily_1': 0, 'daily_2': 0, 'daily_3': 0, 'daily_4': self.day_seconds(day),
+                'first_check_state': data['last_check_state'],
+                'first_check_timestamp': midnight_timestamp,
+                'last_check_state': data['last_check_state'],
+                'last_check_timestamp': midnight_timestamp
+            }
+            seeded.add(today_query)
+
+        self.availability_day = day
+        self.availability_warmed = set()
+        self.availability_missing = set()
+        with self.availability_lock:
+            self.availability_dirty.difference_update(closed)
+            self.availability_dirty.difference_update(seeded)
+            self.availability_closing.update(closed)
+
+        if self.availability_mode == AVAILABILITY_EVENTS:
+            # Today records are derived from the events, only the closed days are materialized
+            seeded = set()
+
+        requests = []
+        for query, data in closed.items() + [(q, self.availability_cache[q]) for q in seeded]:
+            q_day = { "hostname": data['hostname'], "service": data['service'], "day": data['day'] }
+            requests.append(ReplaceOne(q_day, dict(data), upsert=True))
+        logger.info("[krill-hostevents] availability day rollover: %d records closed, %d records seeded (%2.4f)",
+                    len(closed), len(seeded), time.time() - now)
+        self.metrics.timing('availability.rollover', time.time() - now)
+        if not requests:
+            return
+
+        keys = set(closed) | seeded
+        if self.writer:
+            if not self.writer.put('store_availability', (requests, keys)):
+                self.requeue_availability(keys)
+            return
+
+        self.store_availability((requests, keys))
+
+    def day_seconds(self, day):
+        """
+        Get the length of a day (YYYY-MM-DD) in seconds, days do not always last 86400 seconds
+        """
+        seconds = self.days_seconds.get(day)
+        if seconds is None:
+            day_ts, day_end = day_bounds(day)
+            seconds = self.days_seconds[day] = day_end - day_ts
+        return seconds
+
+    def warmup_availability(self):
+        """
+        Load all the today availability records of the cached hosts/services into the availability cache
+
+        One query is done per batch of availability_warmup_batch host names and the result is streamed,
+        this avoids one find_one per host/service when the first check results are received.
+        Records already present in the cache are not modified. The hosts/services without a today
+        record are marked as missing, their record is created without querying the DB.
+
+        Each scheduler sends its initial broks done brok: only the hosts not yet warmed up today are loaded.
+        """
+        if not self.services_cache:
+            return
+
+        if not self.is_connected == CONNECTED:
+            logger.warning("[krill-hostevents] availability warm-up skipped, database is not available")
+            return
+
+        now = time.time()
+        day = datetime.date.today().strftime('%Y-%m-%d')
+        if day != self.availability_day:
+            self.rollover_availability()
+        services = {}
+        for service_id, s in self.services_cache.items():
+            if s['hostname'] not in self.availability_warmed:
+                services.setdefault(s['hostname'], []).append(s['service'])
+        if not services:
+            return
+        hostnames = sorted(services)
+        loaded = 0
+        missing = 0
+        materialized = 0
+        try:
+            for i in range(0, len(hostnames), self.availability_warmup_batch):
+                batch = hostnames[i:i + self.availability_warmup_batch]
+                if self.availability_mode == AVAILABILITY_EVENTS:
+                    materialized += self.materialize_closed_days(batch, day)
+                    cursor = self.warmup_availability_events(batch, day)
+                else:
+                    cursor = self.db[self.hav_collection].find(
+                        { "day": day, "hostname": { "$in": batch } },
+                        batch_size=self.availability_warmup_batch
+                    )
+                for data in cursor:
+                    service_id = data['hostname'] + "/" + data['service']
+                    if service_id not in self.services_cache:
+                        continue
+                    query = """%s/%s_%s""" % (data['hostname'], data['service'], day)
+                    if query in self.availability_cache:
+                        continue
+                    self.availability_cache[query] = data
+                    loaded += 1
+
+                # Batch loaded: the other hosts/services of these hosts have no today record
+                for hostname in batch:
+                    for service in services[hostname]:
+                        query = """%s/%s_%s""" % (hostname, service, day)
+                        if query not in self.availability_cache:
+                            self.availability_missing.add(query)
+                            missing += 1
+                self.availability_warmed.update(batch)
+        except AutoReconnect, exp:
+            logger.error("[krill-hostevents] Autoreconnect exception when loading availability: %s", str(exp))
+            self.set_connection_state(SWITCHING)
+        except Exception, exp:
+            logger.error("[krill-hostevents] Exception when loading availability: %s", str(exp))
+
+        self.warmup_time = time.time() - now
+        self.steady_state_time = time.time() - self.start_time
+        logger.info("[krill-hostevents] availability warm-up: loaded %d records, %d missing, %d closed records stored, "
+                    "for %d hosts in %2.4fs", loaded, missing, materialized, len(hostnames), self.warmup_time)
+        logger.info("[krill-hostevents] availability warm-up: steady state %2.4fs after module start",
+                    self.steady_state_time)
+
+    def warmup_availability_events(self, hostnames, day):
+        """
+        Derive the availability records of a day for the hosts/services of some hosts from their stored events
+        """
+        midnight_timestamp, day_end = day_bounds(day)
+        previous = self.last_availability_events(hostnames, midnight_timestamp)
+        events = self.availability_events_between(hostnames, midnight_timestamp, day_end)
+
+        for hostname, service in set(previous) | set(events):
+            data = daily_from_events(hostname, service, day, previous.get((hostname, service)), events.get((hostname, service), []))
+            last = events[(hostname, service)][-1] if (hostname, service) in events else previous[(hostname, service)]
+            self.availability_states[hostname + "/" + service] = (last['state'], last['downtime'])
+            yield data
+
+    def last_availability_events(self, hostnames, timestamp):
+        """
+        Get the last stored event before a timestamp of the hosts/services of some hosts, by (hostname, service)
+        """
+        previous = {}
+        for state in self.db[self.hav_events_collection].aggregate([
+            { "$match": { "hostname": { "$in": hostnames }, "timestamp": { "$lt": timestamp } } },
+            { "$sort": { "timestamp": 1 } },
+            { "$group": {
+                "_id": { "hostname": "$hostname", "service": "$service" },
+                "timestamp": { "$last": "$timestamp" },
+                "state": { "$last": "$state" },
+                "downtime": { "$last": "$downtime" }
+            } }
+        ], allowDiskUse=True):
+            previous[(state['_id']['hostname'], state['_id']['service'])] = state
+        return previous
+
+    def availability_events_between(self, hostnames, start, end):
+        """
+        Get the stored events between two timestamps of the hosts/services of some hosts,
+        sorted by timestamp, by (hostname, service)
+        """
+        events = {}
+        for event in self.db[self.hav_events_collection].find(
+            { "hostname": { "$in": hostnames }, "timestamp": { "$gte": start, "$lt": end } },
+            batch_size=self.availability_warmup_batch
+        ).sort('timestamp', 1):
+            events.setdefault((event['hostname'], event['service']), []).append(event)
+        return events
+
+    def materialize_closed_days(self, hostnames, day):
+        """
+        Store the missing daily documents of the availability_catchup_days days before day for the
+        hosts/services of some hosts, derived from their stored events
+
+        In events mode, the daily documents of the previous days are only stored by the day rollover:
+        the days ended while the module was stopped are closed here. Returns the number of stored documents.
+        """
+        if not self.availability_catchup_days:
+            return 0
+        today = datetime.datetime.strptime(day, '%Y-%m-%d').date()
+        days = [(today - datetime.timedelta(days=n)).strftime('%Y-%m-%d')
+                for n in range(self.availability_catchup_days, 0, -1)]
+        first_timestamp = day_bounds(days[0])[0]
+        midnight_timestamp = day_bounds(day)[0]
+
+        stored = set()
+        for data in self.db[self.hav_collection].find(
+            { "day": { "$in": days }, "hostname": { "$in": hostnames } },
+            { "hostname": 1, "service": 1, "day": 1 }
+        ):
+            stored.add("""%s/%s_%s""" % (data['hostname'], data['service'], data['day']))
+        with self.availability_lock:
+            stored.update(self.availability_closing)
+
+        previous = self.last_availability_events(hostnames, first_timestamp)
+        events = self.availability_events_between(hostnames, first_timestamp, midnight_timestamp)
+        requests = []
+        for hostname, service in set(previous) | set(events):
+            if hostname + "/" + service not in self.services_cache:
+                continue
+            last = previous.get((hostname, service))
+            remaining = events.get((hostname, service), [])
+            for closed_day in days:
+                day_end = day_bounds(closed_day)[1]
+                day_events = []
+                while remaining and remaining[0]['timestamp'] < day_end:
+                    day_events.append(remaining.pop(0))
+                if """%s/%s_%s""" % (hostname, service, closed_day) not in stored:
+                    data = daily_from_events(hostname, service, closed_day, last, day_events, closed=True)
+                    if data is not None:
+                        q_day = { "hostname": hostname, "service": service, "day": closed_day }
+                        requests.append(ReplaceOne(q_day, data, upsert=True))
+                if day_events:
+                    last = day_events[-1]
+
+        if requests:
+            if not self.writer or not self.writer.put('store_availability', (requests, set())):
+                self.store_availability((requests, set()))
+        return len(requests)
+
+    def save_state(self, clean=False):
+        """
+        Checkpoint the hosts/services, availability and logs caches in the local checkpoint file
+
+        The log lines are only restored from a clean (shutdown) checkpoint: the lines of a periodic
+        checkpoint may have been stored in the DB since.
+        """
+        if not self.checkpoint_file:
+            return
+
+        now = time.time()
+        with self.availability_lock:
+            # The writer thread may update them while pickling
+            dirty = set(self.availability_dirty)
+            closing = dict(self.availability_closing)
+            events = list(self.availability_events)
+        state = {
+            'saved': now,
+            'clean': clean,
+            'settings': self.checkpoint_settings(),
+            'services_cache': self.services_cache,
+            'objects_info': self.objects_info,
+            'availability_store': self.availability_store,
+            'availability_cache': self.availability_cache,
+            'availability_day': self.availability_day,
+            'availability_dirty': dirty,
+            'availability_closing': closing,
+            'availability_states': self.availability_states,
+            'availability_events': events,
+            'logs_cache': list(self.logs_cache) if clean else []
+        }
+        try:
+            size = save_checkpoint(self.checkpoint_file, state)
+        except Exception, exp:
+            logger.error("[krill-hostevents] Can not checkpoint the state to %s: %s", self.checkpoint_file, str(exp))
+            return
+        self.metrics.timing('checkpoint.save', time.time() - now)
+        logger.info("[krill-hostevents] state checkpoint: %d hosts/services, %d availability records, %d log lines, %d bytes (%2.4f)",
+                    len(self.services_cache), len(self.availability_cache), len(state['logs_cache']), size, time.time() - now)
+
+    def checkpoint_settings(self):
+        """
+        Get the settings the checkpointed caches depend on, a checkpoint saved with other settings is not restored
+        """
+        return {
+            'services_filter': self.services_filter.expression,
+            'logs_filter': self.logs_filter.expression,
+            'availability_mode': self.availability_mode
+        }
+
+    def remove_checkpoint(self):
+        """
+        Remove the local checkpoint file once loaded
+        """
+        try:
+            os.remove(self.checkpoint_file)
+        except OSError, exp:
+            logger.error("[krill-hostevents] Can not remove the state checkpoint %s: %s", self.checkpoint_file, str(exp))
+
+    def load_state(self):
+        """
+        Restore the state of the local checkpoint file, returns True if a state was restored
+
+        The checkpoint file is removed once loaded, the next checkpoint is saved periodically.
+        """
+        if not self.checkpoint_file:
+            return False
+
+        now = time.time()
+        try:
+            state = load_checkpoint(self.checkpoint_file)
+        except Exception, exp:
+            logger.error("[krill-hostevents] Can not load the state checkpoint %s: %s", self.checkpoint_file, str(exp))
+            state = None
+        if state is None:
+            return False
+
+        if state.get('settings') != self.checkpoint_settings():
+            # The cached hosts/services and availability records depend on these settings
+            logger.warning("[krill-hostevents] state checkpoint %s discarded, saved with other settings: %s",
+                           self.checkpoint_file, state.get('settings'))
+            self.remove_checkpoint()
+            return False
+
+        self.services_cache = state['services_cache']
+        self.objects_info = state['objects_info']
+        cache = state['availability_cache']
+        if state['availability_store'] != self.availability_store:
+            # Store changed since the checkpoint
+            self.availability_cache = AvailabilityState() if self.availability_store == STORE_ARRAY else {}
+            for query, data in cache.items():
+                self.availability_cache[query] = data
+        else:
+            self.availability_cache = cache
+        self.availability_day = state['availability_day']
+        self.availability_dirty = state['availability_dirty']
+        self.availability_closing = state['availability_closing']
+        self.availability_states = state['availability_states']
+        self.availability_events = state['availability_events']
+        with self.logs_lock:
+            self.buffer_logs(state['logs_cache'], now)
+        self.remove_checkpoint()
+
+        logger.info("[krill-hostevents] state restored from %s, saved %ds ago: %d hosts/services, %d availability records, %d log lines (%2.4f)",
+                    self.checkpoint_file, now - state['saved'], len(self.services_cache), len(self.availability_cache),
+                    len(state['logs_cache']), time.time() - now)
+        self.metrics.timing('checkpoint.load', time.time() - now)
+        return True
+
+    def reconcile_state(self, day, hostnames):
+        """
+        Read the DB availability records of a day for the restored hosts, in a background thread
+
+        The records are applied by the main loop (apply_reconciled).
+        """
+        now = time.time()
+        records = []
+        try:
+            for i in range(0, len(hostnames), self.availability_warmup_batch):
+                cursor = self.db[self.hav_collection].find(
+                    { "day": day, "hostname": { "$in": hostnames[i:i + self.availability_warmup_batch] } },
+                    batch_size=self.availability_warmup_batch
+                )
+                records.extend(cursor)
+        except Exception, exp:
+            logger.error("[krill-hostevents] Can not reconcile the restored state: %s", str(exp))
+            return
+        logger.info("[krill-hostevents] state reconcile: read %d availability records (%2.4f)", len(records), time.time() - now)
+        self.reconciled = records
+
+    def apply_reconciled(self):
+        """
+        Reconcile the restored availability records with the DB records
+
+        A DB record more recent than the restored record replaces it, the restored records more
+        recent than the DB records (or not stored) are marked dirty to be stored on next flush.
+        """
+        records = dict([("""%s/%s_%s""" % (data['hostname'], data['service'], data['day']), data) for data in self.reconciled])
+        self.reconciled = None
+        replaced = 0
+        dirty = 0
+        for query, data in self.availability_cache.items():
+            if data['day'] != self.availability_day:
+                continue
+            stored = records.get(query)
+            if stored is not None and int(stored['last_check_timestamp']) > int(data['last_check_timestamp']):
+                self.availability_cache[query] = stored
+                replaced += 1
+            elif stored is None or int(stored['last_check_timestamp']) < int(data['last_check_timestamp']):
+                with self.availability_lock:
+                    self.availability_dirty.add(query)
+                dirty += 1
+        logger.info("[krill-hostevents] state reconciled: %d availability records replaced, %d records to store", replaced, dirty)
 
     def manage_brok(self, brok):
         """
         Overloaded parent class manage_brok method:
         - select which broks management functions are to be called
         """
-        manage = getattr(self, 'manage_' + brok.type + '_brok', None)
+        if self.brok_capture:
+            self.brok_capture.capture([brok])
+        manage = self.brok_routes.get(brok.type)
         if manage:
             return manage(brok)
 
+    def build_brok_routes(self):
+        """
+        Get the broks management functions of the module, by brok type
+        """
+        routes = {}
+        for name in dir(self):
+            match = BROK_MANAGER.match(name)
+            if match and callable(getattr(self, name)):
+                routes[match.group(1)] = getattr(self, name)
+        logger.info("[krill-hostevents] managed broks types: %s", ', '.join(sorted(routes)))
+        return routes
+
+    def manage_broks(self, broks):
+        """
+        Manage a list of broks received from the broker
+
+        Only the broks which type is managed by the module are prepared (unpickled) and managed,
+        the other ones are only counted. The log broks are managed together.
+        """
+        if self.brok_capture:
+            self.brok_capture.capture(broks)
+        log_broks = []
+        for b in broks:
+            stats = self.brok_stats.get(b.type)
+            if stats is None:
+                stats = self.brok_stats[b.type] = {'handled': 0, 'skipped': 0, 'prepare_time': 0.0}
+
+            manage = self.brok_routes.get(b.type)
+            if manage is None:
+                stats['skipped'] += 1
+                continue
+
+            start = time.time()
+            b.prepare()
+            stats['prepare_time'] += time.time() - start
+            stats['handled'] += 1
+
+            if b.type == 'log':
+                log_broks.append(b)
+                continue
+            manage(b)
+        if log_broks:
+            self.manage_log_broks(log_broks)
+
+    def brok_totals(self):
+        """
+        Get the handled and skipped broks counts, and the time saved by not preparing the skipped broks
+
+        The saved time is estimated with the mean prepare time of the handled broks.
+        """
+        handled = sum([stats['handled'] for stats in self.brok_stats.values()])
+        skipped = sum([stats['skipped'] for stats in self.brok_stats.values()])
+        prepare_time = sum([stats['prepare_time'] for stats in self.brok_stats.values()])
+        mean = prepare_time / handled if handled else 0.0
+        return handled, skipped, skipped * mean
+
+    def log_brok_stats(self):
+        """
+        Log the handled/skipped broks counters
+        """
+        handled, skipped, saved = self.brok_totals()
+        for brok_type in sorted(self.brok_stats):
+            stats = self.brok_stats[brok_type]
+            logger.debug("[krill-hostevents] broks %s: %d handled, %d skipped, prepare time %2.4fs",
+                         brok_type, stats['handled'], stats['skipped'], stats['prepare_time'])
+        logger.info("[krill-hostevents] broks: %d handled, %d skipped, about %2.4fs saved by not preparing skipped broks",
+                    handled, skipped, saved)
+
+    def dump_metrics(self):
+        """
+        Collect the queues and caches sizes and the broks/writer counters, then dump and push the metrics
+        """
+        metrics = self.metrics
+        metrics.gauge('to_q.depth', self.to_q.qsize() if self.to_q else 0)
+        metrics.gauge('logs_cache.size', len(self.logs_cache))
+        metrics.gauge('availability_cache.size', len(self.availability_cache))
+        metrics.gauge('availability_dirty.size', len(self.availability_dirty))
+        metrics.gauge('availability_events.pending', len(self.availability_events))
+        metrics.gauge('services_cache.size', len(self.services_cache))
+        metrics.gauge('db.connected', 1 if self.is_connected == CONNECTED else 0)
+        metrics.gauge('db.stalled_for', time.time() - self.disconnected_since if self.disconnected_since else 0)
+        metrics.gauge('db.retry_failures', self.breaker.failures)
+        if self.indexes_health is not None:
+            for name, value in self.indexes_health.items():
+                metrics.gauge('indexes.%s' % name, value)
+        for brok_type, stats in self.brok_stats.items():
+            metrics.counter('broks.%s.handled' % brok_type, stats['handled'])
+            metrics.counter('broks.%s.skipped' % brok_type, stats['skipped'])
+        metrics.gauge('broks.saved_time', self.brok_totals()[2])
+        if self.warmup_time is not None:
+            metrics.gauge('availability.warmup_time', self.warmup_time)
+            metrics.gauge('availability.steady_state_time', self.steady_state_time)
+        if self.writer:
+            metrics.gauge('writer.queue', self.writer.qsize())
+            for name, value in self.writer.counters.items():
+                metrics.counter('writer.%s' % name, value)
+        if self.shard_pool:
+            for shard, qsize in enumerate(self.shard_pool.qsizes()):
+                metrics.gauge('shard_%d.queue' % shard, qsize)
+                metrics.counter('shard_%d.broks' % shard, self.shard_pool.counters[shard])
+        metrics.dump(self.metrics_file)
+
+    def object_info(self, host_name, service_description, brok):
+        """
+        Get the host/service description used by the filters
+
+        Services get the host groups of their host
+        """
+        if service_description:
+            host = self.objects_info.get(host_name + "/", {})
+            hostgroups = host.get('hostgroups', [])
+        else:
+            hostgroups = []
+            for group in brok.data.get('hostgroups', None) or []:
+                hostgroups.append(group if isinstance(group, basestring) else group.get_name())
+        return {
+            'host_name': host_name,
+            'service_description': service_description,
+            'business_impact': int(brok.data.get('business_impact', 2)),
+            'hostgroups': hostgroups
+        }
+
+    def accept_log(self, doc):
+        """
+        Logs filter decision for the host/service of a log line document, memoized per host/service
+        """
+        key = (doc['host_name'], doc['service_description'])
+        included = self.logs_filter_decisions.get(key)
+        if included is None:
+            obj = self.objects_info.get(doc['host_name'] + "/" + doc['service_description'])
+            if obj is None:
+                obj = {'host_name': doc['host_name'], 'service_description': doc['service_description'],
+                       'business_impact': None, 'hostgroups': []}
+            included = self.logs_filter_decisions[key] = self.logs_filter.match_object(obj)
+        return included
+
     def manage_initial_host_status_brok(self, brok):
         start = time.clock()
         host_name = brok.data['host_name']
@@ -347,6 +1710,18 @@ class MongoLogs(BaseModule):
         self.services_cache[service_id] = { "hostname": host_name, "service": service_description }
         logger.info("[krill-hostevents] host registered: %s (bi=%d)", service_id, brok.data["business_impact"])
 
+        if self.filters_need_info:
+            self.objects_info[service_id] = self.object_info(host_name, service_description, brok)
+
+    def manage_initial_broks_done_brok(self, brok):
+        """
+        All the initial status broks of a scheduler are received: services cache is ready
+        """
+        logger.info("[krill-hostevents] initial broks done, %d hosts/services registered", len(self.services_cache))
+        # Hosts/services information may have changed
+        self.logs_filter_decisions = {}
+        self.warmup_availability()
+
     def manage_host_check_result_brok(self, brok):
         start = time.clock()
         host_name = brok.data['host_name']
@@ -365,36 +1740,18 @@ class MongoLogs(BaseModule):
         service_id = host_name+"/"+service_description
         logger.debug("[krill-hostevents] initial service status received: %s (bi=%d)", host_name, int (brok.data["business_impact"]))
 
-        # Filter service if needed: reference service in services cache ...
-        # ... if description filter matches ...
-        if self.filter_service_description:
-            pat = re.compile(self.filter_service_description, re.IGNORECASE)
-            if pat.search(service_id):
-                self.services_cache[service_id] = { "hostname": host_name, "service": service_description }
-                logger.info("[krill-hostevents] service description filter matches for: %s (bi=%d)", service_id, brok.data["business_impact"])
-
-        # ... or if criticality filter matches.
-        if self.filter_service_criticality:
-            include = False
-            bi = int (brok.data["business_impact"])
-            if self.filter_service_criticality.startswith('>='):
-                if bi >= int(self.filter_service_criticality[2:]):
-                    include = True
-            elif self.filter_service_criticality.startswith('<='):
-                if bi <= int(self.filter_service_criticality[2:]):
-                    include = True
-            elif self.filter_service_criticality.startswith('>'):
-                if bi > int(self.filter_service_criticality[1:]):
-                    include = True
-            elif self.filter_service_criticality.startswith('<'):
-                if bi < int(self.filter_service_criticality[1:]):
-                    include = True
-            elif self.filter_service_criticality.startswith('='):
-                if bi == int(self.filter_service_criticality[1:]):
-                    include = True
-            if include:
-                self.services_cache[service_id] = { "hostname": host_name, "service": service_description }
-                logger.info("[krill-hostevents] criticality filter matches for: %s (bi=%d)", service_id, brok.data["business_impact"])
+        obj = self.object_info(host_name, service_description, brok)
+        if self.filters_need_info:
+            self.objects_info[service_id] = obj
+
+        # Filter service if needed: reference service in services cache if the filter matches
+        key = (service_id, obj['business_impact'], tuple(obj['hostgroups']))
+        included = self.services_filter_decisions.get(key)
+        if included is None:
+            included = self.services_filter_decisions[key] = self.services_filter.match_object(obj, default=False)
+        if included:
+            self.services_cache[service_id] = { "hostname": host_name, "service": service_description }
+            logger.info("[krill-hostevents] services filter matches for: %s (bi=%d)", service_id, brok.data["business_impact"])
 
     def manage_service_check_result_brok(self, brok):
         start = time.clock()
@@ -411,23 +1768,27 @@ class MongoLogs(BaseModule):
         """
         Parse a Shinken log brok to enqueue a log line for DB insertion
         """
-        line = brok.data['log']
-        if re.match("^\[[0-9]*\] [A-Z][a-z]*.:", line):
-            # Match log which NOT have to be stored
-            logger.warning('[krill-hostevents] do not store: %s', line)
-            return
+        self.manage_log_broks([brok])
 
-        logline = Logline(line=line)
-        values = logline.as_dict()
-
-        if logline.logclass == LOGCLASS_INVALID:
-            logger.info("[krill-hostevents] This line is invalid: %s", line)
-            return
-        elif logline.logclass == LOGCLASS_PASSIVECHECK or logline.logclass == LOGCLASS_INFO or logline.logclass == LOGCLASS_PROGRAM or logline.logclass == LOGCLASS_COMMAND:
-            return
-        logger.debug('[krill-hostevents] store log line values: %s', values)
-        self.logs_cache.append(values)
-        return
+    def manage_log_broks(self, broks):
+        """
+        Parse a batch of Shinken log broks to enqueue their log lines for DB insertion
+        """
+        start = time.time()
+        invalid = InvalidLines()
+        accept_type = self.logs_filter.match_type if self.logs_filter else None
+        object_rules = self.logs_filter.has_object_rules()
+        for values in parse_stored([b.data['log'] for b in broks], invalid, accept_type):
+            if object_rules and values['host_name'] and not self.accept_log(values):
+                continue
+            logger.debug('[krill-hostevents] store log line values: %s', values)
+            self.cache_log(values)
+        self.metrics.timing('logs.parse', time.time() - start)
+        self.metrics.incr('logs.invalid', len(invalid))
+
+        if invalid:
+            logger.info("[krill-hostevents] %d invalid lines (%s), e.g.: %s",
+                        len(invalid), invalid.reasons, invalid.samples[0][0])
 
     def record_availability(self, hostname, service, b):
         """
@@ -457,10 +1818,6 @@ class MongoLogs(BaseModule):
         'last_chk': 1433785101 / 'last_state_change': 1433736035.927526
         'in_scheduled_downtime': False
         """
-        if not self.is_connected == CONNECTED:
-            logger.warning("[krill-hostevents] availability not recorded: %s/%s: %s", hostname, service, b.data)
-            return
-
         logger.debug("[krill-hostevents] record availability for: %s/%s: %s", hostname, service, b.data['state'])
         logger.debug("[krill-hostevents] record availability: %s/%s: %s", hostname, service, b.data)
 
@@ -478,32 +1835,53 @@ class MongoLogs(BaseModule):
         scheduled_downtime = bool(b.data['in_scheduled_downtime'])
         # Day
         day = datetime.date.today()
-        yesterday = day - datetime.timedelta(days=1)
+
+        # Close the previous day records first
+        if day.strftime('%Y-%m-%d') != self.availability_day:
+            self.rollover_availability()
 
         # Cache index ...
         query = """%s/%s_%s""" % (hostname, service, day)
         q_day = { "hostname": hostname, "service": service, "day": day.strftime('%Y-%m-%d') }
-        q_yesterday = { "hostname": hostname, "service": service, "day": yesterday.strftime('%Y-%m-%d') }
 
-        # Test if record for current day still exists
+        # Test if record for current day still exists, only query the DB on a cache miss
         exists = False
-        try:
-            self.availability_cache[query] = self.db[self.hav_collection].find_one( q_day )
-            if '_id' in self.availability_cache[query]:
-                exists = True
-                logger.debug("[krill-hostevents] found a today record for: %s", query)
-
-                # Test if yesterday record exists ...
-                # TODO: Not yet implemented:
-                # - update yesterday with today's first received check will provide a more accurate information.
-                # data_yesterday = self.db[self.hav_collection].find_one( q_yesterday )
-                # if '_id' in data_yesterday:
-                    # exists = True
-                    # logger.info("[krill-hostevents] found a yesterday record for: %s", query)
-        except TypeError, exp:
-            logger.debug("[krill-hostevents] Exception when querying database - no cache query available: %s", str(exp))
-        except Exception, exp:
-            logger.error("[krill-hostevents] Exception when querying database: %s", str(exp))
+        if query in self.availability_cache:
+            exists = True
+        elif query in self.availability_missing:
+            # No today record, known by the warm-up
+            self.availability_missing.discard(query)
+        else:
+            if not self.is_connected == CONNECTED:
+                logger.warning("[krill-hostevents] availability not recorded: %s/%s: %s", hostname, service, b.data)
+                return
+
+            try:
+                if self.availability_mode == AVAILABILITY_EVENTS:
+                    data = self.load_availability_events(hostname, service, q_day['day'], midnight_timestamp)
+                else:
+                    data = self.db[self.hav_collection].find_one( q_day )
+                if data:
+                    exists = True
+                    self.availability_cache[query] = data
+                    logger.debug("[krill-hostevents] found a today record for: %s", query)
+                    # Yesterday records are closed by the day rollover
+            except AutoReconnect, exp:
+                logger.error("[krill-hostevents] Autoreconnect exception when querying availability: %s", str(exp))
+                self.set_connection_state(SWITCHING)
+                return
+            except Exception, exp:
+                logger.error("[krill-hostevents] Exception when querying database: %s", str(exp))
+                return
+
+        if self.availability_store == STORE_ARRAY:
+            # Update the record row in place
+            self.availability_cache.record(query, hostname, service, b.data['state_id'], int(b.data['last_chk']),
+                                           int(seconds_today), int(midnight_timestamp), scheduled_downtime)
+            if self.availability_mode == AVAILABILITY_EVENTS:
+                self.record_availability_event(hostname, service, b.data['state_id'], int(b.data['last_chk']), scheduled_downtime)
+            else:
+                self.store_availability_record(query, q_day)
             return
 
         # Configure recorded data
@@ -556,7 +1934,7 @@ class MongoLogs(BaseModule):
         self.availability_cache[query] = data
 
         # Unchecked state for all day duration minus all states duration
-        data['daily_4'] = 86400
+        data['daily_4'] = self.day_seconds(q_day['day'])
         for value in [ data['daily_0'], data['daily_1'], data['daily_2'], data['daily_3'] ]:
             data['daily_4'] -= int(value)
 
@@ -566,17 +1944,121 @@ class MongoLogs(BaseModule):
 
         self.availability_cache[query] = data
 
+        if self.availability_mode == AVAILABILITY_EVENTS:
+            self.record_availability_event(hostname, service, current_state_id, int(b.data['last_chk']), scheduled_downtime)
+        else:
+            self.store_availability_record(query, q_day)
+
+    def record_availability_event(self, hostname, service, state_id, last_chk, in_downtime):
+        """
+        Store a transition event if the state or the downtime status of a host/service changed
+        """
+        service_id = hostname + "/" + service
+        state = (state_id, '1' if in_downtime else '0')
+        previous = self.availability_states.get(service_id)
+        if previous == state:
+            return
+        self.availability_states[service_id] = state
+
+        self.availability_events.append(transition_event(hostname, service, last_chk, state_id, in_downtime, previous))
+        self.metrics.incr('availability.events')
+        if self.availability_write_behind and len(self.availability_events) < self.availability_flush_threshold:
+            return
+        self.flush_availability()
+
+    def store_availability_events(self, events):
+        """
+        Store availability events in the DB, they are stored on next flush if storing fails
+
+        The events ids are deterministic, an event stored again is ignored.
+        """
+        if not self.is_connected == CONNECTED:
+            if not self.open():
+                logger.warning("[krill-hostevents] availability events storing failed, %d events to store", len(events))
+                self.requeue_availability_events(events)
+                return
+
+        now = time.time()
+        try:
+            self.db.get_collection(self.hav_events_collection, write_concern=WriteConcern(**DURABILITY_MODES[self.availability_durability])).insert_many(events, ordered=False)
+            self.metrics.timing('availability.events_store', time.time() - now)
+        except BulkWriteError, exp:
+            errors = [e for e in exp.details.get('writeErrors', []) if e.get('code') != 11000]
+            if exp.details.get('writeConcernErrors'):
+                # The server is reachable, the events are stored again (same ids)
+                logger.error("[krill-hostevents] Write concern error when storing availability events: %s",
+                             exp.details['writeConcernErrors'])
+                self.metrics.incr('availability.errors.write_concern')
+                self.requeue_availability_events(events)
+            elif errors:
+                logger.error("[krill-hostevents] Errors when storing availability events: %s", errors)
+        except AutoReconnect, exp:
+            logger.error("[krill-hostevents] Autoreconnect exception when storing availability events: %s", str(exp))
+            self.set_connection_state(SWITCHING)
+            self.metrics.incr('db.autoreconnects')
+            self.requeue_availability_events(events)
+        except Exception, exp:
+            self.set_connection_state(DISCONNECTED)
+            logger.error("[krill-hostevents] Database error occurred when storing availability events: %s", exp)
+            self.requeue_availability_events(events)
+        logger.debug("[krill-hostevents] time to store %d availability events (%2.4f)", len(events), time.time() - now)
+
+    def load_availability_events(self, hostname, service, day, midnight_timestamp):
+        """
+        Derive the today availability record of a host/service from its stored events
+
+        Returns None if no event was ever stored for the host/service.
+        """
+        collection = self.db[self.hav_events_collection]
+        q_service = { "hostname": hostname, "service": service }
+        previous = collection.find_one(dict(q_service, timestamp={ "$lt": midnight_timestamp }),
+                                       sort=[('timestamp', -1)])
+        events = list(collection.find(dict(q_service, timestamp={ "$gte": midnight_timestamp })).sort('timestamp', 1))
+        data = daily_from_events(hostname, service, day, previous, events)
+        if data is None:
+            return None
+
+        last = events[-1] if events else previous
+        self.availability_states[hostname + "/" + service] = (last['state'], last['downtime'])
+        return data
+
+    def store_availability_record(self, query, q_day):
+        """
+        Store an updated availability record of the cache, or mark it dirty with write-behind
+        """
+        # Write-behind: the cache is the source of truth, records are flushed periodically
+        if self.availability_write_behind:
+            with self.availability_lock:
+                self.availability_dirty.add(query)
+            if len(self.availability_dirty) >= self.availability_flush_threshold:
+                self.flush_availability()
+            return
+
+        if self.writer:
+            # The cached record is still updated while the request is queued
+            if not self.writer.put('store_availability', ([ReplaceOne(q_day, dict(self.availability_cache[query]), upsert=True)], set([query]))):
+                self.requeue_availability([query])
+            return
+
+        if not self.is_connected == CONNECTED:
+            logger.warning("[krill-hostevents] availability not stored: %s", query)
+            return
+
         # Store cached values ...
         try:
-            logger.debug("[krill-hostevents] store for: %s", self.availability_cache[query])
+            data = self.availability_cache[query]
+            logger.debug("[krill-hostevents] store for: %s", data)
             # self.db[self.hav_collection].save(self.availability_cache[query])
-            self.db[self.hav_collection].replace_one(q_day, self.availability_cache[query], upsert=True)
+            start = time.time()
+            self.hav_db_collection().replace_one(q_day, data, upsert=True)
+            self.metrics.timing('availability.upsert', time.time() - start)
         except AutoReconnect, exp:
             logger.error("[krill-hostevents] Autoreconnect exception when updating availability: %s", str(exp))
-            self.is_connected = SWITCHING
+            self.set_connection_state(SWITCHING)
+            self.metrics.incr('db.autoreconnects')
             # Abort update ... no backlog management currently!
         except Exception, exp:
-            self.is_connected = DISCONNECTED
+            self.set_connection_state(DISCONNECTED)
             logger.error("[krill-hostevents] Database error occurred: %s", exp)
             raise MongoLogsError
 
@@ -584,11 +2066,136 @@ class MongoLogs(BaseModule):
         self.set_proctitle(self.name)
         self.set_exit_handler()
 
+        if self.brok_capture_file:
+            try:
+                self.brok_capture = BrokCapture(self.brok_capture_file, self.brok_capture_max_size * 1024 * 1024)
+            except (IOError, OSError), exp:
+                logger.error("[krill-hostevents] Can not capture the broks in %s: %s", self.brok_capture_file, str(exp))
+
+        if self.ingestion_shards > 1:
+            self.route_to_shards()
+        else:
+            self.manage_queue()
+
+        if self.brok_capture:
+            self.brok_capture.close()
+
+    def route_broks(self, broks):
+        """
+        Prepare the broks which type is managed by the module and route them to the shards
+        """
+        if self.brok_capture:
+            self.brok_capture.capture(broks)
+        routed = []
+        for b in broks:
+            stats = self.brok_stats.get(b.type)
+            if stats is None:
+                stats = self.brok_stats[b.type] = {'handled': 0, 'skipped': 0, 'prepare_time': 0.0}
+            if b.type not in self.brok_routes:
+                stats['skipped'] += 1
+                continue
+
+            start = time.time()
+            b.prepare()
+            stats['prepare_time'] += time.time() - start
+            stats['handled'] += 1
+            routed.append(b)
+        self.shard_pool.route(routed)
+
+    def route_to_shards(self):
+        """
+        Sharded ingestion main loop: start the shards processes and route the received broks to them
+        """
+        self.shard_pool = ShardPool(self.shard_main, self.ingestion_shards, self.ingestion_queue_size, self.name)
+        self.shard_pool.start()
+
+        stats_next_time = time.time() + self.commit_period
+        metrics_next_time = time.time() + self.metrics_period
+
+        while not self.interrupted:
+            now = time.time()
+
+            # Shards check and broks counters
+            if stats_next_time < now:
+                stats_next_time = now + self.commit_period
+                self.shard_pool.check()
+                self.log_brok_stats()
+                logger.info("[krill-hostevents] shards queues: %s, routed broks: %s",
+                            self.shard_pool.qsizes(), self.shard_pool.counters)
+
+            # Metrics dump ?
+            if self.metrics.enabled and metrics_next_time < now:
+                metrics_next_time = now + self.metrics_period
+                self.dump_metrics()
+
+            try:
+                l = self.to_q.get(timeout=1)
+            except Queue.Empty:
+                continue
+            self.route_broks(l)
+
+        # Wait for the shards to manage all the routed broks
+        self.shard_pool.stop()
+
+    def shard_main(self, shard, queue):
+        """
+        Shard process main function: manage the broks of the shard queue with own caches and DB connection
+
+        Indexes are created and logs are rotated by the first shard only.
+        """
+        self.shard = shard
+        self.shard_pool = None
+        self.to_q = queue
+        # The broks are captured by the module process
+        self.brok_capture = None
+        self.set_proctitle('%s-shard-%d' % (self.name, shard))
+
+        self.metrics = self.build_metrics('%s.shard_%d' % (self.metrics_prefix, shard))
+        if self.metrics_file:
+            self.metrics_file = '%s.shard-%d' % (self.metrics_file, shard)
+        if self.checkpoint_file:
+            self.checkpoint_file = '%s.shard-%d' % (self.checkpoint_file, shard)
+        if shard:
+            # Indexes are verified and created by the first shard only
+            self.create_indexes = False
+        if self.logs_journal_path:
+            try:
+                self.logs_journal = LogsJournal(os.path.join(self.logs_journal_path, 'shard-%d' % shard),
+                                                self.logs_journal_segment_size * 1024 * 1024)
+            except Exception, exp:
+                logger.error("[krill-hostevents] Can not open the shard %d logs journal: %s", shard, str(exp))
+                self.logs_journal = None
+
+        self.manage_queue()
+
+    def manage_queue(self):
+        """
+        Broks management main loop
+        """
+        self.start_time = time.time()
+
+        # Restore the state of the previous run
+        restored = self.load_state()
+
         # Open database connection
-        self.open()
+        self.open(wait=True)
+        if restored and self.is_connected == CONNECTED and self.availability_mode == AVAILABILITY_DAILY:
+            # The restored records of the events mode are derived from the events, they are not stored in the DB
+            hostnames = sorted(set([data['hostname'] for query, data in self.availability_cache.items()]))
+            thread = threading.Thread(target=self.reconcile_state, name='mongo-logs-reconcile',
+                                      args=(self.availability_day, hostnames))
+            thread.daemon = True
+            thread.start()
+
+        # Start the background writer
+        if self.writer_thread:
+            self.writer = LogsWriter(self, self.writer_queue_size, self.writer_queue_policy)
+            self.writer.start()
 
         db_commit_next_time = time.time()
         db_test_connection = time.time()
+        metrics_next_time = time.time() + self.metrics_period
+        checkpoint_next_time = time.time() + self.checkpoint_period
 
         while not self.interrupted:
             logger.debug("[krill-hostevents] queue length: %s", self.to_q.qsize())
@@ -599,7 +2206,11 @@ class MongoLogs(BaseModule):
                 logger.debug("[krill-hostevents] Testing database connection ...")
                 # Test connection every 5 seconds ...
                 db_test_connection = now + self.db_test_period
-                if self.is_connected == DISCONNECTED:
+                if self.is_connected == CONNECTED:
+                    thread = threading.Thread(target=self.check_connection, name='mongo-logs-check')
+                    thread.daemon = True
+                    thread.start()
+                else:
                     logger.warning("[krill-hostevents] Trying to connect database ...")
                     self.open()
 
@@ -609,19 +2220,67 @@ class MongoLogs(BaseModule):
                 # Commit periodically ...
                 db_commit_next_time = now + self.commit_period
                 self.commit_logs()
+                self.flush_availability()
+                self.log_brok_stats()
+                if self.writer:
+                    self.writer.log_counters()
+            elif self.commit_due(now):
+                # ... or as soon as there are too many or too old lines
+                logger.debug("[krill-hostevents] Logs commit due ...")
+                self.commit_logs()
 
-            # Logs rotation ?
-            if self.next_logs_rotation < now:
-                logger.debug("[krill-hostevents] Logs rotation time ...")
-                self.rotate_logs()
+            # Checkpoint reconciled with the DB ?
+            if self.reconciled is not None:
+                self.apply_reconciled()
+
+            # Day rollover ?
+            self.rollover_availability()
 
-            # Broks management ...
-            l = self.to_q.get()
-            for b in l:
-                b.prepare()
-                self.manage_brok(b)
+            # State checkpoint ?
+            if self.checkpoint_file and self.checkpoint_period and checkpoint_next_time < now:
+                checkpoint_next_time = now + self.checkpoint_period
+                self.save_state()
+
+            # Metrics dump ?
+            if self.metrics.enabled and metrics_next_time < now:
+                metrics_next_time = now + self.metrics_period
+                self.dump_metrics()
+
+            # Logs rotation ? (first shard only with sharded ingestion)
+            if self.next_logs_rotation < now and not self.shard:
+                logger.debug("[krill-hostevents] Logs rotation time ...")
+                if self.writer:
+                    # Avoid queuing the rotation again until the writer schedules the next one
+                    self.next_logs_rotation = now + 600
+                    self.writer.put('rotate_logs')
+                else:
+                    self.rotate_logs()
+
+            # Broks management ... do not wait too long for broks, periodic tasks must run
+            try:
+                l = self.to_q.get(timeout=1)
+            except Queue.Empty:
+                continue
+            if l is None:
+                # Sharded ingestion stop request
+                break
+            self.manage_broks(l)
 
             logger.debug("[krill-hostevents] time to manage %s broks (%3.4fs)", len(l), time.time() - now)
 
+        # Store pending availability records
+        self.flush_availability()
+
+        # Wait for the writer to store all the queued batches
+        if self.writer:
+            self.writer.stop()
+
+        # Close logs journal
+        if self.logs_journal:
+            self.logs_journal.close()
+
+        # Checkpoint the state for the next run, with the log lines not yet stored
+        self.save_state(clean=True)
+
         # Close database connection
         self.close()
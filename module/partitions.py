@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Time partitioned logs collections.
+
+Log documents are stored in one collection per day or per month, named after the logs
+collection (logs_2015_09 or logs_2015_09_10). A catalog collection (logs_partitions)
+stores the time range of each partition, readers use it to find the partitions to query.
+"""
+
+import time
+import datetime
+
+PARTITION_NONE = 'none'
+PARTITION_DAY = 'day'
+PARTITION_MONTH = 'month'
+PARTITION_MODES = [PARTITION_NONE, PARTITION_DAY, PARTITION_MONTH]
+
+# Seconds after which a known partition is looked up again in the catalog:
+# another process (shard) may have dropped it
+KNOWN_RECHECK = 60
+
+
+def partition_bounds(timestamp, mode):
+    """
+    Get the (start, end) timestamps of the partition containing a timestamp (local time)
+    """
+    day = datetime.date.fromtimestamp(timestamp)
+    if mode == PARTITION_DAY:
+        first = day
+        last = day + datetime.timedelta(days=1)
+    else:
+        first = day.replace(day=1)
+        last = (first + datetime.timedelta(days=32)).replace(day=1)
+    return (int(time.mktime(first.timetuple())), int(time.mktime(last.timetuple())))
+
+
+def partition_name(collection, timestamp, mode):
+    day = datetime.date.fromtimestamp(timestamp)
+    if mode == PARTITION_DAY:
+        return '%s_%s' % (collection, day.strftime('%Y_%m_%d'))
+    return '%s_%s' % (collection, day.strftime('%Y_%m'))
+
+
+def catalog_name(collection):
+    return '%s_partitions' % collection
+
+
+def partitions_for_range(db, collection, start, end):
+    """
+    Get the names of the partitions of a logs collection which contain logs between start and end,
+    sorted by time
+    """
+    cursor = db[catalog_name(collection)].find(
+        {'start': {'$lt': end}, 'end': {'$gt': start}}
+    ).sort('start', 1)
+    return [p['name'] for p in cursor]
+
+
+class LogsPartitions(object):
+    """
+    Partitions of a logs collection
+    """
+
+    def __init__(self, collection, mode):
+        self.collection = collection
+        self.mode = mode
+        # Partitions known to be in the catalog: time of the last check
+        self.known = {}
+
+    def split(self, docs):
+        """
+        Group log documents by partition name
+        """
+        partitions = {}
+        # Consecutive lines are very likely in the same partition
+        current_end = current_start = None
+        current = None
+        for doc in docs:
+            ts = doc['time']
+            if current is None or not (current_start <= ts < current_end):
+                current_start, current_end = partition_bounds(ts, self.mode)
+                current = partitions.setdefault(partition_name(self.collection, ts, self.mode), [])
+            current.append(doc)
+        return partitions
+
+    def register(self, db, name, sample_time, indexes=None):
+        """
+        Store a partition in the catalog and create its indexes, once
+
+        Returns True if the partition was registered. A known partition is looked up again in the
+        catalog after KNOWN_RECHECK seconds, it is registered again if it was dropped meanwhile.
+        """
+        now = time.time()
+        checked = self.known.get(name)
+        if checked is not None:
+            if now - checked < KNOWN_RECHECK:
+                return False
+            if db[catalog_name(self.collection)].find_one({'name': name}, {'_id': 1}) is not None:
+                self.known[name] = now
+                return False
+        start, end = partition_bounds(sample_time, self.mode)
+        db[catalog_name(self.collection)].update_one(
+            {'name': name},
+            {'$setOnInsert': {'name': name, 'start': start, 'end': end}},
+            upsert=True
+        )
+        for index_name, keys, unique in indexes or []:
+            db[name].create_index(keys, name=index_name, unique=unique, background=True)
+        self.known[name] = now
+        return True
+
+    def expired(self, db, oldest):
+        """
+        Get the names of the partitions which only contain logs older than oldest
+        """
+        return [p['name'] for p in db[catalog_name(self.collection)].find({'end': {'$lte': oldest}})]
+
+    def drop(self, db, name):
+        db.drop_collection(name)
+        db[catalog_name(self.collection)].delete_one({'name': name})
+        self.known.pop(name, None)
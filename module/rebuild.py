@@ -0,0 +1,327 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Rebuild the daily availability documents from the stored alert and state log lines.
+
+For each host/service, the state changes (HOST/SERVICE ALERT, CURRENT/INITIAL HOST/SERVICE STATE)
+are sorted in one array for all the hosts/services. The time spent in each state up to any
+timestamp is got with cumulative sums, thus the daily durations of all the hosts/services
+are computed at once for all the day boundaries.
+
+The state of a host/service is carried from one day to the next one: time is only counted as
+unchecked (daily_4) before the first known state of the host/service. As with the broker module,
+no document is stored for the days before the first known state of a host/service.
+
+The state changes are loaded from the logs collection and from its time partitions, if any,
+stored with the full or the compact schema.
+
+numpy is required.
+"""
+
+import sys
+import time
+import datetime
+import optparse
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .log_line import SERVICE_STATES, HOST_STATES
+from .partitions import partitions_for_range
+from .compact import TYPE_CODES
+
+STATE_TYPES = ['HOST ALERT', 'SERVICE ALERT',
+               'CURRENT HOST STATE', 'CURRENT SERVICE STATE',
+               'INITIAL HOST STATE', 'INITIAL SERVICE STATE']
+
+# daily_0 .. daily_4, 4 is the unchecked state
+STATES_COUNT = 5
+UNCHECKED = 4
+
+
+def midnight(day):
+    return int(time.mktime(datetime.datetime.combine(day, datetime.time.min).timetuple()))
+
+
+def state_id(state, service):
+    """
+    Alert lines store an integer state, state lines store the state name
+    """
+    if isinstance(state, (int, long)):
+        return state
+    return (SERVICE_STATES if service else HOST_STATES).get(state, 3)
+
+
+class StateEvents(object):
+    """
+    State changes of many hosts/services stored in flat arrays
+    """
+
+    def __init__(self):
+        self.series = {}
+        self.names = []
+        self.sid = array('l')
+        self.time = array('l')
+        self.state = array('b')
+
+    def series_id(self, hostname, service):
+        key = (hostname, service)
+        sid = self.series.get(key)
+        if sid is None:
+            sid = self.series[key] = len(self.names)
+            self.names.append(key)
+        return sid
+
+    def add(self, hostname, service, timestamp, state):
+        self.sid.append(self.series_id(hostname, service))
+        self.time.append(int(timestamp))
+        self.state.append(state)
+
+    def load(self, collection, start, end, batch_size=10000):
+        """
+        Load the state changes stored in a logs collection between start and end timestamps
+        """
+        cursor = collection.find(
+            {'$or': [
+                {'time': {'$gte': start, '$lt': end}, 'type': {'$in': STATE_TYPES}},
+                # Compact schema, the empty service and the 0 state are not stored
+                {'t': {'$gte': start, '$lt': end}, 'y': {'$in': [TYPE_CODES[t] for t in STATE_TYPES]}}
+            ]},
+            {'_id': 0, 'host_name': 1, 'service_description': 1, 'time': 1, 'state': 1,
+             'h': 1, 's': 1, 't': 1, 'st': 1},
+            batch_size=batch_size
+        )
+        for doc in cursor:
+            if 't' in doc:
+                service = doc.get('s', '')
+                self.add(doc['h'], service, doc['t'], state_id(doc.get('st', 0), service))
+            else:
+                service = doc.get('service_description', '')
+                self.add(doc['host_name'], service, doc['time'], state_id(doc['state'], service))
+        return len(self.time)
+
+
+def logs_collections(db, collection, start, end):
+    """
+    Get the names of the collections storing the logs between start and end:
+    the logs collection and its partitions for this time range
+    """
+    return [collection] + partitions_for_range(db, collection, start, end)
+
+
+def daily_durations(events, origin, boundaries):
+    """
+    Compute the seconds spent in each state between consecutive boundaries for all the series
+
+    origin is a timestamp before all the boundaries, the series are in the unchecked state
+    from origin to their first event. Events must be before the last boundary.
+
+    Returns a dict of arrays:
+    - daily: (series, days, states) seconds in each state
+    - first_state/first_time, last_state/last_time: (series, days) first and last event of each day,
+      or the state at the day start and the day start timestamp if no event occurred during the day
+    """
+    boundaries = np.asarray(boundaries, dtype=np.int64)
+    nseries = len(events.names)
+    span = int(boundaries[-1] - origin + 1)
+
+    # One sentinel unchecked event at origin for each series, then the sorted events
+    sentinel = np.arange(nseries, dtype=np.int64)
+    sid = np.concatenate([sentinel, np.frombuffer(events.sid, dtype=np.dtype(events.sid.typecode)).astype(np.int64)])
+    ts = np.concatenate([np.zeros(nseries, dtype=np.int64),
+                         np.frombuffer(events.time, dtype=np.dtype(events.time.typecode)).astype(np.int64) - origin])
+    ts = np.clip(ts, 0, span - 1)
+    state = np.concatenate([np.full(nseries, UNCHECKED, dtype=np.int8),
+                            np.frombuffer(events.state, dtype=np.int8)])
+    # Sentinels first when events are at the same time
+    is_event = np.concatenate([np.zeros(nseries, dtype=np.int8), np.ones(len(events.time), dtype=np.int8)])
+    order = np.lexsort((is_event, ts, sid))
+    key = sid[order] * span + ts[order]
+    sid = sid[order]
+    state = state[order]
+    is_event = is_event[order]
+
+    # Duration of each event: up to the next event of the series, or up to the last boundary
+    end = (sid + 1) * span - 1
+    next_key = np.empty_like(key)
+    next_key[:-1] = key[1:]
+    next_key[-1] = end[-1]
+    last_of_series = np.empty(len(key), dtype=bool)
+    last_of_series[:-1] = sid[1:] != sid[:-1]
+    last_of_series[-1] = True
+    next_key[last_of_series] = end[last_of_series]
+    duration = next_key - key
+
+    # Cumulated time in each state before each event
+    cumulated = np.zeros((len(key), STATES_COUNT), dtype=np.int64)
+    for s in range(STATES_COUNT):
+        contribution = np.where(state == s, duration, 0)
+        cumulated[1:, s] = np.cumsum(contribution)[:-1]
+
+    # Time in each state up to each boundary of each series
+    queries = (np.arange(nseries, dtype=np.int64)[:, None] * span + (boundaries - origin)[None, :])
+    idx = np.searchsorted(key, queries, side='right') - 1
+    elapsed = queries - key[idx]
+    at = cumulated[idx] + np.where(state[idx][..., None] == np.arange(STATES_COUNT), elapsed[..., None], 0)
+    daily = at[:, 1:, :] - at[:, :-1, :]
+
+    # First and last events of each day
+    first = np.searchsorted(key, queries[:, :-1], side='left')
+    after = np.searchsorted(key, queries[:, 1:], side='left')
+    has_events = (after > first)
+    last = after - 1
+    start_idx = idx[:, :-1]
+    first_idx = np.where(has_events, first, start_idx)
+    last_idx = np.where(has_events, last, start_idx)
+    day_start = (boundaries[:-1])[None, :]
+
+    return {
+        'daily': daily,
+        'has_events': has_events,
+        'first_state': state[first_idx],
+        'first_time': np.where(has_events, key[first_idx] - sid[first_idx] * span + origin, day_start),
+        'last_state': state[last_idx],
+        'last_time': np.where(has_events, key[last_idx] - sid[last_idx] * span + origin, day_start),
+    }
+
+
+def availability_documents(events, days, result):
+    """
+    Yield the availability documents of the series and days, from the first event of each series
+    """
+    daily = result['daily']
+    for i, (hostname, service) in enumerate(events.names):
+        for d, day in enumerate(days):
+            if not result['has_events'][i, d] and result['last_state'][i, d] == UNCHECKED:
+                # Day before the first event of the series
+                continue
+            doc = {
+                'hostname': hostname,
+                'service': service,
+                'day': day.strftime('%Y-%m-%d'),
+                'day_ts': midnight(day),
+                'is_downtime': '0',
+                'first_check_state': int(result['first_state'][i, d]),
+                'first_check_timestamp': int(result['first_time'][i, d]),
+                'last_check_state': int(result['last_state'][i, d]),
+                'last_check_timestamp': int(result['last_time'][i, d])
+            }
+            for s in range(STATES_COUNT):
+                doc['daily_%d' % s] = int(daily[i, d, s])
+            yield doc
+
+
+def rebuild(db, logs_collection, hav_collection, first_day, last_day,
+            lookback_days=7, chunk_days=31, batch_size=1000, overwrite=False):
+    """
+    Rebuild the availability documents from first_day to last_day (included)
+
+    Days are processed by chunks of chunk_days days. The state at the beginning of a chunk
+    is got from the state changes of the lookback_days previous days.
+    Existing documents are replaced if overwrite is set, else only the missing days are stored.
+    """
+    from pymongo import ReplaceOne, UpdateOne
+
+    stored = 0
+    day = first_day
+    while day <= last_day:
+        chunk = [day + datetime.timedelta(days=i) for i in range(chunk_days)
+                 if day + datetime.timedelta(days=i) <= last_day]
+        boundaries = [midnight(d) for d in chunk] + [midnight(chunk[-1] + datetime.timedelta(days=1))]
+        origin = boundaries[0] - lookback_days * 86400 - 1
+
+        start = time.time()
+        events = StateEvents()
+        for name in logs_collections(db, logs_collection, origin, boundaries[-1]):
+            events.load(db[name], origin, boundaries[-1])
+        count = len(events.time)
+        loaded = time.time()
+        if events.names:
+            result = daily_durations(events, origin, boundaries)
+            computed = time.time()
+
+            requests = []
+            for doc in availability_documents(events, chunk, result):
+                q_day = {'hostname': doc['hostname'], 'service': doc['service'], 'day': doc['day']}
+                if overwrite:
+                    requests.append(ReplaceOne(q_day, doc, upsert=True))
+                else:
+                    requests.append(UpdateOne(q_day, {'$setOnInsert': doc}, upsert=True))
+                if len(requests) >= batch_size:
+                    db[hav_collection].bulk_write(requests, ordered=False)
+                    stored += len(requests)
+                    requests = []
+            if requests:
+                db[hav_collection].bulk_write(requests, ordered=False)
+                stored += len(requests)
+            print "%s to %s: %d events, %d hosts/services, load %.1fs, compute %.1fs, store %.1fs" % (
+                chunk[0], chunk[-1], count, len(events.names),
+                loaded - start, computed - loaded, time.time() - computed)
+        else:
+            print "%s to %s: no events" % (chunk[0], chunk[-1])
+
+        day = chunk[-1] + datetime.timedelta(days=1)
+    return stored
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]",
+                                   description="Rebuild the mongo-logs daily availability from the stored log lines")
+    parser.add_option('-u', '--uri', default='mongodb://localhost', help="MongoDB connection string [%default]")
+    parser.add_option('-d', '--database', default='shinken', help="database name [%default]")
+    parser.add_option('-l', '--logs-collection', default='logs', help="logs collection name [%default]")
+    parser.add_option('-a', '--hav-collection', default='availability', help="availability collection name [%default]")
+    parser.add_option('-f', '--from', dest='first_day', help="first day to rebuild, YYYY-MM-DD")
+    parser.add_option('-t', '--to', dest='last_day', help="last day to rebuild, YYYY-MM-DD [yesterday]")
+    parser.add_option('--lookback', type='int', default=7, help="days searched for the initial states [%default]")
+    parser.add_option('--chunk', type='int', default=31, help="days rebuilt at once [%default]")
+    parser.add_option('-b', '--batch-size', type='int', default=1000, help="documents per bulk write [%default]")
+    parser.add_option('-o', '--overwrite', action='store_true', default=False,
+                      help="replace the existing documents, default is to only store the missing days")
+    opts, args = parser.parse_args(argv)
+
+    if np is None:
+        parser.error("numpy is required to rebuild the availability")
+    if not opts.first_day:
+        parser.error("--from is required")
+
+    first_day = datetime.datetime.strptime(opts.first_day, '%Y-%m-%d').date()
+    if opts.last_day:
+        last_day = datetime.datetime.strptime(opts.last_day, '%Y-%m-%d').date()
+    else:
+        last_day = datetime.date.today() - datetime.timedelta(days=1)
+
+    from pymongo import MongoClient
+    db = MongoClient(opts.uri)[opts.database]
+
+    start = time.time()
+    stored = rebuild(db, opts.logs_collection, opts.hav_collection, first_day, last_day,
+                     opts.lookback, opts.chunk, opts.batch_size, opts.overwrite)
+    print "Stored %d availability documents in %.1fs" % (stored, time.time() - start)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Sharded ingestion for the mongo-logs module.
+
+The module process routes the broks to N worker processes (shards) by a stable hash of the
+host name. Each shard manages the broks of its hosts with its own caches and DB connection.
+All the broks of a host go through the same queue, in the order they were received.
+
+The module process keeps the last initial status of each host/service, reduced to the fields
+used to register the hosts/services: a restarted shard gets the initial status of its
+hosts/services again to rebuild its services cache.
+"""
+
+import zlib
+import multiprocessing
+
+from shinken.log import logger
+from shinken.brok import Brok
+
+from .log_line import line_host_name
+
+INITIAL_STATUS_TYPES = ('initial_host_status', 'initial_service_status')
+# Initial status fields used to register a host/service and by the filters
+INITIAL_STATUS_FIELDS = ('host_name', 'service_description', 'business_impact', 'hostgroups')
+# Broks per batch when resending the initial status to a shard
+RESEND_BATCH = 1000
+
+
+def shard_of(host_name, shards):
+    """
+    Get the shard of a host, the same for every process and every run
+    """
+    if isinstance(host_name, unicode):
+        host_name = host_name.encode('UTF-8')
+    return (zlib.crc32(host_name) & 0xffffffff) % shards
+
+
+def brok_host_name(brok):
+    """
+    Get the host name of a prepared brok, '' if the brok is not about a host
+    """
+    if brok.type == 'log':
+        line = brok.data['log']
+        if isinstance(line, unicode):
+            line = line.encode('UTF-8')
+        return line_host_name(line)
+    return brok.data.get('host_name', '')
+
+
+def initial_status(brok):
+    """
+    Get a prepared copy of an initial status brok with only the fields used to register its host/service
+    """
+    data = dict([(key, brok.data[key]) for key in INITIAL_STATUS_FIELDS if key in brok.data])
+    if data.get('hostgroups'):
+        data['hostgroups'] = [group if isinstance(group, basestring) else group.get_name() for group in data['hostgroups']]
+    status = Brok(brok.type, data)
+    status.prepare()
+    return status
+
+
+class ShardPool(object):
+    """
+    Shards worker processes and their broks queues
+
+    target(shard, queue) is the worker process main function, it stops when it gets None from its queue.
+    """
+
+    def __init__(self, target, shards, queue_size=100, name='mongo-logs'):
+        self.target = target
+        self.shards = shards
+        self.name = name
+        self.queues = [multiprocessing.Queue(queue_size) for i in range(shards)]
+        self.processes = [None] * shards
+        self.counters = [0] * shards
+        # Last initial status brok of each host/service, per shard, and last initial broks done brok
+        self.initial = [{} for i in range(shards)]
+        self.initial_done = None
+
+    def start_shard(self, shard):
+        process = multiprocessing.Process(target=self.target, args=(shard, self.queues[shard]),
+                                          name='%s-shard-%d' % (self.name, shard))
+        process.daemon = True
+        process.start()
+        self.processes[shard] = process
+        logger.info("[krill-hostevents] shard %d started, pid: %d", shard, process.pid)
+
+    def start(self):
+        for shard in range(self.shards):
+            self.start_shard(shard)
+
+    def check(self):
+        """
+        Restart the dead shards, their queued broks are managed by the new process
+
+        The initial status of the shard hosts/services is queued again for the new process.
+        """
+        for shard, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.error("[krill-hostevents] shard %d died (exit code %s), restarting it", shard, process.exitcode)
+                self.start_shard(shard)
+                self.resend_initial(shard)
+
+    def resend_initial(self, shard):
+        """
+        Queue the initial status broks of a shard, hosts before their services, then the initial broks done brok
+        """
+        initial = self.initial[shard]
+        broks = [initial[key] for key in sorted(initial)]
+        if self.initial_done is not None:
+            broks.append(self.initial_done)
+        for i in range(0, len(broks), RESEND_BATCH):
+            self.queues[shard].put(broks[i:i + RESEND_BATCH])
+            self.counters[shard] += len(broks[i:i + RESEND_BATCH])
+        logger.info("[krill-hostevents] shard %d: %d initial status broks sent again", shard, len(initial))
+
+    def route(self, broks):
+        """
+        Queue prepared broks to their shards
+
+        The log lines which are not about a host go to the first shard, the other broks which
+        are not about a host go to all the shards.
+        """
+        batches = [[] for i in range(self.shards)]
+        for brok in broks:
+            host_name = brok_host_name(brok)
+            if host_name:
+                shard = shard_of(host_name, self.shards)
+                batches[shard].append(brok)
+                if brok.type in INITIAL_STATUS_TYPES:
+                    self.initial[shard][(host_name, brok.data.get('service_description', ''))] = initial_status(brok)
+            elif brok.type == 'log':
+                batches[0].append(brok)
+            else:
+                if brok.type == 'initial_broks_done':
+                    self.initial_done = brok
+                for batch in batches:
+                    batch.append(brok)
+        for shard, batch in enumerate(batches):
+            if batch:
+                self.queues[shard].put(batch)
+                self.counters[shard] += len(batch)
+
+    def qsizes(self):
+        return [queue.qsize() for queue in self.queues]
+
+    def stop(self, timeout=60):
+        """
+        Request the shards to stop once their queued broks are managed, and wait for them
+        """
+        for queue in self.queues:
+            queue.put(None)
+        for shard, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                logger.error("[krill-hostevents] shard %d did not stop in %ds, terminating it", shard, timeout)
+                process.terminate()
+        logger.info("[krill-hostevents] shards stopped, routed broks: %s", self.counters)
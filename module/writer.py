@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Background writer for the mongo-logs module.
+
+The broks management loop prepares batches (log lines, availability records, logs rotation)
+and queues them to a writer thread which is the only one waiting for the DB.
+"""
+
+import time
+import threading
+import Queue
+
+from shinken.log import logger
+
+WRITER_BLOCK = 'block'
+WRITER_DROP_OLDEST = 'drop_oldest'
+WRITER_SPILL = 'spill'
+WRITER_POLICIES = [WRITER_BLOCK, WRITER_DROP_OLDEST, WRITER_SPILL]
+
+# Jobs which may be dropped when the queue is full, and jobs which are never refused
+DROPPABLE_JOBS = ('insert_logs',)
+CONTROL_JOBS = ('rotate_logs', 'replay_journal')
+
+
+class LogsWriter(threading.Thread):
+    """
+    Writer thread fed through a bounded queue
+
+    Each queued job is a tuple (kind, payload) where kind is the name of the
+    module method to call with the payload: insert_logs, store_availability,
+    store_availability_events, rotate_logs, replay_journal
+
+    When the queue is full, the configured policy applies:
+    - block: wait until the writer has some room in its queue
+    - drop_oldest: drop the oldest queued insert_logs job to make room for the new job
+    - spill: refuse the job, the caller keeps its data for a next try. The refused log lines are
+      put back in the logs cache, which overflows in the logs journal (see cache_log): the lines
+      are still inserted in order
+
+    Only the insert_logs jobs are ever dropped: when no insert_logs job is queued, the drop_oldest
+    policy waits for some room. The control jobs (rotate_logs, replay_journal) are never refused.
+    """
+
+    def __init__(self, module, queue_size=100, policy=WRITER_BLOCK):
+        threading.Thread.__init__(self, name='mongo-logs-writer')
+        self.daemon = True
+        self.module = module
+        self.policy = policy
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.interrupted = False
+
+        self.counters = {
+            'queued': 0,
+            'written': 0,
+            'blocked': 0,
+            'dropped': 0,
+            'refused': 0,
+            'errors': 0
+        }
+
+    def put(self, kind, payload=None):
+        """
+        Queue a job for the writer thread
+
+        Returns False if the job was refused (spill policy), else True.
+        """
+        job = (kind, payload)
+        try:
+            self.queue.put_nowait(job)
+            self.counters['queued'] += 1
+            return True
+        except Queue.Full:
+            pass
+
+        if self.policy == WRITER_SPILL and kind not in CONTROL_JOBS:
+            self.counters['refused'] += 1
+            return False
+
+        if self.policy == WRITER_DROP_OLDEST:
+            while self.drop_oldest():
+                try:
+                    self.queue.put_nowait(job)
+                    self.counters['queued'] += 1
+                    return True
+                except Queue.Full:
+                    continue
+
+        # Block until the writer makes some room
+        self.counters['blocked'] += 1
+        self.queue.put(job)
+        self.counters['queued'] += 1
+        return True
+
+    def drop_oldest(self):
+        """
+        Remove the oldest queued insert_logs job, returns False if none is queued
+        """
+        with self.queue.mutex:
+            for job in self.queue.queue:
+                if job is not None and job[0] in DROPPABLE_JOBS:
+                    self.queue.queue.remove(job)
+                    self.queue.not_full.notify()
+                    break
+            else:
+                return False
+        self.counters['dropped'] += 1
+        logger.warning("[krill-hostevents] writer queue is full, dropped a %s job of %d lines", job[0], len(job[1]))
+        return True
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def run(self):
+        logger.info("[krill-hostevents] writer thread started, policy: %s", self.policy)
+        while True:
+            try:
+                job = self.queue.get(timeout=1)
+            except Queue.Empty:
+                if self.interrupted:
+                    break
+                continue
+
+            if job is None:
+                break
+
+            kind, payload = job
+            now = time.time()
+            try:
+                if payload is None:
+                    getattr(self.module, kind)()
+                else:
+                    getattr(self.module, kind)(payload)
+                self.counters['written'] += 1
+            except Exception, exp:
+                self.counters['errors'] += 1
+                logger.error("[krill-hostevents] writer exception in %s: %s", kind, str(exp))
+            logger.debug("[krill-hostevents] writer time for %s (%2.4f)", kind, time.time() - now)
+        logger.info("[krill-hostevents] writer thread stopped")
+
+    def stop(self, timeout=None):
+        """
+        Request the writer to stop once all the queued jobs are done
+        """
+        self.interrupted = True
+        self.queue.put(None)
+        self.join(timeout)
+
+    def log_counters(self):
+        logger.info("[krill-hostevents] writer queue: %d jobs, counters: %s", self.qsize(), self.counters)
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Helpers of the mongo-logs module tests: a module instance connected to an in-process mongomock DB
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mongomock
+
+from shinken.objects.module import Module
+
+from module.module import MongoLogs, CONNECTED
+
+
+class Brok(object):
+    """
+    Prepared brok stand-in
+    """
+
+    def __init__(self, type, data):
+        self.type = type
+        self.data = data
+
+    def prepare(self):
+        pass
+
+
+def module_instance(**conf):
+    """
+    Get a module instance configured with conf and connected to an empty mongomock DB
+    """
+    params = {'module_name': 'mongo-logs', 'module_type': 'mongo-logs'}
+    params.update(conf)
+    mod = MongoLogs(Module(params))
+    mod.con = mongomock.MongoClient()
+    mod.db = mod.con[mod.database]
+    mod.is_connected = CONNECTED
+    return mod
+
+
+def service_check_brok(host_name, service_description, state_id, last_chk, in_downtime=False):
+    return Brok('service_check_result', {
+        'host_name': host_name,
+        'service_description': service_description,
+        'state': ['OK', 'WARNING', 'CRITICAL', 'UNKNOWN'][state_id],
+        'state_id': state_id,
+        'last_state': 'OK',
+        'last_chk': last_chk,
+        'in_scheduled_downtime': in_downtime
+    })
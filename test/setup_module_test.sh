@@ -0,0 +1,14 @@
+#!/bin/bash
+# Install Shinken and the module tests requirements (see .travis.yml)
+
+set -e
+
+MODULE_DIR=$(cd "$(dirname "$0")/.." && pwd)
+
+cd ~
+if [ ! -d shinken ]; then
+    git clone --depth 1 --branch 2.4.3 https://github.com/naparuba/shinken.git
+fi
+
+pip install -r "$MODULE_DIR/requirements.txt"
+pip install -r "$MODULE_DIR/test/requirements.txt"
@@ -0,0 +1,255 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Daily availability tests on the daylight saving time change days
+"""
+
+import os
+import time
+import datetime
+import unittest
+
+from helpers import module_instance, service_check_brok
+
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from module.module import DISCONNECTED, CONNECTED
+
+from module.availability_events import daily_from_events, day_bounds, transition_event
+from module.availability_state import AvailabilityState
+
+# 23 hours and 25 hours days in Europe/Paris
+SHORT_DAY = '2015-03-29'
+LONG_DAY = '2015-10-25'
+
+
+class DSTTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'Europe/Paris'
+        time.tzset()
+
+    def tearDown(self):
+        if self.tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.tz
+        time.tzset()
+
+
+def record(hostname, service, day, state, timestamp):
+    day_ts, day_end = day_bounds(day)
+    return {
+        'hostname': hostname, 'service': service, 'day': day, 'day_ts': day_ts, 'is_downtime': '0',
+        'daily_0': 0, 'daily_1': 0, 'daily_2': 0, 'daily_3': 0, 'daily_4': day_end - day_ts,
+        'first_check_state': state, 'first_check_timestamp': timestamp,
+        'last_check_state': state, 'last_check_timestamp': timestamp
+    }
+
+
+def total(doc):
+    return sum([doc['daily_%d' % s] for s in range(5)])
+
+
+class TestRollover(DSTTestCase):
+
+    def rollover(self, availability_store):
+        mod = module_instance(availability_store=availability_store)
+        mod.services_cache['h1/'] = {'hostname': 'h1', 'service': ''}
+        mod.services_cache['h2/'] = {'hostname': 'h2', 'service': ''}
+        for hostname, day in (('h1', SHORT_DAY), ('h2', LONG_DAY)):
+            day_ts = day_bounds(day)[0]
+            mod.availability_cache['%s/_%s' % (hostname, day)] = record(hostname, '', day, 0, day_ts + 3600)
+        mod.availability_day = LONG_DAY
+        mod.rollover_availability()
+        return mod
+
+    def check(self, mod):
+        docs = dict([(doc['day'], doc) for doc in mod.db.availability.find({'day': {'$in': [SHORT_DAY, LONG_DAY]}})])
+        self.assertEqual(total(docs[SHORT_DAY]), 23 * 3600)
+        self.assertEqual(docs[SHORT_DAY]['daily_4'], 3600)
+        self.assertEqual(total(docs[LONG_DAY]), 25 * 3600)
+        self.assertEqual(docs[LONG_DAY]['daily_0'], 24 * 3600)
+
+        today = datetime.date.today().strftime('%Y-%m-%d')
+        day_ts, day_end = day_bounds(today)
+        for doc in mod.db.availability.find({'day': today}):
+            self.assertEqual(total(doc), day_end - day_ts)
+
+    def test_dict_store(self):
+        self.check(self.rollover('dict'))
+
+    def test_array_store(self):
+        self.check(self.rollover('array'))
+
+
+class TestDailyFromEvents(DSTTestCase):
+
+    def test_closed_day(self):
+        day_ts, day_end = day_bounds(LONG_DAY)
+        previous = {'timestamp': day_ts - 60, 'state': 0, 'downtime': '0'}
+        events = [{'timestamp': day_ts + 7200, 'state': 2, 'downtime': '0'}]
+        doc = daily_from_events('h1', '', LONG_DAY, previous, events, closed=True)
+        self.assertEqual((doc['daily_0'], doc['daily_2'], doc['daily_4']), (7200, 23 * 3600, 0))
+
+    def test_open_day(self):
+        day_ts, day_end = day_bounds(SHORT_DAY)
+        events = [{'timestamp': day_ts + 3600, 'state': 0, 'downtime': '0'}]
+        doc = daily_from_events('h1', '', SHORT_DAY, None, events)
+        self.assertEqual(total(doc), 23 * 3600)
+
+
+class TestAvailabilityState(DSTTestCase):
+
+    def test_unchecked(self):
+        state = AvailabilityState()
+        for hostname, day in (('h1', SHORT_DAY), ('h2', LONG_DAY), ('h3', '2015-06-10')):
+            state['%s/_%s' % (hostname, day)] = record(hostname, '', day, 0, day_bounds(day)[0])
+        docs = dict(state.items())
+        self.assertEqual(docs['h1/_' + SHORT_DAY]['daily_4'], 23 * 3600)
+        self.assertEqual(docs['h2/_' + LONG_DAY]['daily_4'], 25 * 3600)
+        self.assertEqual(docs['h3/_2015-06-10']['daily_4'], 24 * 3600)
+
+        # Single row path, without numpy
+        self.assertEqual(state.documents(['h2/_' + LONG_DAY])[0][1]['daily_4'], 25 * 3600)
+
+
+class TestTransitionEvents(unittest.TestCase):
+
+    def test_same_second(self):
+        mod = module_instance(availability_mode='events')
+        now = int(time.time())
+        mod.record_availability_event('h1', 'Load', 0, now, False)
+        mod.record_availability_event('h1', 'Load', 2, now + 1, False)
+        mod.record_availability_event('h1', 'Load', 0, now + 1, False)
+        mod.record_availability_event('h1', 'Load', 0, now + 1, True)
+        mod.flush_availability()
+        events = list(mod.db[mod.hav_events_collection].find({'hostname': 'h1'}))
+        self.assertEqual(len(events), 4)
+        self.assertEqual(len(set([event['_id'] for event in events])), 4)
+
+    def test_same_id(self):
+        event = transition_event('h1', 'Load', 1000, 2, False, (0, '0'))
+        self.assertEqual(event['_id'], 'h1/Load_1000_00_20')
+        self.assertEqual(transition_event('h1', 'Load', 1000, 2, False, (0, '0')), event)
+        self.assertEqual(transition_event('h1', '', 1000, 0, True)['_id'], 'h1/_1000_-_01')
+
+
+class TestWarmup(unittest.TestCase):
+
+    def setUp(self):
+        self.mod = module_instance()
+        self.day = datetime.date.today().strftime('%Y-%m-%d')
+        self.mod.availability_day = self.day
+        for service in ('Load', 'Disk'):
+            self.mod.services_cache['h1/' + service] = {'hostname': 'h1', 'service': service}
+        day_ts = day_bounds(self.day)[0]
+        self.mod.db.availability.insert_one(record('h1', 'Load', self.day, 1, day_ts))
+
+    def test_once_per_host(self):
+        self.mod.warmup_availability()
+        self.assertTrue('h1/Load_%s' % self.day in self.mod.availability_cache)
+        self.assertEqual(self.mod.availability_missing, set(['h1/Disk_%s' % self.day]))
+
+        # Another scheduler initial broks: the warmed up hosts are not loaded again
+        del self.mod.availability_cache['h1/Load_%s' % self.day]
+        self.mod.services_cache['h2/'] = {'hostname': 'h2', 'service': ''}
+        self.mod.warmup_availability()
+        self.assertFalse('h1/Load_%s' % self.day in self.mod.availability_cache)
+        self.assertEqual(self.mod.availability_warmed, set(['h1', 'h2']))
+        self.assertTrue('h2/_%s' % self.day in self.mod.availability_missing)
+
+    def test_missing_record_without_query(self):
+        self.mod.warmup_availability()
+        self.mod.is_connected = DISCONNECTED
+        now = int(time.time())
+        self.mod.record_availability('h1', 'Disk', service_check_brok('h1', 'Disk', 2, now))
+        data = self.mod.availability_cache['h1/Disk_%s' % self.day]
+        self.assertEqual((data['first_check_state'], data['first_check_timestamp']), (2, now))
+        self.assertFalse(self.mod.availability_missing)
+
+
+class TestClosedDaysCatchup(unittest.TestCase):
+
+    def setUp(self):
+        self.mod = module_instance(availability_mode='events')
+        today = datetime.date.today()
+        self.day = today.strftime('%Y-%m-%d')
+        self.days = [(today - datetime.timedelta(days=n)).strftime('%Y-%m-%d') for n in (2, 1)]
+        self.mod.availability_day = self.day
+        self.mod.services_cache['h1/Load'] = {'hostname': 'h1', 'service': 'Load'}
+
+    def test_days_ended_while_stopped(self):
+        # Critical since the day before yesterday noon, the module was stopped before yesterday
+        day_ts, day_end = day_bounds(self.days[0])
+        self.mod.db[self.mod.hav_events_collection].insert_one(
+            transition_event('h1', 'Load', day_ts + 43200, 2, False))
+        self.mod.warmup_availability()
+
+        closed = self.mod.db.availability.find_one({'hostname': 'h1', 'service': 'Load', 'day': self.days[0]})
+        self.assertEqual(closed['daily_4'], 43200)
+        self.assertEqual(closed['daily_2'], day_end - day_ts - 43200)
+        closed = self.mod.db.availability.find_one({'hostname': 'h1', 'service': 'Load', 'day': self.days[1]})
+        self.assertEqual(closed['daily_2'], total(closed))
+        self.assertEqual(total(closed), self.mod.day_seconds(self.days[1]))
+
+    def test_stored_days_kept(self):
+        day_ts = day_bounds(self.days[1])[0]
+        self.mod.db.availability.insert_one(record('h1', 'Load', self.days[1], 0, day_ts))
+        self.mod.db[self.mod.hav_events_collection].insert_one(
+            transition_event('h1', 'Load', day_ts + 3600, 2, False))
+        self.assertEqual(self.mod.materialize_closed_days(['h1'], self.day), 0)
+        closed = self.mod.db.availability.find_one({'hostname': 'h1', 'service': 'Load', 'day': self.days[1]})
+        self.assertEqual(closed['daily_4'], self.mod.day_seconds(self.days[1]))
+
+    def test_disabled(self):
+        self.mod.availability_catchup_days = 0
+        day_ts = day_bounds(self.days[1])[0]
+        self.mod.db[self.mod.hav_events_collection].insert_one(
+            transition_event('h1', 'Load', day_ts + 3600, 2, False))
+        self.assertEqual(self.mod.materialize_closed_days(['h1'], self.day), 0)
+        self.assertIsNone(self.mod.db.availability.find_one())
+
+
+class WriteConcernCollection(object):
+
+    def bulk_write(self, requests, ordered=True):
+        raise BulkWriteError({'writeErrors': [], 'writeConcernErrors': [{'code': 64, 'errmsg': 'timed out'}]})
+
+
+class TestStoreErrors(unittest.TestCase):
+
+    def test_write_concern_error(self):
+        mod = module_instance()
+        mod.hav_db_collection = WriteConcernCollection
+        q_day = {'hostname': 'h1', 'service': '', 'day': '2015-06-10'}
+        mod.store_availability(([ReplaceOne(q_day, dict(q_day), upsert=True)], set(['h1/_2015-06-10'])))
+        self.assertEqual(mod.is_connected, CONNECTED)
+        self.assertEqual(mod.availability_dirty, set(['h1/_2015-06-10']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Module state checkpoint tests
+"""
+
+import os
+import time
+import shutil
+import struct
+import tempfile
+import unittest
+
+from helpers import module_instance, service_check_brok
+
+from module.checkpoint import save_checkpoint, load_checkpoint, CHECKPOINT_HEADER, CHECKPOINT_MAGIC
+
+
+class TestCheckpointFile(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'state', 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        state = {'services_cache': {'h1/': {'hostname': 'h1', 'service': ''}}, 'logs_cache': [{'time': 1}]}
+        size = save_checkpoint(self.filename, state)
+        self.assertEqual(size, os.path.getsize(self.filename))
+        self.assertFalse(os.path.exists(self.filename + '.tmp'))
+        self.assertEqual(load_checkpoint(self.filename), state)
+
+    def test_missing(self):
+        self.assertEqual(load_checkpoint(self.filename), None)
+
+    def test_truncated(self):
+        save_checkpoint(self.filename, {'saved': 1})
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        for size in (CHECKPOINT_HEADER.size - 1, len(data) - 1):
+            with open(self.filename, 'wb') as f:
+                f.write(data[:size])
+            self.assertEqual(load_checkpoint(self.filename), None)
+
+    def test_corrupted(self):
+        save_checkpoint(self.filename, {'saved': 1})
+        with open(self.filename, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(chr(ord(last) ^ 0xff))
+        self.assertEqual(load_checkpoint(self.filename), None)
+
+    def test_other_version(self):
+        save_checkpoint(self.filename, {'saved': 1})
+        with open(self.filename, 'r+b') as f:
+            f.seek(len(CHECKPOINT_MAGIC))
+            f.write(struct.pack('>B', 99))
+        self.assertEqual(load_checkpoint(self.filename), None)
+
+
+class TestModuleState(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def module(self, **conf):
+        conf.setdefault('checkpoint_file', self.filename)
+        mod = module_instance(**conf)
+        mod.services_cache['h1/Load'] = {'hostname': 'h1', 'service': 'Load'}
+        return mod
+
+    def test_restore(self):
+        mod = self.module(availability_write_behind='1')
+        now = int(time.time())
+        mod.record_availability('h1', 'Load', service_check_brok('h1', 'Load', 2, now))
+        mod.cache_log({'time': now, 'type': 'INFO', 'host_name': '', 'service_description': '', 'message': 'line'})
+        mod.save_state(clean=True)
+
+        restored = self.module(availability_write_behind='1')
+        restored.services_cache = {}
+        self.assertTrue(restored.load_state())
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(restored.services_cache.keys(), ['h1/Load'])
+        self.assertEqual(restored.availability_dirty, mod.availability_dirty)
+        self.assertEqual([data['last_check_state'] for query, data in restored.availability_cache.items()], [2])
+        self.assertEqual([doc['message'] for doc in restored.logs_cache], ['line'])
+
+    def test_periodic_checkpoint_drops_lines(self):
+        mod = self.module()
+        mod.cache_log({'time': 1000, 'type': 'INFO', 'host_name': '', 'service_description': '', 'message': 'line'})
+        mod.save_state()
+
+        restored = self.module()
+        self.assertTrue(restored.load_state())
+        self.assertFalse(restored.logs_cache)
+
+    def test_store_changed(self):
+        mod = self.module(availability_store='dict')
+        mod.record_availability('h1', 'Load', service_check_brok('h1', 'Load', 1, int(time.time())))
+        mod.save_state(clean=True)
+
+        restored = self.module(availability_store='array')
+        self.assertTrue(restored.load_state())
+        self.assertEqual([data['last_check_state'] for query, data in restored.availability_cache.items()], [1])
+
+    def test_settings_changed(self):
+        for conf in ({'services_filter': 'Load'}, {'logs_filter': 'class:alert'}, {'availability_mode': 'events'}):
+            mod = self.module()
+            mod.record_availability('h1', 'Load', service_check_brok('h1', 'Load', 1, int(time.time())))
+            mod.save_state(clean=True)
+
+            restored = self.module(**conf)
+            restored.services_cache = {}
+            self.assertFalse(restored.load_state())
+            self.assertFalse(os.path.exists(self.filename))
+            self.assertFalse(restored.services_cache)
+            self.assertFalse(restored.availability_cache)
+
+    def test_no_settings(self):
+        # Checkpoint of a previous version
+        save_checkpoint(self.filename, {'saved': 1, 'clean': True, 'services_cache': {}})
+        self.assertFalse(self.module().load_state())
+
+    def test_no_checkpoint(self):
+        self.assertFalse(self.module().load_state())
+        self.assertFalse(self.module(checkpoint_file='').load_state())
+
+
+if __name__ == '__main__':
+    unittest.main()
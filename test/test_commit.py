@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Logs commit scheduling tests
+"""
+
+import time
+import unittest
+
+from helpers import module_instance
+
+from module.module import DISCONNECTED
+
+
+def log_line(timestamp, message='line'):
+    return {'time': timestamp, 'type': 'INFO', 'host_name': '', 'service_description': '', 'message': message}
+
+
+class TestCommitDue(unittest.TestCase):
+
+    def setUp(self):
+        self.mod = module_instance(commit_max_age='30', commit_threshold='100')
+
+    def test_buffered_time(self):
+        now = time.time()
+        self.assertFalse(self.mod.commit_due(now))
+
+        # Lines logged long ago (late broks, imported lines) are not due when received
+        self.mod.cache_log(log_line(int(now) - 3600))
+        self.assertFalse(self.mod.commit_due(now))
+        self.assertTrue(self.mod.commit_due(now + 31))
+
+    def test_threshold(self):
+        now = time.time()
+        for i in range(100):
+            self.mod.cache_log(log_line(int(now), str(i)))
+        self.assertTrue(self.mod.commit_due(now))
+
+    def test_committed(self):
+        self.mod.cache_log(log_line(int(time.time())))
+        self.mod.commit_logs()
+        self.assertFalse(self.mod.logs_cache)
+        self.assertEqual(self.mod.logs_cache_since, None)
+        self.assertEqual(self.mod.db.logs.count_documents({}), 1)
+
+    def test_requeued(self):
+        self.mod.is_connected = DISCONNECTED
+        self.mod.open = lambda *args, **kwargs: False
+        self.mod.cache_log(log_line(int(time.time())))
+        since = self.mod.logs_cache_since
+        self.mod.insert_logs([self.mod.logs_cache.popleft()])
+        self.assertEqual(len(self.mod.logs_cache), 1)
+        self.assertTrue(self.mod.logs_cache_since >= since)
+
+
+class TestDefaults(unittest.TestCase):
+
+    def test_enabled_by_default(self):
+        mod = module_instance(commit_period='20')
+        self.assertEqual((mod.commit_max_age, mod.commit_target_latency), (10, 500))
+
+        now = time.time()
+        mod.cache_log(log_line(int(now)))
+        self.assertTrue(mod.commit_due(now + 11))
+
+    def test_adapt_batch(self):
+        mod = module_instance(commit_volume='100')
+        mod.adapt_commit_batch(100, 0.1)
+        self.assertEqual(mod.commit_batch, 200)
+        mod.adapt_commit_batch(200, 0.6)
+        self.assertEqual(mod.commit_batch, 100)
+
+    def test_disabled(self):
+        mod = module_instance(commit_volume='100', commit_max_age='0', commit_target_latency='0')
+        mod.adapt_commit_batch(100, 0.1)
+        self.assertEqual(mod.commit_batch, 100)
+        mod.cache_log(log_line(0))
+        self.assertFalse(mod.commit_due(time.time() + 3600))
+
+
+if __name__ == '__main__':
+    unittest.main()
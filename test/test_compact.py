@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Compact schema tests: stored type codes and full/compact round trip
+"""
+
+import os
+import imp
+import unittest
+
+import helpers  # noqa, module path
+
+from module.log_line import parse_line, LINE_TYPES
+from module.compact import compact_document, expand_document, TYPE_CODES, TYPE_NAMES, COMPRESSED_OUTPUT
+
+bench_log_line = imp.load_source('bench_log_line', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                '..', 'bench', 'bench_log_line.py'))
+
+
+class TestTypeCodes(unittest.TestCase):
+
+    def test_frozen_codes(self):
+        # Codes of the stored documents, they must never change
+        self.assertEqual(TYPE_CODES['CURRENT HOST STATE'], 0)
+        self.assertEqual(TYPE_CODES['HOST ALERT'], 4)
+        self.assertEqual(TYPE_CODES['INFO'], 9)
+        self.assertEqual(TYPE_CODES['SERVICE ALERT'], 14)
+        self.assertEqual(TYPE_CODES['WARNING'], 20)
+
+    def test_unique_codes(self):
+        self.assertEqual(sorted(TYPE_CODES.values()), range(len(TYPE_CODES)))
+        self.assertEqual(len(TYPE_NAMES), len(TYPE_CODES))
+
+    def test_all_types_coded(self):
+        for line_type in LINE_TYPES:
+            self.assertTrue(line_type in TYPE_CODES, line_type)
+
+
+class TestRoundTrip(unittest.TestCase):
+
+    def test_sample_lines(self):
+        for line in bench_log_line.SAMPLE_LINES:
+            doc = parse_line(line)
+            compact = compact_document(doc)
+            self.assertEqual(expand_document(compact), doc, line)
+
+    def test_compact_fields(self):
+        doc = parse_line("[1441863951] SERVICE ALERT: srv-40;Service-9;CRITICAL;HARD;1;No such file or directory")
+        compact = compact_document(doc)
+        self.assertEqual(compact['y'], TYPE_CODES['SERVICE ALERT'])
+        self.assertEqual(compact['sy'], 1)
+        # Rebuilt from the other fields
+        self.assertFalse('m' in compact)
+
+    def test_compressed_output(self):
+        doc = parse_line("[1441863951] SERVICE ALERT: srv-40;Service-9;CRITICAL;HARD;1;" + 'x' * 500)
+        compact = compact_document(doc, compress_threshold=100)
+        self.assertTrue(COMPRESSED_OUTPUT in compact)
+        self.assertFalse('p' in compact)
+        self.assertEqual(expand_document(compact), doc)
+
+    def test_unknown_type(self):
+        doc = parse_line("[1441863951] UNKNOWN TYPE: some message")
+        self.assertEqual(expand_document(compact_document(doc)), doc)
+
+    def test_full_document_unchanged(self):
+        doc = parse_line("[1441863951] INFO: [broker-master] We have our schedulers")
+        self.assertEqual(expand_document(doc), doc)
+
+
+if __name__ == '__main__':
+    unittest.main()
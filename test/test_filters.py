@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Hosts/services and log lines filters tests
+"""
+
+import unittest
+
+from helpers import module_instance, Brok
+
+from module.filters import Filter, FilterError
+
+
+def obj(host_name, service_description='', business_impact=2, hostgroups=None):
+    return {'host_name': host_name, 'service_description': service_description,
+            'business_impact': business_impact, 'hostgroups': hostgroups or []}
+
+
+class TestFilter(unittest.TestCase):
+
+    def test_empty(self):
+        f = Filter('')
+        self.assertFalse(f)
+        self.assertTrue(f.match_object(obj('h1')))
+        self.assertFalse(f.match_object(obj('h1'), default=False))
+        self.assertTrue(f.match_type('HOST ALERT'))
+
+    def test_regexp(self):
+        f = Filter('srv-.*/Load, host:^web')
+        self.assertTrue(f.match_object(obj('srv-1', 'Load')))
+        self.assertTrue(f.match_object(obj('Web-1', 'Disk')))
+        self.assertFalse(f.match_object(obj('srv-1', 'Disk')))
+        self.assertFalse(f.match_object(obj('db-1')))
+
+    def test_exclude(self):
+        f = Filter('host:^srv, !Disk')
+        self.assertTrue(f.match_object(obj('srv-1', 'Load')))
+        self.assertFalse(f.match_object(obj('srv-1', 'Disk')))
+
+        # Only exclude rules: default decision
+        f = Filter('!Disk')
+        self.assertTrue(f.match_object(obj('srv-1', 'Load')))
+        self.assertFalse(f.match_object(obj('srv-1', 'Load'), default=False))
+
+    def test_business_impact(self):
+        f = Filter('bi:>=4')
+        self.assertTrue(f.needs_info)
+        self.assertTrue(f.match_object(obj('h1', business_impact=4)))
+        self.assertFalse(f.match_object(obj('h1', business_impact=3)))
+        self.assertFalse(f.match_object(obj('h1', business_impact=None)))
+
+        f = Filter('bp:1-2')
+        self.assertTrue(f.match_object(obj('h1', business_impact=1)))
+        self.assertFalse(f.match_object(obj('h1', business_impact=3)))
+
+        for op, matches in (('>2', [3]), ('<2', [1]), ('<=2', [1, 2]), ('=2', [2])):
+            f = Filter('bi:' + op)
+            self.assertEqual([bi for bi in range(1, 4) if f.match_object(obj('h1', business_impact=bi))], matches, op)
+
+    def test_hostgroups(self):
+        f = Filter('hg:linux')
+        self.assertTrue(f.needs_info)
+        self.assertTrue(f.match_object(obj('h1', hostgroups=['windows', 'linux'])))
+        self.assertFalse(f.match_object(obj('h1', hostgroups=['windows'])))
+
+    def test_line_rules(self):
+        f = Filter('class:alert|state, !type:FLAPPING')
+        self.assertFalse(f.has_object_rules())
+        self.assertTrue(f.match_type('HOST ALERT'))
+        self.assertTrue(f.match_type('CURRENT SERVICE STATE'))
+        self.assertFalse(f.match_type('HOST FLAPPING ALERT'))
+        self.assertFalse(f.match_type('SERVICE NOTIFICATION'))
+        # Object rules are not applied to the line types
+        self.assertTrue(f.match_object(obj('h1')))
+
+    def test_program_class(self):
+        f = Filter('class:program')
+        self.assertTrue(f.match_type('Warning'))
+
+    def test_errors(self):
+        self.assertRaises(FilterError, Filter, 'class:unknown')
+        self.assertRaises(FilterError, Filter, 'bi:high')
+        self.assertRaises(FilterError, Filter, 'host:(')
+
+
+class TestModuleFilters(unittest.TestCase):
+
+    def initial_status(self, mod, host_name, service_description, business_impact=2):
+        data = {'host_name': host_name, 'business_impact': business_impact, 'hostgroups': []}
+        if service_description:
+            data['service_description'] = service_description
+            mod.manage_initial_service_status_brok(Brok('initial_service_status', data))
+        else:
+            mod.manage_initial_host_status_brok(Brok('initial_host_status', data))
+
+    def test_services_filter(self):
+        mod = module_instance(services_filter='bi:>=4, Load')
+        self.initial_status(mod, 'h1', '')
+        self.initial_status(mod, 'h1', 'Load')
+        self.initial_status(mod, 'h1', 'Disk')
+        self.initial_status(mod, 'h1', 'Disk2', business_impact=5)
+        self.assertEqual(sorted(mod.services_cache), ['h1/', 'h1/Disk2', 'h1/Load'])
+
+    def test_wrong_filter(self):
+        mod = module_instance(services_filter='bi:high', logs_filter='class:nope')
+        self.assertFalse(mod.services_filter)
+        self.assertFalse(mod.logs_filter)
+
+    def test_logs_filter(self):
+        mod = module_instance(logs_filter='class:alert, !host:^test')
+        self.initial_status(mod, 'h1', '')
+        mod.manage_log_broks([Brok('log', {'log': line}) for line in [
+            "[1441863951] SERVICE ALERT: h1;Load;CRITICAL;HARD;1;load",
+            "[1441863951] SERVICE ALERT: test-1;Load;CRITICAL;HARD;1;load",
+            "[1441863952] SERVICE NOTIFICATION: admin;h1;Load;CRITICAL;notify-service;load",
+            "[1441863953] HOST ALERT: h1;DOWN;SOFT;1;ping",
+        ]])
+        self.assertEqual([(doc['type'], doc['host_name']) for doc in mod.logs_cache],
+                         [('SERVICE ALERT', 'h1'), ('HOST ALERT', 'h1')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Log files importer tests, against a mongomock collection
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mongomock
+
+import helpers  # noqa, module path
+
+from module import importer
+from module.partitions import partition_name, catalog_name, PARTITION_NONE, PARTITION_DAY
+from module.compact import expand_document, SCHEMA_FULL, SCHEMA_COMPACT
+from module.log_line import parse_line
+
+LINES = [
+    "[1441863951] SERVICE ALERT: srv-40;Service-9;CRITICAL;HARD;1;No such file or directory",
+    "[1441863951] INFO: [broker-master] We have our schedulers",
+    "[1441863952] HOST ALERT: pi2;DOWN;SOFT;1;check_ping: Invalid hostname/address - pi2",
+    "[1441863953] HOST ALERT: pi2;DOWN",
+    "[1441863954] CURRENT HOST STATE: pi2;UP;HARD;1;PING OK",
+]
+
+
+class TestImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.logfile = os.path.join(self.path, 'shinken.log')
+        with open(self.logfile, 'wb') as f:
+            f.write('\n'.join(LINES) + '\n')
+        self.client = mongomock.MongoClient()
+        self.collection = self.client.shinken.logs
+        self.get_client = importer.get_client
+        importer.get_client = lambda uri: self.client
+        self.options = {
+            'uri': 'mongomock://',
+            'database': 'shinken',
+            'collection': 'logs',
+            'partitioning': PARTITION_NONE,
+            'schema': SCHEMA_FULL,
+            'compress_output': 0,
+            'batch_size': 2,
+            'processes': 1,
+            'checkpoint': os.path.join(self.path, 'checkpoint'),
+            'dry_run': False
+        }
+
+    def tearDown(self):
+        importer.get_client = self.get_client
+        shutil.rmtree(self.path)
+
+    def test_import(self):
+        self.assertEqual(importer.run([self.logfile], self.options), 3)
+        self.assertEqual(self.collection.count_documents({}), 3)
+        self.assertTrue(importer.Checkpoint(self.options['checkpoint']).done(self.logfile))
+
+        # Already imported
+        self.assertEqual(importer.run([self.logfile], self.options), 0)
+        self.assertEqual(self.collection.count_documents({}), 3)
+
+    def test_dry_run(self):
+        self.options['dry_run'] = True
+        self.assertEqual(importer.run([self.logfile], self.options), 3)
+        self.assertFalse(os.path.exists(self.options['checkpoint']))
+        self.assertEqual(self.collection.count_documents({}), 0)
+
+        self.options['dry_run'] = False
+        self.assertEqual(importer.run([self.logfile], self.options), 3)
+        self.assertEqual(self.collection.count_documents({}), 3)
+
+    def test_resume_does_not_duplicate(self):
+        # Interrupted after inserting the first batch, before its checkpoint
+        filename, offset, stored, invalid, elapsed = importer.import_file(self.logfile, 0, self.options, self.client.shinken)
+        self.assertEqual((stored, invalid), (3, 1))
+        importer.import_file(self.logfile, 0, self.options, self.client.shinken)
+        self.assertEqual(self.collection.count_documents({}), 3)
+
+    def test_partitions(self):
+        self.options['partitioning'] = PARTITION_DAY
+        self.assertEqual(importer.run([self.logfile], self.options), 3)
+        self.assertEqual(self.collection.count_documents({}), 0)
+
+        name = partition_name('logs', 1441863951, PARTITION_DAY)
+        self.assertEqual(self.client.shinken[name].count_documents({}), 3)
+        self.assertEqual(self.client.shinken[catalog_name('logs')].count_documents({'name': name}), 1)
+        self.assertTrue(len(self.client.shinken[name].index_information()) > 1)
+
+    def test_compact_schema(self):
+        self.options['schema'] = SCHEMA_COMPACT
+        self.assertEqual(importer.run([self.logfile], self.options), 3)
+        docs = sorted([expand_document(doc) for doc in self.collection.find()], key=lambda doc: doc['message'])
+        self.assertTrue(all(['t' in doc for doc in self.collection.find()]))
+        for doc in docs:
+            del doc['_id']
+        expected = [parse_line(line) for line in LINES if 'INFO' not in line and line != LINES[3]]
+        self.assertEqual(docs, sorted(expected, key=lambda doc: doc['message']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Logs journal and journal replay tests
+"""
+
+import shutil
+import tempfile
+import unittest
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+from pymongo.results import InsertManyResult
+
+from helpers import module_instance
+
+from module.journal import LogsJournal
+from module.log_line import EMPTY_LINE
+from module.module import CONNECTED
+
+
+def log_line(i):
+    return {'time': 1000 + i, 'type': 'INFO', 'host_name': '', 'service_description': '', 'message': 'line %d' % i}
+
+
+class RejectingCollection(object):
+    """
+    Collection which fails the insertion of some documents with a write error code, by message
+    """
+
+    def __init__(self, collection, codes):
+        self.collection = collection
+        self.codes = codes
+
+    def insert_many(self, docs, ordered=True):
+        errors = []
+        inserted = []
+        for index, doc in enumerate(docs):
+            code = self.codes.get(doc['message'])
+            if code:
+                errors.append({'index': index, 'code': code, 'errmsg': 'rejected'})
+            else:
+                inserted.append(self.collection.insert_one(doc).inserted_id)
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'writeConcernErrors': [], 'nInserted': len(inserted)})
+        return InsertManyResult(inserted, True)
+
+
+class WriteConcernCollection(object):
+    """
+    Collection which inserts the documents but fails to satisfy the write concern
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.collection.insert_one(doc)
+        raise BulkWriteError({'writeErrors': [], 'writeConcernErrors': [{'code': 64, 'errmsg': 'waiting for replication timed out'}],
+                              'nInserted': len(docs)})
+
+
+class DisconnectedCollection(object):
+
+    def insert_many(self, docs, ordered=True):
+        raise AutoReconnect('not master')
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_resume_from_checkpoint(self):
+        journal = LogsJournal(self.path)
+        for i in range(5):
+            journal.append(log_line(i))
+        docs, position = journal.read_batch(3)
+        journal.commit(position)
+        journal.close()
+
+        journal = LogsJournal(self.path)
+        docs, position = journal.read_batch(10)
+        self.assertEqual([doc['time'] for doc in docs], [1003, 1004])
+        journal.commit(position)
+        self.assertFalse(journal.pending())
+        journal.close()
+
+    def test_segments_rotation(self):
+        journal = LogsJournal(self.path, segment_size=100)
+        for i in range(10):
+            journal.append(log_line(i))
+        self.assertTrue(journal.write_seq > 0)
+        docs, position = journal.read_batch(100)
+        self.assertEqual(len(docs), 10)
+        journal.close()
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.mod = module_instance(commit_volume='4')
+        self.mod.logs_journal = LogsJournal(self.path)
+        for i in range(10):
+            self.mod.logs_journal.append(log_line(i))
+
+    def tearDown(self):
+        self.mod.logs_journal.close()
+        shutil.rmtree(self.path)
+
+    def stored(self):
+        return sorted([doc['time'] for doc in self.mod.db.logs.find()])
+
+    def test_replay(self):
+        self.mod.replay_journal()
+        self.assertFalse(self.mod.logs_journal.pending())
+        self.assertFalse(self.mod.logs_journal_replaying)
+        self.assertEqual(self.stored(), range(1000, 1010))
+
+    def test_replay_twice_does_not_duplicate(self):
+        docs, position = self.mod.logs_journal.read_batch(4)
+        self.mod.db.logs.insert_many(docs)
+        self.mod.replay_journal()
+        self.assertFalse(self.mod.logs_journal.pending())
+        self.assertEqual(self.stored(), range(1000, 1010))
+
+    def test_rejected_lines_are_dropped(self):
+        codes = {'line 1': 121, 'line 6': 10334}
+        self.mod.logs_db_collection = lambda name: RejectingCollection(self.mod.db[name], codes)
+        self.mod.replay_journal()
+        self.assertFalse(self.mod.logs_journal.pending())
+        self.assertEqual(self.stored(), [1000, 1002, 1003, 1004, 1005, 1007, 1008, 1009])
+
+    def test_transient_errors_are_replayed(self):
+        codes = {'line 5': 11600}
+        self.mod.logs_db_collection = lambda name: RejectingCollection(self.mod.db[name], codes)
+        self.mod.replay_journal()
+        self.assertTrue(self.mod.logs_journal.pending())
+        self.assertEqual(self.stored(), [1000, 1001, 1002, 1003, 1004, 1006, 1007])
+
+        del self.mod.logs_db_collection
+        self.mod.replay_journal()
+        self.assertFalse(self.mod.logs_journal.pending())
+        self.assertEqual(self.stored(), range(1000, 1010))
+
+    def test_connection_errors_are_replayed(self):
+        self.mod.logs_db_collection = lambda name: DisconnectedCollection()
+        self.mod.replay_journal()
+        self.assertTrue(self.mod.logs_journal.pending())
+        self.assertEqual(self.stored(), [])
+
+    def test_write_concern_errors_are_replayed(self):
+        self.mod.logs_db_collection = lambda name: WriteConcernCollection(self.mod.db[name])
+        self.mod.replay_journal()
+        self.assertTrue(self.mod.logs_journal.pending())
+        self.assertEqual(self.mod.is_connected, CONNECTED)
+
+        del self.mod.logs_db_collection
+        self.mod.replay_journal()
+        self.assertFalse(self.mod.logs_journal.pending())
+        self.assertEqual(self.stored(), range(1000, 1010))
+
+    def test_write_concern_error_keeps_connection(self):
+        self.mod.logs_db_collection = lambda name: WriteConcernCollection(self.mod.db[name])
+        self.assertFalse(self.mod.insert_logs([log_line(20)]))
+        self.assertEqual(self.mod.is_connected, CONNECTED)
+        self.assertEqual(self.mod.breaker.failures, 0)
+        self.assertEqual(len(self.mod.logs_cache), 1)
+
+        del self.mod.logs_db_collection
+        self.mod.commit_logs()
+        self.assertEqual(self.mod.db.logs.count_documents({'time': 1020}), 1)
+
+    def test_compact_retry_does_not_duplicate(self):
+        mod = module_instance(logs_schema='compact', logs_deterministic_ids='0')
+        mod.logs_db_collection = lambda name: WriteConcernCollection(mod.db[name])
+        self.assertFalse(mod.insert_logs([dict(EMPTY_LINE, **log_line(20))]))
+        self.assertEqual(len(mod.logs_cache), 1)
+
+        del mod.logs_db_collection
+        mod.commit_logs()
+        self.assertFalse(mod.logs_cache)
+        self.assertEqual(mod.db.logs.count_documents({}), 1)
+
+    def test_journaled_while_pending(self):
+        self.mod.logs_cache_size = 100
+        self.mod.cache_log(log_line(10))
+        self.assertEqual(len(self.mod.logs_cache), 0)
+        self.mod.commit_logs()
+        self.assertEqual(self.stored(), range(1000, 1011))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Log lines parser tests: same documents as the former Logline parser
+"""
+
+import os
+import imp
+import unittest
+
+import helpers  # noqa, module path
+
+from module.log_line import (
+    parse_line, parse_many, parse_stored, line_host_name, Logline, InvalidLines, LoglineWrongFormat,
+    LOGCLASS_ALERT, LOGCLASS_STATE, LOGCLASS_NOTIFICATION
+)
+
+# The former parser and the sample lines of all the known line types are in the parser benchmark
+bench_log_line = imp.load_source('bench_log_line', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                '..', 'bench', 'bench_log_line.py'))
+
+
+class TestParseLine(unittest.TestCase):
+
+    def test_same_as_legacy_parser(self):
+        for line in bench_log_line.SAMPLE_LINES:
+            self.assertEqual(parse_line(line), bench_log_line.legacy_parse(line), line)
+
+    def test_logline(self):
+        for line in bench_log_line.SAMPLE_LINES:
+            self.assertEqual(Logline(line=line).as_dict(), parse_line(line))
+
+    def test_notification_state(self):
+        doc = parse_line("[1441863951] SERVICE NOTIFICATION: admin;srv-1;Load;DOWNTIMESTART (OK);notify;OK")
+        self.assertEqual(doc['state_type'], 'UNKNOWN')
+        self.assertEqual(doc['state'], 3)
+
+    def test_wrong_format(self):
+        self.assertRaises(LoglineWrongFormat, parse_line, "1441863951 SERVICE ALERT: x")
+
+    def test_missing_fields(self):
+        self.assertRaises(ValueError, parse_line, "[1441863951] SERVICE ALERT: srv-1;Load;CRITICAL")
+
+    def test_host_name(self):
+        self.assertEqual(line_host_name("[1441863951] SERVICE ALERT: srv-40;Service-9;CRITICAL;HARD;1;out"), 'srv-40')
+        self.assertEqual(line_host_name("[1441863951] HOST NOTIFICATION: admin;pi2;DOWN;notify;out"), 'pi2')
+        self.assertEqual(line_host_name("[1441863951] INFO: [broker-master] We have our schedulers"), '')
+
+
+class TestParseMany(unittest.TestCase):
+
+    def test_invalid_lines(self):
+        invalid = InvalidLines()
+        docs = list(parse_many([
+            "[1441863951] HOST ALERT: pi2;DOWN;SOFT;1;out",
+            "[1441863951] HOST ALERT: pi2;DOWN",
+            "[1441863951] HOST ALERT: pi2;SIDEWAYS;SOFT;1;out",
+            "[1441863951] UNKNOWN LINE TYPE: whatever",
+            "1441863951 HOST ALERT",
+        ], invalid))
+        self.assertEqual(len(docs), 1)
+        self.assertEqual(len(invalid), 4)
+        self.assertEqual(invalid.reasons, {'fields': 2, 'type': 1, 'format': 1})
+
+    def test_stored_lines(self):
+        docs = list(parse_stored(bench_log_line.SAMPLE_LINES))
+        self.assertTrue(docs)
+        for doc in docs:
+            self.assertTrue(doc['logclass'] in (LOGCLASS_ALERT, LOGCLASS_STATE, LOGCLASS_NOTIFICATION), doc)
+        self.assertFalse([doc for doc in docs if doc['type'] in ('INFO', 'EXTERNAL COMMAND', 'PASSIVE HOST CHECK')])
+
+    def test_accepted_types(self):
+        docs = list(parse_stored(bench_log_line.SAMPLE_LINES, accept_type=lambda type: type == 'HOST ALERT'))
+        self.assertEqual(set([doc['type'] for doc in docs]), set(['HOST ALERT']))
+        self.assertEqual(len(docs), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Internal metrics tests
+"""
+
+import unittest
+
+from helpers import module_instance, Brok
+
+from module.metrics import Metrics
+
+
+class TestTimers(unittest.TestCase):
+
+    def test_window(self):
+        metrics = Metrics(enabled=True)
+        metrics.timing('db.insert', 2.0)
+        metrics.timing('db.insert', 4.0)
+        timer = metrics.snapshot()['timers']['db.insert']
+        self.assertEqual((timer['count'], timer['mean'], timer['max']), (2, 3.0, 4.0))
+
+        # Reset at each snapshot
+        self.assertFalse(metrics.snapshot()['timers'])
+        metrics.timing('db.insert', 0.5)
+        timer = metrics.snapshot()['timers']['db.insert']
+        self.assertEqual((timer['count'], timer['mean'], timer['max']), (1, 0.5, 0.5))
+
+    def test_disabled(self):
+        metrics = Metrics()
+        metrics.timing('db.insert', 2.0)
+        metrics.gauge('queue', 1)
+        self.assertFalse(metrics.timers or metrics.gauges)
+
+
+class TestModuleGauges(unittest.TestCase):
+
+    def test_warmup_times(self):
+        mod = module_instance(metrics_period='60')
+        mod.dump_metrics()
+        self.assertFalse('availability.warmup_time' in mod.metrics.gauges)
+
+        mod.services_cache['host/'] = {'hostname': 'host', 'service': ''}
+        mod.manage_initial_broks_done_brok(Brok('initial_broks_done', {}))
+        mod.dump_metrics()
+        self.assertTrue(mod.metrics.gauges['availability.warmup_time'] >= 0)
+        self.assertTrue(mod.metrics.gauges['availability.steady_state_time'] >= mod.metrics.gauges['availability.warmup_time'])
+
+    def test_brok_saved_time(self):
+        mod = module_instance(metrics_period='60')
+        mod.brok_stats = {
+            'log': {'handled': 10, 'skipped': 0, 'prepare_time': 1.0},
+            'update_program_status': {'handled': 0, 'skipped': 30, 'prepare_time': 0.0},
+        }
+        mod.dump_metrics()
+        self.assertAlmostEqual(mod.metrics.gauges['broks.saved_time'], 3.0)
+
+
+class TestIndexesHealth(unittest.TestCase):
+
+    def test_created(self):
+        mod = module_instance(metrics_period='60')
+        mod.ensure_indexes()
+        mod.dump_metrics()
+        self.assertEqual(mod.metrics.gauges['indexes.missing'], 0)
+        self.assertEqual(mod.metrics.gauges['indexes.mismatched'], 0)
+        self.assertEqual(mod.metrics.gauges['indexes.created'], 4)
+
+        mod.ensure_indexes()
+        mod.dump_metrics()
+        self.assertEqual(mod.metrics.gauges['indexes.created'], 0)
+
+    def test_verified_only(self):
+        mod = module_instance(metrics_period='60', create_indexes='0')
+        mod.db.availability.create_index([('hostname', 1), ('service', 1), ('day', 1)])
+        mod.ensure_indexes()
+        mod.dump_metrics()
+        self.assertEqual(mod.metrics.gauges['indexes.missing'], 3)
+        self.assertEqual(mod.metrics.gauges['indexes.mismatched'], 1)
+        self.assertFalse([name for name in mod.db.logs.index_information() if name != '_id_'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Time partitioned logs collections tests
+"""
+
+import unittest
+
+import mongomock
+
+import helpers  # noqa, module path
+
+from module import partitions
+from module.partitions import LogsPartitions, partitions_for_range, partition_bounds, PARTITION_DAY, PARTITION_MONTH
+
+# 2015-09-10 local time
+TIMESTAMP = 1441863951
+
+
+class TestPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient().shinken
+
+    def test_split(self):
+        start, end = partition_bounds(TIMESTAMP, PARTITION_DAY)
+        batches = LogsPartitions('logs', PARTITION_DAY).split([{'time': start}, {'time': end - 1}, {'time': end}])
+        self.assertEqual(sorted([(name, len(docs)) for name, docs in batches.items()]),
+                         [('logs_2015_09_10', 2), ('logs_2015_09_11', 1)])
+        self.assertEqual(LogsPartitions('logs', PARTITION_MONTH).split([{'time': TIMESTAMP}]).keys(), ['logs_2015_09'])
+
+    def test_register_once(self):
+        p = LogsPartitions('logs', PARTITION_DAY)
+        self.assertTrue(p.register(self.db, 'logs_2015_09_10', TIMESTAMP, [('time', [('time', 1)], False)]))
+        self.assertFalse(p.register(self.db, 'logs_2015_09_10', TIMESTAMP))
+        self.assertEqual(partitions_for_range(self.db, 'logs', TIMESTAMP - 1, TIMESTAMP + 1), ['logs_2015_09_10'])
+        self.assertTrue('time' in self.db.logs_2015_09_10.index_information())
+
+    def test_dropped_by_another_process(self):
+        shard0 = LogsPartitions('logs', PARTITION_DAY)
+        shard1 = LogsPartitions('logs', PARTITION_DAY)
+        shard0.register(self.db, 'logs_2015_09_10', TIMESTAMP)
+        shard1.register(self.db, 'logs_2015_09_10', TIMESTAMP)
+        shard0.drop(self.db, 'logs_2015_09_10')
+
+        # Still known by the other process until it checks the catalog again
+        self.assertFalse(shard1.register(self.db, 'logs_2015_09_10', TIMESTAMP))
+        shard1.known['logs_2015_09_10'] -= partitions.KNOWN_RECHECK
+        self.assertTrue(shard1.register(self.db, 'logs_2015_09_10', TIMESTAMP))
+        self.assertEqual(partitions_for_range(self.db, 'logs', TIMESTAMP - 1, TIMESTAMP + 1), ['logs_2015_09_10'])
+
+        # Still in the catalog: not registered again
+        shard0.register(self.db, 'logs_2015_09_10', TIMESTAMP)
+        shard0.known['logs_2015_09_10'] -= partitions.KNOWN_RECHECK
+        self.assertFalse(shard0.register(self.db, 'logs_2015_09_10', TIMESTAMP))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Availability rebuild tests, against a mongomock DB
+"""
+
+import time
+import datetime
+import unittest
+
+import mongomock
+
+import helpers  # noqa, module path
+
+from module.rebuild import rebuild, UNCHECKED
+from module.partitions import LogsPartitions, PARTITION_DAY
+from module.compact import compact_document
+from module.log_line import EMPTY_LINE
+
+
+def timestamp(day, hour):
+    return int(time.mktime(datetime.datetime.combine(day, datetime.time(hour)).timetuple()))
+
+
+class TestRebuild(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient().shinken
+        self.day1 = datetime.date(2015, 6, 9)
+        self.day2 = datetime.date(2015, 6, 10)
+        self.day3 = datetime.date(2015, 6, 11)
+        self.db.logs.insert_many([
+            {'time': timestamp(self.day2, 6), 'type': 'HOST ALERT', 'host_name': 'h1', 'service_description': '', 'state': 1},
+            {'time': timestamp(self.day2, 18), 'type': 'HOST ALERT', 'host_name': 'h1', 'service_description': '', 'state': 0},
+            {'time': timestamp(self.day1, 12), 'type': 'CURRENT SERVICE STATE', 'host_name': 'h2',
+             'service_description': 'Load', 'state': 'WARNING'},
+            {'time': timestamp(self.day2, 12), 'type': 'SERVICE ALERT', 'host_name': 'h2',
+             'service_description': 'Load', 'state': 2},
+        ])
+
+    def documents(self):
+        return dict([((doc['hostname'], doc['service'], doc['day']), doc) for doc in self.db.availability.find()])
+
+    def test_rebuild(self):
+        self.assertEqual(rebuild(self.db, 'logs', 'availability', self.day1, self.day3), 5)
+        docs = self.documents()
+
+        # No document before the first event of a series
+        self.assertFalse(('h1', '', '2015-06-09') in docs)
+        for doc in docs.values():
+            self.assertNotEqual(doc['first_check_state'], UNCHECKED)
+            self.assertNotEqual(doc['last_check_state'], UNCHECKED)
+            self.assertEqual(sum([doc['daily_%d' % s] for s in range(5)]), 86400)
+
+        doc = docs[('h1', '', '2015-06-10')]
+        self.assertEqual((doc['daily_0'], doc['daily_1'], doc['daily_4']), (6 * 3600, 12 * 3600, 6 * 3600))
+        self.assertEqual((doc['first_check_state'], doc['first_check_timestamp']), (1, timestamp(self.day2, 6)))
+        self.assertEqual((doc['last_check_state'], doc['last_check_timestamp']), (0, timestamp(self.day2, 18)))
+
+        # State carried to the next day
+        doc = docs[('h1', '', '2015-06-11')]
+        self.assertEqual((doc['daily_0'], doc['daily_4']), (86400, 0))
+        self.assertEqual((doc['first_check_state'], doc['first_check_timestamp']), (0, timestamp(self.day3, 0)))
+
+        doc = docs[('h2', 'Load', '2015-06-09')]
+        self.assertEqual((doc['daily_1'], doc['daily_4']), (12 * 3600, 12 * 3600))
+        doc = docs[('h2', 'Load', '2015-06-10')]
+        self.assertEqual((doc['daily_1'], doc['daily_2']), (12 * 3600, 12 * 3600))
+
+    def test_keep_existing(self):
+        self.db.availability.insert_one({'hostname': 'h1', 'service': '', 'day': '2015-06-10', 'daily_0': 1})
+        rebuild(self.db, 'logs', 'availability', self.day1, self.day3)
+        self.assertEqual(self.documents()[('h1', '', '2015-06-10')]['daily_0'], 1)
+
+        rebuild(self.db, 'logs', 'availability', self.day1, self.day3, overwrite=True)
+        self.assertEqual(self.documents()[('h1', '', '2015-06-10')]['daily_0'], 6 * 3600)
+
+    def test_partitions(self):
+        # Same logs, stored in day partitions
+        docs = list(self.db.logs.find({}, {'_id': 0}))
+        self.db.logs.drop()
+        partitions = LogsPartitions('logs', PARTITION_DAY)
+        for name, batch in partitions.split(docs).items():
+            partitions.register(self.db, name, batch[0]['time'])
+            self.db[name].insert_many(batch)
+
+        self.assertEqual(rebuild(self.db, 'logs', 'availability', self.day1, self.day3), 5)
+        doc = self.documents()[('h1', '', '2015-06-10')]
+        self.assertEqual((doc['daily_0'], doc['daily_1'], doc['daily_4']), (6 * 3600, 12 * 3600, 6 * 3600))
+
+    def test_compact_schema(self):
+        docs = list(self.db.logs.find({}, {'_id': 0}))
+        self.db.logs.drop()
+        for doc in docs:
+            full = EMPTY_LINE.copy()
+            full.update(doc)
+            self.db.logs.insert_one(compact_document(full))
+
+        self.assertEqual(rebuild(self.db, 'logs', 'availability', self.day1, self.day3), 5)
+        docs = self.documents()
+        doc = docs[('h1', '', '2015-06-10')]
+        self.assertEqual((doc['daily_0'], doc['daily_1'], doc['daily_4']), (6 * 3600, 12 * 3600, 6 * 3600))
+        doc = docs[('h2', 'Load', '2015-06-10')]
+        self.assertEqual((doc['daily_1'], doc['daily_2']), (12 * 3600, 12 * 3600))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Sharded ingestion routing tests, without worker processes
+"""
+
+import Queue
+import unittest
+
+from helpers import Brok
+
+from module.shards import ShardPool, shard_of
+
+
+class AliveProcess(object):
+
+    def is_alive(self):
+        return True
+
+
+class DeadProcess(object):
+    exitcode = -9
+
+    def is_alive(self):
+        return False
+
+
+def initial_status(host_name, service_description=''):
+    data = {'host_name': host_name, 'business_impact': 2, 'hostgroups': ['linux'], 'perf_data': 'x' * 1000}
+    if service_description:
+        data['service_description'] = service_description
+        return Brok('initial_service_status', data)
+    return Brok('initial_host_status', data)
+
+
+class TestShardPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ShardPool(None, 2)
+        self.started = []
+        self.pool.start_shard = self.started.append
+        # Two hosts in different shards
+        self.hosts = {}
+        for i in range(20):
+            self.hosts.setdefault(shard_of('host-%d' % i, 2), 'host-%d' % i)
+
+    def queued(self, shard):
+        broks = []
+        while True:
+            try:
+                broks.extend(self.pool.queues[shard].get(timeout=0.2))
+            except Queue.Empty:
+                return broks
+
+    def test_route(self):
+        host = self.hosts[1]
+        self.pool.route([initial_status(host), Brok('log', {'log': '[1441863951] INFO: info'}),
+                         Brok('initial_broks_done', {'instance_id': 0})])
+        self.assertEqual([b.type for b in self.queued(0)], ['log', 'initial_broks_done'])
+        self.assertEqual([b.type for b in self.queued(1)], ['initial_host_status', 'initial_broks_done'])
+
+    def test_restarted_shard_gets_initial_status(self):
+        host0, host1 = self.hosts[0], self.hosts[1]
+        self.pool.route([initial_status(host1, 'Load'), initial_status(host1), initial_status(host0),
+                         Brok('initial_broks_done', {'instance_id': 0})])
+        # Initial status sent again by a scheduler
+        self.pool.route([initial_status(host1)])
+        self.queued(0)
+        self.queued(1)
+
+        self.pool.processes = [AliveProcess(), DeadProcess()]
+        self.pool.check()
+        self.assertEqual(self.started, [1])
+        self.assertFalse(self.queued(0))
+        self.assertEqual([(b.type, b.data.get('host_name')) for b in self.queued(1)],
+                         [('initial_host_status', host1), ('initial_service_status', host1), ('initial_broks_done', None)])
+
+    def test_kept_fields(self):
+        host = self.hosts[0]
+        self.pool.route([initial_status(host, 'Load')])
+        kept = self.pool.initial[0][(host, 'Load')]
+        self.assertEqual(kept.type, 'initial_service_status')
+        self.assertEqual(kept.data, {'host_name': host, 'service_description': 'Load', 'business_impact': 2,
+                                     'hostgroups': ['linux']})
+
+
+if __name__ == '__main__':
+    unittest.main()
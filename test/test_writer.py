@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2015:
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Background writer queue policies and writer thread hand-over tests
+"""
+
+import time
+import shutil
+import tempfile
+import unittest
+
+from helpers import module_instance, service_check_brok
+
+from module.module import DISCONNECTED
+from module.writer import LogsWriter, WRITER_DROP_OLDEST, WRITER_SPILL
+from module.journal import LogsJournal
+
+
+def run_queued(writer):
+    """
+    Run the queued jobs of a writer which is not started
+    """
+    while writer.qsize():
+        kind, payload = writer.queue.get_nowait()
+        if payload is None:
+            getattr(writer.module, kind)()
+        else:
+            getattr(writer.module, kind)(payload)
+
+
+class TestDropOldest(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = LogsWriter(None, 2, WRITER_DROP_OLDEST)
+
+    def kinds(self):
+        return [job[0] for job in self.writer.queue.queue]
+
+    def test_drops_oldest_logs(self):
+        self.writer.put('insert_logs', [{'time': 1}])
+        self.writer.put('insert_logs', [{'time': 2}])
+        self.assertTrue(self.writer.put('insert_logs', [{'time': 3}]))
+        self.assertEqual([job[1][0]['time'] for job in self.writer.queue.queue], [2, 3])
+        self.assertEqual(self.writer.counters['dropped'], 1)
+
+    def test_never_drops_other_jobs(self):
+        self.writer.put('store_availability', ([], set()))
+        self.writer.put('insert_logs', [{'time': 1}])
+        self.assertTrue(self.writer.put('replay_journal'))
+        self.assertEqual(self.kinds(), ['store_availability', 'replay_journal'])
+        self.assertFalse(self.writer.drop_oldest())
+        self.assertEqual(self.writer.counters['dropped'], 1)
+
+    def test_no_droppable_job_blocks(self):
+        self.writer.put('rotate_logs')
+        self.writer.put('store_availability', ([], set()))
+        self.assertFalse(self.writer.drop_oldest())
+        self.assertEqual(self.kinds(), ['rotate_logs', 'store_availability'])
+
+
+class TestSpill(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_refuses_other_than_control_jobs(self):
+        writer = LogsWriter(None, 1, WRITER_SPILL)
+        writer.put('insert_logs', [{'time': 1}])
+        self.assertFalse(writer.put('insert_logs', [{'time': 2}]))
+        self.assertFalse(writer.put('store_availability', ([], set())))
+        self.assertEqual(writer.counters['refused'], 2)
+
+    def test_journaled_lines_in_order(self):
+        mod = module_instance(commit_volume='2', logs_cache_size='3')
+        mod.logs_journal = LogsJournal(self.path)
+        mod.writer = LogsWriter(mod, 1, WRITER_SPILL)
+        for i in range(3):
+            mod.cache_log({'time': 1000 + i, 'type': 'INFO', 'host_name': '', 'service_description': '', 'message': str(i)})
+        # First batch queued, second one refused and kept in the cache
+        mod.commit_logs()
+        self.assertEqual([doc['time'] for doc in mod.logs_cache], [1002])
+        for i in range(3, 6):
+            mod.cache_log({'time': 1000 + i, 'type': 'INFO', 'host_name': '', 'service_description': '', 'message': str(i)})
+        # The cache overflows in the journal
+        self.assertEqual([doc['time'] for doc in mod.logs_cache], [1002, 1003, 1004])
+        self.assertTrue(mod.logs_journal.pending())
+
+        # Cached lines first, then the journaled ones
+        while mod.logs_cache or mod.logs_journal.pending() or mod.writer.qsize():
+            run_queued(mod.writer)
+            mod.commit_logs()
+        run_queued(mod.writer)
+        self.assertEqual([doc['time'] for doc in mod.db.logs.find()], range(1000, 1006))
+        mod.logs_journal.close()
+
+    def test_refused_lines_are_kept(self):
+        mod = module_instance(commit_volume='2')
+        mod.writer = LogsWriter(mod, 1, WRITER_SPILL)
+        for i in range(5):
+            mod.cache_log({'time': 1000 + i, 'type': 'INFO', 'host_name': '', 'service_description': '', 'message': str(i)})
+        mod.commit_logs()
+        self.assertEqual(mod.writer.qsize(), 1)
+        self.assertEqual([doc['time'] for doc in mod.logs_cache], [1002, 1003, 1004])
+
+
+class TestWriterHandOver(unittest.TestCase):
+
+    def setUp(self):
+        self.mod = module_instance(availability_write_behind='1')
+        self.mod.writer = LogsWriter(self.mod, 10)
+        self.mod.services_cache['host/svc'] = {'hostname': 'host', 'service': 'svc'}
+
+    def test_queued_records_are_copies(self):
+        now = int(time.time())
+        self.mod.record_availability('host', 'svc', service_check_brok('host', 'svc', 0, now))
+        self.mod.flush_availability()
+        self.mod.record_availability('host', 'svc', service_check_brok('host', 'svc', 2, now + 1))
+        run_queued(self.mod.writer)
+
+        stored = self.mod.db[self.mod.hav_collection].find_one({'hostname': 'host'})
+        self.assertEqual(stored['last_check_state'], 0)
+        self.assertEqual(stored['last_check_timestamp'], now)
+
+    def test_failed_store_marks_dirty_again(self):
+        self.mod.record_availability('host', 'svc', service_check_brok('host', 'svc', 0, int(time.time())))
+        self.mod.flush_availability()
+        self.assertFalse(self.mod.availability_dirty)
+
+        self.mod.is_connected = DISCONNECTED
+        self.mod.db_probing = True
+        run_queued(self.mod.writer)
+        self.assertEqual(len(self.mod.availability_dirty), 1)
+
+    def test_replay_job_is_not_flagged_when_queued(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.mod.logs_journal = LogsJournal(path)
+            self.mod.logs_journal.append({'time': 1000, 'type': 'INFO', 'message': 'spilled'})
+            self.mod.commit_logs()
+            self.assertFalse(self.mod.logs_journal_replaying)
+            self.assertEqual(self.mod.writer.qsize(), 1)
+
+            run_queued(self.mod.writer)
+            self.assertFalse(self.mod.logs_journal.pending())
+            self.assertEqual(self.mod.db.logs.count_documents({}), 1)
+            self.mod.logs_journal.close()
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    unittest.main()